@@ -191,6 +191,26 @@ STATICFILES_DIRS = [  # Include additional static files
 
 FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800
 
+# TTS inference backend
+# - "native": load F5-TTS in the Django process (one model per worker process) and synthesize in-process
+# - "gradio": forward requests to the Gradio app (infer_basic_tts.py) through gradio_client
+TTS_INFERENCE_BACKEND = os.environ.get("TTS_INFERENCE_BACKEND", "native")
+
+# TTS models kept loaded per process by the native backend, switching between them needs no reload.
+# Least recently used ones beyond the limits are offloaded to CPU memory (up to its budget), else dropped.
+TTS_MAX_RESIDENT_MODELS = int(os.environ.get("TTS_MAX_RESIDENT_MODELS", 2))
+TTS_MODEL_DEVICE_BUDGET_GB = float(os.environ.get("TTS_MODEL_DEVICE_BUDGET_GB", 0)) or None  # 0 for no limit
+TTS_MODEL_CPU_BUDGET_GB = float(os.environ.get("TTS_MODEL_CPU_BUDGET_GB", 0))
+
+# Max TTS jobs (/tts/generate_async) synthesizing at once per process, independent of the HTTP worker count
+TTS_MAX_GPU_JOBS = int(os.environ.get("TTS_MAX_GPU_JOBS", 1))
+# Running jobs without heartbeat for that long were left by a dead process and are queued again
+TTS_JOB_LEASE_SECONDS = int(os.environ.get("TTS_JOB_LEASE_SECONDS", 300))
+# Hosts job callbacks may be sent to (comma separated, ".example.com" for its subdomains), none allowed if empty
+TTS_CALLBACK_ALLOWED_HOSTS = [
+    host.strip() for host in os.environ.get("TTS_CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
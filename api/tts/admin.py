@@ -7,7 +7,9 @@ from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from unfold.admin import ModelAdmin
 
+from . import jobs
 from .models.config.models import TTSConfiguration
+from .models.job.models import TTSJob
 from .models.speaker.models import Speaker, ReferenceAudio
 from .models.tts.models import UsageLog
 
@@ -258,6 +260,12 @@ class UsageLogAdmin(admin.ModelAdmin):
             readonly_fields += ['speaker', 'custom_reference', 'generated_text', ]
         return readonly_fields
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # synthesize in the job worker pool instead of holding the admin request
+        if not change:
+            jobs.submit(obj)
+
     def formatted_timestamp(self, obj):
         return obj.timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
@@ -322,3 +330,19 @@ class UsageLogAdmin(admin.ModelAdmin):
         return "❌"
 
     spectrogram_viewer.short_description = "Spectrogram Preview"
+
+
+# --------------------------------------
+# TTSJob
+# --------------------------------------
+
+@admin.register(TTSJob)
+class TTSJobAdmin(ModelAdmin):
+    list_display = ['uuid', 'status', 'usage_log', 'created_at', 'started_at', 'finished_at']
+    list_display_links = ['uuid']
+    list_filter = ['status']
+    readonly_fields = ['uuid', 'status', 'usage_log', 'callback_url', 'error', 'created_at', 'started_at',
+                       'finished_at']
+
+    def has_add_permission(self, request):
+        return False
@@ -2,6 +2,7 @@ from typing import Dict
 
 from ninja import Router
 
+from ..inference import model_registry_stats, preload_model
 from ..models.config.models import TTSConfiguration
 from ..models.config.schema import TTSConfigurationOut, TTSConfigurationIn
 
@@ -34,5 +35,29 @@ def update_configuration(request, data: TTSConfigurationIn):
         config.vocab = data.vocab
         config.config = data.config
         config.save()
-    # Optionally, trigger actions such as reloading the TTS model here.
+    # saving switches to the new model once it is loaded in the background
     return config
+
+
+@router.get("/models", response={200: Dict, 501: Dict})
+def get_resident_models(request):
+    """
+    List the models resident in this worker process (on device or offloaded to CPU), and those loading.
+    """
+    try:
+        return model_registry_stats()
+    except NotImplementedError as e:
+        return 501, {"message": str(e)}
+
+
+@router.post("/preload", response={202: Dict, 501: Dict})
+def preload(request, data: TTSConfigurationIn):
+    """
+    Load a model in the background without switching to it, so that a later switch to it is instant.
+    - Expects the same JSON body as PUT /config
+    """
+    try:
+        preload_model(data.checkpoint, data.vocab, data.config)
+    except NotImplementedError as e:
+        return 501, {"message": str(e)}
+    return 202, {"message": f"Preloading {data.checkpoint}"}
@@ -1,13 +1,18 @@
 from typing import Dict
+from uuid import UUID
 
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.http import StreamingHttpResponse
 from django.urls import reverse
 from filer.models.filemodels import File as FilerFile
 from ninja import Router, UploadedFile, File, Form
 
+from .. import jobs
+from ..models.job.models import TTSJob
+from ..models.job.schema import GenerateAsyncTTSInput, GenerateAsyncCustomTTSInput, TTSJobOutput
 from ..models.speaker.models import Speaker, ReferenceAudio
-from ..models.tts.models import UsageLog, save_filer_file
+from ..models.tts.models import UsageLog
 from ..models.tts.schema import GenerateTTSOutput, GenerateTTSInput, GenerateCustomTTSInput
 
 router = Router()
@@ -15,6 +20,66 @@ router = Router()
 domain = "https://a100.ap.ngrok.io"
 
 
+def get_speaker(speaker_id):
+    """Speaker of speaker_id, or (400, message) response if it does not exist."""
+    try:
+        return Speaker.objects.get(speaker_id=speaker_id), None
+    except Speaker.DoesNotExist:
+        return None, (400, {
+            "message": f"Invalid speaker_id '{speaker_id}'. Must be one of: {list(Speaker.objects.values_list('speaker_id', flat=True))}"})
+
+
+def check_callback_url(callback_url):
+    """(400, message) response if callback_url is given and not allowed, else None."""
+    if not callback_url:
+        return None
+    try:
+        jobs.validate_callback_url(callback_url)
+    except ValueError as e:
+        return 400, {"message": str(e)}
+    return None
+
+
+def save_reference(reference_text, reference_audio: UploadedFile):
+    """Save the uploaded reference_audio file and create ReferenceAudio instance"""
+    relative_path = default_storage.save(f"speakers/{reference_audio.name}", ContentFile(reference_audio.read()))
+    absolute_path = default_storage.path(relative_path)
+    with open(absolute_path, "rb") as f:
+        django_file = ContentFile(f.read(), name=relative_path)
+        filer_file = FilerFile.objects.create(
+            original_filename=reference_audio.name,
+            file=django_file
+        )
+    return ReferenceAudio.objects.create(text=reference_text, audio=filer_file)
+
+
+def usage_log_output(usage_log):
+    return GenerateTTSOutput(
+        message="TTS generated successfully",
+        audio=domain + usage_log.generated_audio.url,
+        enhanced_audio=domain + usage_log.enhanced_audio.url,
+        spectrogram=domain + usage_log.spectrogram.url,
+        usage_log_id=usage_log.id,
+        usage_log_url=domain + reverse('admin:tts_usagelog_change', args=(usage_log.id,))
+    )
+
+
+def job_output(job):
+    from core.urls import api
+    status_url = domain + reverse(f'{api.urls_namespace}:get_job', args=(job.pk,))
+    return TTSJobOutput(
+        job_id=str(job.pk),
+        status=job.status,
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        status_url=status_url,
+        result_url=status_url + "/result",
+        result=usage_log_output(job.usage_log) if job.status == TTSJob.STATUS_SUCCEEDED else None,
+    )
+
+
 @router.post("/generate", response={200: GenerateTTSOutput, 400: Dict, 500: Dict})
 def generate(request, data: GenerateTTSInput):
     """
@@ -22,92 +87,124 @@ def generate(request, data: GenerateTTSInput):
     - Expects a JSON body with prompt_text and speaker_id.
     """
     # Validate speaker_id against database
-    try:
-        speaker = Speaker.objects.get(speaker_id=data.speaker_id)
-    except Speaker.DoesNotExist:
-        return 400, {
-            "message": f"Invalid speaker_id '{data.speaker_id}'. Must be one of: {list(Speaker.objects.values_list('speaker_id', flat=True))}"}
+    speaker, error = get_speaker(data.speaker_id)
+    if error:
+        return error
 
     try:
-        from ..infer_gradio_api import basic_tts
-        audio, spectrogram, _, enhanced_audio = basic_tts(
-            ref_audio_input=speaker.reference.audio.file.path,
-            ref_text_input=speaker.reference.text,
-            gen_text_input=data.prompt_text,
-            remove_silence=False,
-            cross_fade_duration_slider=0.15,
-            nfe_slider=32,
-            speed_slider=1,
-            verbose=False
-        )
-
-        usage_log = UsageLog.objects.create(
-            speaker=speaker,
-            custom_reference=None,
-            generated_text=data.prompt_text,
-            generated_audio=save_filer_file(audio, folder="tts_generated"),
-            enhanced_audio=save_filer_file(enhanced_audio, folder="tts_generated"),
-            spectrogram=save_filer_file(spectrogram, folder="tts_spectrograms"),
-        )
-
-        return GenerateTTSOutput(
-            message="TTS generated successfully",
-            audio=domain + usage_log.generated_audio.url,
-            enhanced_audio=domain + usage_log.enhanced_audio.url,
-            spectrogram=domain + usage_log.spectrogram.url,
-            usage_log_id=usage_log.id,
-            usage_log_url=domain + reverse('admin:tts_usagelog_change', args=(usage_log.id,))
-        )
+        usage_log = UsageLog(speaker=speaker, custom_reference=None, generated_text=data.prompt_text)
+        usage_log.synthesize()
+        usage_log.save()
+        return usage_log_output(usage_log)
     except Exception as e:
         return 500, {"message": str(e)}
 
 
-@router.post("/generate_vc", response=GenerateTTSOutput)
+@router.post("/generate_vc", response={200: GenerateTTSOutput, 500: Dict})
 def generate_with_reference(request, data: Form[GenerateCustomTTSInput], reference_audio: UploadedFile = File(...)):
     """
     Generates speech with Custom Reference using F5-TTS.
     - Expects a JSON body with prompt_text, reference_text, and reference_audio.
     """
-    # Save the uploaded reference_audio file and create ReferenceAudio instance
-    relative_path = default_storage.save(f"speakers/{reference_audio.name}", ContentFile(reference_audio.read()))
-    absolute_path = default_storage.path(relative_path)
-    with open(absolute_path, "rb") as f:
-        django_file = ContentFile(f.read(), name=relative_path)
-        filer_file = FilerFile.objects.create(
-            original_filename=reference_audio.name,
-            file=django_file
-        )
-    reference = ReferenceAudio.objects.create(text=data.reference_text, audio=filer_file)
+    reference = save_reference(data.reference_text, reference_audio)
 
     try:
-        from ..infer_gradio_api import basic_tts
-        audio, spectrogram, _, enhanced_audio = basic_tts(
-            ref_audio_input=reference.audio.file.path,
-            ref_text_input=reference.text,
+        usage_log = UsageLog(speaker=None, custom_reference=reference, generated_text=data.prompt_text)
+        usage_log.synthesize()
+        usage_log.save()
+        return usage_log_output(usage_log)
+    except Exception as e:
+        return 500, {"message": str(e)}
+
+
+@router.post("/generate_stream", response={400: Dict, 501: Dict})
+def generate_stream(request, data: GenerateTTSInput):
+    """
+    Streams speech generated using F5-TTS as chunked audio/wav (16-bit PCM, mono, 24 kHz).
+    - Expects a JSON body with prompt_text and speaker_id.
+    - The WAV header is sent first with an open length, PCM frames follow as each text chunk is vocoded.
+    - If the client disconnects, the remaining text chunks are cancelled.
+    """
+    speaker, error = get_speaker(data.speaker_id)
+    if error:
+        return error
+
+    from ..inference import stream_tts
+    try:
+        stream = stream_tts(
+            ref_audio_input=speaker.reference.audio.file.path,
+            ref_text_input=speaker.reference.text,
             gen_text_input=data.prompt_text,
-            remove_silence=False,
             cross_fade_duration_slider=0.15,
             nfe_slider=32,
             speed_slider=1,
-            verbose=False
         )
+    except NotImplementedError as e:
+        return 501, {"message": str(e)}
 
-        usage_log = UsageLog.objects.create(
-            speaker=None,
-            custom_reference=reference,
-            generated_text=data.prompt_text,
-            generated_audio=save_filer_file(audio, folder="tts_generated"),
-            enhanced_audio=save_filer_file(enhanced_audio, folder="tts_generated"),
-            spectrogram=save_filer_file(spectrogram, folder="tts_spectrograms"),
-        )
+    # the server closes the response when the client goes away, which closes the generator and stops synthesis
+    response = StreamingHttpResponse(stream, content_type="audio/wav")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-        return GenerateTTSOutput(
-            message="TTS generated successfully",
-            audio=domain + usage_log.generated_audio.url,
-            enhanced_audio=domain + usage_log.enhanced_audio.url,
-            spectrogram=domain + usage_log.spectrogram.url,
-            usage_log_id=usage_log.id,
-            usage_log_url=domain + reverse('admin:tts_usagelog_change', args=(usage_log.id,))
-        )
-    except Exception as e:
-        return 500, {"message": str(e)}
+
+@router.post("/generate_async", response={202: TTSJobOutput, 400: Dict})
+def generate_async(request, data: GenerateAsyncTTSInput):
+    """
+    Queues speech generation using F5-TTS and returns a job immediately.
+    - Expects a JSON body with prompt_text, speaker_id and an optional callback_url.
+    - Poll status_url, or get the job status POSTed to callback_url once it succeeds or fails.
+    """
+    speaker, error = get_speaker(data.speaker_id)
+    if error:
+        return error
+    error = check_callback_url(data.callback_url)
+    if error:
+        return error
+
+    usage_log = UsageLog.objects.create(speaker=speaker, custom_reference=None, generated_text=data.prompt_text)
+    return 202, job_output(jobs.submit(usage_log, callback_url=data.callback_url))
+
+
+@router.post("/generate_vc_async", response={202: TTSJobOutput, 400: Dict})
+def generate_with_reference_async(
+        request, data: Form[GenerateAsyncCustomTTSInput], reference_audio: UploadedFile = File(...)
+):
+    """
+    Queues speech generation with Custom Reference using F5-TTS and returns a job immediately.
+    - Expects a form with prompt_text, reference_text, reference_audio and an optional callback_url.
+    """
+    error = check_callback_url(data.callback_url)
+    if error:
+        return error
+
+    reference = save_reference(data.reference_text, reference_audio)
+    usage_log = UsageLog.objects.create(speaker=None, custom_reference=reference, generated_text=data.prompt_text)
+    return 202, job_output(jobs.submit(usage_log, callback_url=data.callback_url))
+
+
+@router.get("/jobs/{job_id}", response={200: TTSJobOutput, 404: Dict}, url_name="get_job")
+def get_job(request, job_id: UUID):
+    """
+    Status of a generation job: queued, running, succeeded (with result) or failed (with error).
+    """
+    job = TTSJob.objects.select_related('usage_log').filter(pk=job_id).first()
+    if job is None:
+        return 404, {"message": f"Job '{job_id}' not found"}
+    return job_output(job)
+
+
+@router.get("/jobs/{job_id}/result", response={200: GenerateTTSOutput, 202: TTSJobOutput, 404: Dict, 500: Dict})
+def get_job_result(request, job_id: UUID):
+    """
+    Result of a generation job, 202 with the job status while it is queued or running.
+    """
+    job = TTSJob.objects.select_related('usage_log').filter(pk=job_id).first()
+    if job is None:
+        return 404, {"message": f"Job '{job_id}' not found"}
+    if job.status == TTSJob.STATUS_FAILED:
+        return 500, {"message": job.error}
+    if job.status != TTSJob.STATUS_SUCCEEDED:
+        return 202, job_output(job)
+    return usage_log_output(job.usage_log)
@@ -1,4 +1,6 @@
 import logging
+import os
+import sys
 
 from django.apps import AppConfig
 
@@ -7,11 +9,27 @@ from tts.utils import wait_for_port
 logger = logging.getLogger(__name__)
 
 
+def serves_requests():
+    """Whether this process serves the app (WSGI/ASGI server or runserver), not a management command like migrate."""
+    if os.path.basename(sys.argv[0]) not in ("manage.py", "django-admin", "__main__.py"):
+        return True
+    if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+        return False
+    # runserver with autoreload: the serving child, not the watching parent
+    return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+
+
 class TtsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tts'
     verbose_name = 'TTS'
 
+    def ready(self):
+        # resume the async jobs queued before a restart, without waiting for a request to start the pool
+        if serves_requests():
+            from tts import jobs
+            jobs.ensure_workers()
+
     # def ready(self):
     #     logger.info('Django TTS app is ready, waiting for Gradio server to start...')
     #     if not wait_for_port(55556, "0.0.0.0", timeout=60, interval=1):
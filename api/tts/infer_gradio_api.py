@@ -15,7 +15,10 @@ def switch_tts_model(new_choice: str = "Custom", verbose=False):
     return result
 
 
-def set_custom_model(custom_ckpt_path: str, custom_vocab_path: str, custom_model_cfg: str, verbose=False):
+def set_custom_model(
+        custom_ckpt_path: str, custom_vocab_path: str, custom_model_cfg: str, verbose=False, wait=True
+):
+    # the Gradio app loads the model on its next request either way, wait is for parity with the native backend
     result = client.predict(
         custom_ckpt_path=custom_ckpt_path,
         custom_vocab_path=custom_vocab_path,
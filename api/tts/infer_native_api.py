@@ -0,0 +1,310 @@
+"""
+In-process inference backend.
+
+The CFM model and vocoder are loaded once per worker process and synthesis runs directly in the Django process,
+so there is no gradio_client upload, Gradio queue round trip or temp-file re-read. Results are returned as
+in-memory ContentFile objects, which save_filer_file accepts in place of temp-file paths.
+"""
+import io
+import json
+import logging
+import queue
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import soundfile as sf
+import torch
+import torchaudio
+from cached_path import cached_path
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from f5_tts.infer.utils_infer import (
+    StreamMetrics,
+    chunk_text,
+    device,
+    get_ref_prompt,
+    infer_batch_process,
+    infer_process,
+    load_model,
+    load_vocoder,
+    remove_silence_for_generated_wav,
+    save_spectrogram,
+    target_sample_rate,
+)
+from f5_tts.infer.model_registry import ModelRegistry, model_key
+from f5_tts.model import DiT
+from tts.prompts import get_prompt_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTS_MODEL_CFG = [
+    "hf://SWivid/F5-TTS/F5TTS_v1_Base/model_1250000.safetensors",
+    "hf://SWivid/F5-TTS/F5TTS_v1_Base/vocab.txt",
+    json.dumps(dict(dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4)),
+]
+VOICEFIXER_SAMPLE_RATE = 44100
+# RIFF and data chunk sizes of a stream whose length is not known up front
+WAV_OPEN_LENGTH = 0xFFFFFFFF
+# PCM frames of a stream buffered ahead of the client, ~22 s of audio with the default chunk_size
+STREAM_BUFFER_FRAMES = 256
+# seconds a full buffer waits for the client before the synthesis is cancelled and the lock released
+STREAM_STALL_TIMEOUT = 30
+
+# one GPU per worker process, serialize synthesis
+lock = threading.Lock()
+
+vocoder = None
+voicefixer = None
+
+
+def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
+    ckpt_path, vocab_path = ckpt_path.strip(), (vocab_path or "").strip()
+    if ckpt_path.startswith("hf://"):
+        ckpt_path = str(cached_path(ckpt_path))
+    if vocab_path.startswith("hf://"):
+        vocab_path = str(cached_path(vocab_path))
+    if model_cfg is None:
+        model_cfg = json.loads(DEFAULT_TTS_MODEL_CFG[2])
+    elif isinstance(model_cfg, str):
+        model_cfg = json.loads(model_cfg)
+    return load_model(DiT, model_cfg, ckpt_path, vocab_file=vocab_path)
+
+
+# models resident in this process, switched to once loaded in the background
+registry = ModelRegistry(
+    load_custom,
+    device,
+    max_models=settings.TTS_MAX_RESIDENT_MODELS,
+    device_budget=int(settings.TTS_MODEL_DEVICE_BUDGET_GB * 1024**3) if settings.TTS_MODEL_DEVICE_BUDGET_GB else None,
+    cpu_budget=int(settings.TTS_MODEL_CPU_BUDGET_GB * 1024**3),
+)
+
+
+def configured_model():
+    """(checkpoint, vocab, config) of the current TTSConfiguration."""
+    from tts.models.config.models import TTSConfiguration
+    config = TTSConfiguration.objects.first()
+    if config and config.model == 'Custom' and config.checkpoint:
+        return config.checkpoint, config.vocab, config.config
+    return tuple(DEFAULT_TTS_MODEL_CFG)
+
+
+def switch_tts_model(new_choice: str = "Custom", verbose=False):
+    if new_choice not in ['F5-TTS', 'Custom']:
+        raise ValueError(f"new_choice should be one of ['F5-TTS', 'Custom'], but got {new_choice}")
+    if new_choice == 'F5-TTS':
+        return set_custom_model(*DEFAULT_TTS_MODEL_CFG, verbose=verbose)
+    return set_custom_model(*configured_model(), verbose=verbose)
+
+
+def set_custom_model(custom_ckpt_path: str, custom_vocab_path: str, custom_model_cfg, verbose=False, wait=True):
+    """
+    Switch to a model, loaded unless resident already. With wait=False, it is loaded in the background and
+    switched to once ready, requests meanwhile still served by the previous model. Returns the model or its future.
+    """
+    result = registry.switch(custom_ckpt_path, custom_vocab_path, custom_model_cfg, wait=wait)
+    if verbose:
+        print(f"Switched TTS model to {custom_ckpt_path}" if wait else f"Switching TTS model to {custom_ckpt_path}")
+    return result
+
+
+def preload_model(custom_ckpt_path: str, custom_vocab_path: str, custom_model_cfg):
+    """Load a model in the background without switching to it, e.g. the other side of an A/B test."""
+    return registry.preload(custom_ckpt_path, custom_vocab_path, custom_model_cfg)
+
+
+def model_registry_stats():
+    return registry.stats()
+
+
+def get_model():
+    """
+    Model of the current TTSConfiguration, loaded on first use, for the duration of a request.
+
+    TTSConfiguration.save only switches the process that saved it, other worker processes follow here: a changed
+    configuration is loaded in the background while the previous model keeps serving.
+    """
+    configured = configured_model()
+    if registry.active_key is None:
+        set_custom_model(*configured)
+    elif model_key(*configured) not in (registry.active_key, registry.requested_key):
+        set_custom_model(*configured, wait=False)
+    return registry.use()
+
+
+def get_vocoder():
+    global vocoder
+    if vocoder is None:
+        vocoder = load_vocoder()
+    return vocoder
+
+
+def enhance(wave, sample_rate):
+    """Restore audio with VoiceFixer in memory, returns (enhanced_wave, sample_rate)."""
+    global voicefixer
+    if voicefixer is None:
+        from voicefixer import VoiceFixer
+        voicefixer = VoiceFixer()
+
+    wave_44k = torchaudio.functional.resample(torch.from_numpy(wave).float(), sample_rate, VOICEFIXER_SAMPLE_RATE)
+    enhanced_wave = voicefixer.restore_inmem(wave_44k.numpy(), cuda=device == "cuda", mode=0)
+    return enhanced_wave.squeeze(), VOICEFIXER_SAMPLE_RATE
+
+
+def to_wav_file(wave, sample_rate, name):
+    buffer = io.BytesIO()
+    sf.write(buffer, wave, sample_rate, format="WAV")
+    return ContentFile(buffer.getvalue(), name=name)
+
+
+def wav_header(sample_rate, num_channels=1, bits_per_sample=16, data_size=WAV_OPEN_LENGTH):
+    byte_rate = sample_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    return (
+        struct.pack("<4sI4s", b"RIFF", data_size if data_size == WAV_OPEN_LENGTH else data_size + 36, b"WAVE")
+        + struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, num_channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + struct.pack("<4sI", b"data", data_size)
+    )
+
+
+def stream_tts(
+        ref_audio_input, ref_text_input, gen_text_input,
+        cross_fade_duration_slider=0.15,
+        nfe_slider=32,
+        speed_slider=1,
+        chunk_size=2048,
+):
+    """
+    Yield a WAV header with open length, then 16-bit PCM frames as infer_batch_process(streaming=True) produces them.
+    Synthesis runs in a worker thread that holds the lock only while it synthesizes, and buffers at most
+    STREAM_BUFFER_FRAMES frames ahead of the client, so a slow client does not hold the GPU for the other requests.
+    Closing the generator (e.g. on client disconnect) cancels the remaining text chunks and releases the model.
+    """
+    yield wav_header(target_sample_rate)
+
+    frames = queue.Queue(maxsize=STREAM_BUFFER_FRAMES)
+    stop_event = threading.Event()
+    metrics = StreamMetrics()
+
+    def put(item):
+        deadline = time.monotonic() + STREAM_STALL_TIMEOUT
+        while not stop_event.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    logger.warning("Client stopped reading the TTS stream, synthesis cancelled")
+                    return False
+        return False
+
+    def synthesize(model):
+        try:
+            with lock:
+                ref_prompt, ref_text = get_ref_prompt(
+                    ref_audio_input, ref_text_input, model, prompt_file=get_prompt_path(ref_audio_input),
+                    show_info=logger.info,
+                )
+                ref_duration = ref_prompt.audio.shape[-1] / target_sample_rate
+                max_chars = int(len(ref_text.encode("utf-8")) / ref_duration * (22 - ref_duration) * speed_slider)
+                audio_stream = infer_batch_process(
+                    ref_prompt,
+                    ref_text,
+                    chunk_text(gen_text_input, max_chars=max_chars),
+                    model,
+                    get_vocoder(),
+                    progress=None,
+                    cross_fade_duration=cross_fade_duration_slider,
+                    nfe_step=nfe_slider,
+                    speed=speed_slider,
+                    device=device,
+                    streaming=True,
+                    chunk_size=chunk_size,
+                    metrics=metrics,
+                )
+                try:
+                    for audio_chunk, _ in audio_stream:
+                        if not put((np.clip(audio_chunk, -1.0, 1.0) * 32767).astype(np.int16).tobytes()):
+                            return
+                finally:
+                    audio_stream.close()
+            put(None)
+        except Exception as e:
+            put(e)
+
+    with get_model() as model:
+        worker = threading.Thread(target=synthesize, args=(model,), daemon=True)
+        worker.start()
+        try:
+            while True:
+                try:
+                    frame = frames.get(timeout=0.1)
+                except queue.Empty:
+                    if worker.is_alive():
+                        continue
+                    break  # gave up on a stalled client
+                if frame is None:
+                    break
+                if isinstance(frame, Exception):
+                    raise frame
+                yield frame
+        finally:
+            # the model is released only once the worker is done with it
+            stop_event.set()
+            worker.join()
+    logger.info(f"Streamed TTS, {metrics}")
+
+
+def basic_tts(
+        ref_audio_input, ref_text_input, gen_text_input,
+        remove_silence=False,
+        cross_fade_duration_slider=0.15,
+        nfe_slider=32,
+        speed_slider=1,
+        verbose=False
+):
+    with get_model() as model, lock:
+        # repeated references (e.g. a registered Speaker) come from the prompt cache, no decoding or STFT
+        ref_prompt, ref_text = get_ref_prompt(
+            ref_audio_input, ref_text_input, model, prompt_file=get_prompt_path(ref_audio_input), show_info=print
+        )
+        final_wave, final_sample_rate, combined_spectrogram = infer_process(
+            ref_prompt,
+            ref_text,
+            gen_text_input,
+            model,
+            get_vocoder(),
+            cross_fade_duration=cross_fade_duration_slider,
+            nfe_step=nfe_slider,
+            speed=speed_slider,
+            show_info=print,
+            progress=None,
+        )
+
+        # Remove silence
+        if remove_silence:
+            with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+                sf.write(f.name, final_wave, final_sample_rate)
+                remove_silence_for_generated_wav(f.name)
+                final_wave, _ = torchaudio.load(f.name)
+            final_wave = final_wave.squeeze().cpu().numpy()
+
+        enhanced_wave, enhanced_sample_rate = enhance(final_wave, final_sample_rate)
+
+    spectrogram = io.BytesIO()
+    save_spectrogram(combined_spectrogram, spectrogram)
+
+    result = (
+        to_wav_file(final_wave, final_sample_rate, "generated.wav"),
+        ContentFile(spectrogram.getvalue(), name="spectrogram.png"),
+        ref_text,
+        to_wav_file(enhanced_wave, enhanced_sample_rate, "enhanced.wav"),
+    )
+    if verbose:
+        print(result)
+    return result
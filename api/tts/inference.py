@@ -0,0 +1,53 @@
+"""
+Inference backend selection for the TTS API, see TTS_INFERENCE_BACKEND in settings.
+
+- "native": run F5-TTS in-process (infer_native_api), results come back as in-memory files
+- "gradio": call the Gradio app through gradio_client (infer_gradio_api), results come back as temp-file paths
+
+The Gradio backend is used as a fallback when the native one cannot be imported (e.g. no torch in this env).
+"""
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_backend():
+    if settings.TTS_INFERENCE_BACKEND == "native":
+        try:
+            from tts import infer_native_api
+            return infer_native_api
+        except ImportError as e:
+            logger.warning(f"> Native inference backend unavailable ({e}), falling back to Gradio.")
+    from tts import infer_gradio_api
+    return infer_gradio_api
+
+
+def basic_tts(*args, **kwargs):
+    return get_backend().basic_tts(*args, **kwargs)
+
+
+def stream_tts(*args, **kwargs):
+    backend = get_backend()
+    if not hasattr(backend, "stream_tts"):
+        raise NotImplementedError(f"Streaming is not supported by the {backend.__name__} backend.")
+    return backend.stream_tts(*args, **kwargs)
+
+
+def set_custom_model(*args, **kwargs):
+    return get_backend().set_custom_model(*args, **kwargs)
+
+
+def preload_model(*args, **kwargs):
+    backend = get_backend()
+    if not hasattr(backend, "preload_model"):
+        raise NotImplementedError(f"Preloading models is not supported by the {backend.__name__} backend.")
+    return backend.preload_model(*args, **kwargs)
+
+
+def model_registry_stats():
+    backend = get_backend()
+    if not hasattr(backend, "model_registry_stats"):
+        raise NotImplementedError(f"Resident models are not tracked by the {backend.__name__} backend.")
+    return backend.model_registry_stats()
@@ -0,0 +1,177 @@
+"""
+Asynchronous TTS jobs.
+
+A job is a TTSJob row in the database, so submitting one only costs an insert and the HTTP worker returns right
+away. A pool of TTS_MAX_GPU_JOBS worker threads per process claims queued jobs, runs synthesis, VoiceFixer and
+the Filer writes, and POSTs the job status to its callback_url (if any) when done. The pool size caps concurrent
+GPU jobs independently of how many HTTP workers serve requests.
+
+Jobs are claimed with a conditional UPDATE, so several processes can share the same database. The worker running a
+job refreshes its heartbeat; running jobs without heartbeat for TTS_JOB_LEASE_SECONDS were left by a dead process and
+are re-queued by any pool. The pool is started with the app (TtsConfig.ready), so queued jobs resume after a restart.
+
+Callbacks are only sent to http(s) URLs of TTS_CALLBACK_ALLOWED_HOSTS, without following redirects.
+"""
+import json
+import logging
+import queue
+import threading
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# seconds an idle worker waits before looking for queued jobs again, e.g. submitted by another process
+POLL_INTERVAL = 5.0
+HEARTBEAT_INTERVAL = 30.0
+CALLBACK_TIMEOUT = 10
+
+# wake-up tokens, one per submitted job, the job itself is always claimed from the database
+wake_up = queue.Queue()
+workers = []
+workers_lock = threading.Lock()
+
+
+def ensure_workers():
+    """Start the worker pool of this process, once."""
+    with workers_lock:
+        if workers:
+            return
+
+        for i in range(getattr(settings, "TTS_MAX_GPU_JOBS", 1)):
+            worker = threading.Thread(target=work, name=f"tts-job-{i}", daemon=True)
+            worker.start()
+            workers.append(worker)
+
+
+def validate_callback_url(url):
+    """Raises ValueError unless url is an http(s) URL of one of the TTS_CALLBACK_ALLOWED_HOSTS."""
+    parsed = urllib.parse.urlsplit(url)
+    host = (parsed.hostname or "").lower()
+    allowed = [h.lower() for h in getattr(settings, "TTS_CALLBACK_ALLOWED_HOSTS", [])]
+    if parsed.scheme not in ("http", "https") or not any(
+        host == h or (h.startswith(".") and host.endswith(h)) for h in allowed
+    ):
+        raise ValueError("callback_url must be an http(s) URL of an allowed host")
+
+
+def submit(usage_log, callback_url=None):
+    """Queue synthesis of a saved UsageLog (speaker or custom reference, and generated_text), returns the TTSJob."""
+    from tts.models.job.models import TTSJob
+
+    if callback_url:
+        validate_callback_url(callback_url)
+    ensure_workers()
+    job = TTSJob.objects.create(usage_log=usage_log, callback_url=callback_url or None)
+    transaction.on_commit(lambda: wake_up.put(job.pk))
+    return job
+
+
+def requeue_stale_jobs():
+    from tts.models.job.models import TTSJob
+
+    lease = timedelta(seconds=getattr(settings, "TTS_JOB_LEASE_SECONDS", 300))
+    # no heartbeat at all: left running before heartbeats were recorded
+    stale = Q(heartbeat_at__lt=timezone.now() - lease) | Q(heartbeat_at__isnull=True)
+    requeued = TTSJob.objects.filter(stale, status=TTSJob.STATUS_RUNNING).update(
+        status=TTSJob.STATUS_QUEUED, started_at=None, heartbeat_at=None
+    )
+    if requeued:
+        logger.info(f"> Re-queued {requeued} TTS job(s) left running by a dead process")
+
+
+def claim_next_job():
+    from tts.models.job.models import TTSJob
+
+    queued = TTSJob.objects.filter(status=TTSJob.STATUS_QUEUED).order_by('created_at')
+    for pk in queued.values_list('pk', flat=True)[:8]:
+        # only one worker (in any process) wins the update of a given job
+        now = timezone.now()
+        claimed = TTSJob.objects.filter(pk=pk, status=TTSJob.STATUS_QUEUED).update(
+            status=TTSJob.STATUS_RUNNING, started_at=now, heartbeat_at=now
+        )
+        if claimed:
+            return TTSJob.objects.select_related('usage_log').get(pk=pk)
+    return None
+
+
+def work():
+    while True:
+        try:
+            wake_up.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+
+        close_old_connections()
+        try:
+            requeue_stale_jobs()
+            job = claim_next_job()
+            while job is not None:
+                run_job(job)
+                job = claim_next_job()
+        except Exception as e:
+            logger.error(f"> TTS job worker error: {e}")
+
+
+def heartbeat(job_pk, done):
+    from tts.models.job.models import TTSJob
+
+    while not done.wait(HEARTBEAT_INTERVAL):
+        try:
+            TTSJob.objects.filter(pk=job_pk, status=TTSJob.STATUS_RUNNING).update(heartbeat_at=timezone.now())
+        except Exception as e:
+            logger.warning(f"> Heartbeat of TTS job {job_pk} failed: {e}")
+        finally:
+            close_old_connections()
+
+
+def run_job(job):
+    from tts.models.job.models import TTSJob
+
+    done = threading.Event()
+    threading.Thread(target=heartbeat, args=(job.pk, done), daemon=True).start()
+    try:
+        usage_log = job.usage_log
+        usage_log.synthesize()
+        usage_log.save()
+        job.status = TTSJob.STATUS_SUCCEEDED
+    except Exception as e:
+        logger.error(f"> TTS job {job.pk} failed: {e}")
+        job.status = TTSJob.STATUS_FAILED
+        job.error = str(e)
+    finally:
+        done.set()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+
+    if job.callback_url:
+        send_callback(job)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None  # a redirect could lead anywhere, e.g. to an internal host
+
+
+callback_opener = urllib.request.build_opener(NoRedirect)
+
+
+def send_callback(job):
+    from tts.api.tts import job_output
+
+    payload = json.dumps(job_output(job).dict(), default=str).encode("utf-8")
+    request = urllib.request.Request(
+        job.callback_url, data=payload, headers={"Content-Type": "application/json"}, method="POST"
+    )
+    try:
+        validate_callback_url(job.callback_url)  # the allowlist may have changed since the job was submitted
+        with callback_opener.open(request, timeout=CALLBACK_TIMEOUT) as response:
+            response.read()
+    except Exception as e:
+        logger.warning(f"> Callback of TTS job {job.pk} to {job.callback_url} failed: {e}")
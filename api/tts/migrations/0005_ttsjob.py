@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:50
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tts', '0004_alter_usagelog_custom_reference_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TTSJob',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='queued', max_length=16)),
+                ('callback_url', models.URLField(blank=True, max_length=1024, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('usage_log', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='job', to='tts.usagelog')),
+            ],
+            options={
+                'verbose_name': 'TTS Job',
+                'verbose_name_plural': 'TTS Jobs',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tts', '0005_ttsjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ttsjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -47,5 +47,6 @@ class TTSConfiguration(models.Model):
         if not self.pk and TTSConfiguration.objects.exists():
             raise ValidationError("There can be only one TTSConfiguration instance")
         super().save(*args, **kwargs)
-        from tts.infer_gradio_api import set_custom_model
-        set_custom_model(self.checkpoint, self.vocab, self.config)
+        # loaded in the background, the previous model keeps serving until the switch
+        from tts.inference import set_custom_model
+        set_custom_model(self.checkpoint, self.vocab, self.config, wait=False)
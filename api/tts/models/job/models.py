@@ -0,0 +1,43 @@
+import uuid
+
+from django.db import models
+
+from tts.models.tts.models import UsageLog
+
+
+class TTSJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    uuid = models.UUIDField(primary_key=True, editable=False, unique=True, default=uuid.uuid4)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    # holds the speaker / custom reference and text to synthesize, audio files are attached once the job succeeds
+    usage_log = models.OneToOneField(UsageLog, related_name='job', on_delete=models.CASCADE)
+    callback_url = models.URLField(max_length=1024, blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # refreshed by the worker running the job, a running job without recent heartbeat was left by a dead process
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'TTS Job'
+        verbose_name_plural = 'TTS Jobs'
+        ordering = ('-created_at',)
+
+    def __str__(self):
+        return f"TTSJob {self.uuid} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED)
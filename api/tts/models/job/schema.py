@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from ninja import Schema
+
+from tts.models.tts.schema import GenerateTTSInput, GenerateCustomTTSInput, GenerateTTSOutput
+
+
+class GenerateAsyncTTSInput(GenerateTTSInput):
+    callback_url: Optional[str] = None
+
+
+class GenerateAsyncCustomTTSInput(GenerateCustomTTSInput):
+    callback_url: Optional[str] = None
+
+
+class TTSJobOutput(Schema):
+    job_id: str
+    status: str
+    error: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    status_url: str
+    result_url: str
+    result: Optional[GenerateTTSOutput] = None
@@ -54,6 +54,11 @@ class ReferenceAudio(models.Model):
 
         super().save(*args, **kwargs)
 
+        # Precompute the reference prompt (waveform, mel spectrogram and tokens) in the background
+        if self.audio and self.audio.file:
+            from tts.prompts import schedule_precompute
+            schedule_precompute(self)
+
 
 class Speaker(models.Model):
     DEFAULT_GENDER = 'M'
@@ -96,6 +101,13 @@ class Speaker(models.Model):
             speaker.save()
         return True
 
+    @staticmethod
+    def rerun_prompt_precompute():
+        from tts.prompts import schedule_precompute
+        for speaker in Speaker.objects.exclude(reference=None):
+            schedule_precompute(speaker.reference)
+        return True
+
     @staticmethod
     def rerun_speaker_id():
         """
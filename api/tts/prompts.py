@@ -0,0 +1,57 @@
+"""
+Background precompute of speaker reference prompts.
+
+When a ReferenceAudio is saved, the preprocessed reference waveform, its mel spectrogram, the normalized
+reference text and its tokens are written as a safetensors artifact next to the audio file. The native inference
+backend loads it directly, so a fixed roster of voices needs no per-request reference preprocessing.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+PROMPT_SUFFIX = ".prompt.safetensors"
+
+# a single background worker, precompute jobs are short and should not compete with synthesis for the GPU
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-precompute")
+
+
+def get_prompt_path(audio_path):
+    return os.path.splitext(audio_path)[0] + PROMPT_SUFFIX
+
+
+def is_prompt_outdated(audio_path, ref_text):
+    prompt_path = get_prompt_path(audio_path)
+    if not os.path.exists(prompt_path) or os.path.getmtime(prompt_path) < os.path.getmtime(audio_path):
+        return True
+
+    from f5_tts.infer.ref_cache import RefPrompt
+    from f5_tts.infer.utils_infer import normalize_ref_text
+    prompt, _ = RefPrompt.load(prompt_path)
+    return bool(ref_text.strip()) and prompt.ref_text != normalize_ref_text(ref_text)
+
+
+def precompute_reference_prompt(reference_uuid):
+    from tts.models.speaker.models import ReferenceAudio
+
+    try:
+        reference = ReferenceAudio.objects.get(uuid=reference_uuid)
+        if not reference.audio or not reference.audio.file:
+            return
+        audio_path = reference.audio.file.path
+        if not os.path.exists(audio_path) or not is_prompt_outdated(audio_path, reference.text):
+            return
+
+        from f5_tts.infer.utils_infer import precompute_ref_prompt
+        precompute_ref_prompt(audio_path, reference.text, get_prompt_path(audio_path))
+        logger.info(f"> Precomputed reference prompt for {reference}")
+    except Exception as e:
+        logger.error(f"> Failed to precompute reference prompt for {reference_uuid}: {e}")
+
+
+def schedule_precompute(reference):
+    """Queue the precompute job of a ReferenceAudio once the current transaction commits."""
+    transaction.on_commit(lambda: executor.submit(precompute_reference_prompt, reference.uuid))
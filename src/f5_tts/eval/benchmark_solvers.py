@@ -0,0 +1,156 @@
+""" Example Usage
+python src/f5_tts/eval/benchmark_solvers.py \
+--model F5TTS_v1_Base \
+--metalst data/seedtts_testset/en/meta.lst \
+--max_samples 50 \
+--solvers euler midpoint heun ab2 dpmpp_2m \
+--nfe 8 10 12 16 32 \
+--sway -1 0 \
+--wavlm_ckpt ../checkpoints/UniSpeech/wavlm_large_finetune.pth
+"""
+
+# Sweep ODE solver x NFE x sway sampling coefficient on a fixed prompt set,
+# reporting wall-clock time, RTF, and WER / speaker similarity from the eval/ tooling
+
+import argparse
+import itertools
+import json
+import os
+import time
+from importlib.resources import files
+
+import numpy as np
+import soundfile as sf
+import torch
+from cached_path import cached_path
+from hydra.utils import get_class
+from omegaconf import OmegaConf
+
+from f5_tts.eval.utils_eval import get_seedtts_testset_metainfo, run_asr_wer, run_sim
+from f5_tts.infer.utils_infer import get_ref_prompt, infer_process, load_model, load_vocoder
+from f5_tts.model.solvers import SOLVERS
+
+
+rel_path = str(files("f5_tts").joinpath("../../"))
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark ODE solvers against NFE and sway sampling")
+    parser.add_argument("--model", default="F5TTS_v1_Base")
+    parser.add_argument("--ckpt_file", default="")
+    parser.add_argument("--vocab_file", default="")
+    parser.add_argument("--metalst", default=rel_path + "/data/seedtts_testset/en/meta.lst")
+    parser.add_argument("--max_samples", default=50, type=int)
+    parser.add_argument("--solvers", nargs="+", default=list(SOLVERS), choices=list(SOLVERS))
+    parser.add_argument("--nfe", nargs="+", default=[8, 10, 12, 16, 32], type=int, help="Function evaluations")
+    parser.add_argument("--sway", nargs="+", default=[-1.0], type=float, help="Sway sampling coefficients")
+    parser.add_argument("--cfg_strength", default=2.0, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--output_dir", default=rel_path + "/results/benchmark_solvers")
+    parser.add_argument("--lang", default="en", choices=["en", "zh"])
+    parser.add_argument("--asr_ckpt_dir", default="", help="Local ASR checkpoint, auto download if empty")
+    parser.add_argument("--wavlm_ckpt", default="", help="WavLM ECAPA-TDNN checkpoint for SIM, skipped if empty")
+    parser.add_argument("--skip_eval", action="store_true", help="Only measure speed")
+    args = parser.parse_args()
+
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml")))
+    model_cls = get_class(f"f5_tts.model.{model_cfg.model.backbone}")
+    mel_spec_type = model_cfg.model.mel_spec.mel_spec_type
+    ckpt_file = args.ckpt_file or str(cached_path(f"hf://SWivid/F5-TTS/{args.model}/model_1250000.safetensors"))
+
+    vocoder = load_vocoder(vocoder_name=mel_spec_type)
+    model = load_model(model_cls, model_cfg.model.arch, ckpt_file, mel_spec_type, args.vocab_file)
+
+    # fixed prompt set, references preprocessed once so that only sampling is timed
+    metainfo = get_seedtts_testset_metainfo(args.metalst)[: args.max_samples]
+    prompts = []
+    for utt, prompt_text, prompt_wav, gt_text, _ in metainfo:
+        ref_prompt, ref_text = get_ref_prompt(prompt_wav, prompt_text, model, mel_spec_type, show_info=lambda _: None)
+        prompts.append((utt, ref_prompt, ref_text, prompt_wav, gt_text))
+
+    def synthesize(ref_prompt, ref_text, gen_text, steps, sway):
+        wave, sample_rate, _ = infer_process(
+            ref_prompt,
+            ref_text,
+            gen_text,
+            model,
+            vocoder,
+            mel_spec_type=mel_spec_type,
+            show_info=lambda _: None,
+            progress=None,
+            nfe_step=steps,
+            cfg_strength=args.cfg_strength,
+            sway_sampling_coef=sway,
+            device=model.device,
+        )
+        return wave, sample_rate
+
+    # warm up
+    synthesize(*prompts[0][1:3], prompts[0][4], 4, -1.0)
+
+    wav_dir = os.path.join(args.output_dir, "wavs")
+    os.makedirs(wav_dir, exist_ok=True)
+
+    runs = []
+    for method, nfe, sway in itertools.product(args.solvers, args.nfe, args.sway):
+        evals_per_step = SOLVERS[method].evals_per_step
+        if nfe % evals_per_step:
+            print(f"Skip {method} at NFE {nfe}, not a multiple of its {evals_per_step} evaluations per step")
+            continue
+        run_name = f"{method}_nfe{nfe}_ss{sway}"
+        model.odeint_kwargs = dict(method=method)
+
+        wall_time, audio_duration, test_set = 0.0, 0.0, []
+        for utt, ref_prompt, ref_text, prompt_wav, gen_text in prompts:
+            torch.manual_seed(args.seed)
+            synchronize()
+            start = time.perf_counter()
+            wave, sample_rate = synthesize(ref_prompt, ref_text, gen_text, nfe // evals_per_step, sway)
+            synchronize()
+            wall_time += time.perf_counter() - start
+            audio_duration += len(wave) / sample_rate
+
+            gen_wav = os.path.join(wav_dir, f"{run_name}__{utt}.wav")
+            sf.write(gen_wav, wave, sample_rate)
+            test_set.append((gen_wav, prompt_wav, gen_text))
+
+        runs.append(dict(name=run_name, solver=method, nfe=nfe, sway=sway, wall_time=wall_time,
+                         rtf=wall_time / audio_duration, test_set=test_set))  # fmt: skip
+        print(f"{run_name:>28} | wall {wall_time:8.2f} s | RTF {wall_time / audio_duration:.4f}")
+
+    # objective quality, all runs scored in one pass so that each eval model is loaded once
+    if not args.skip_eval:
+        all_test_set = [sample for run in runs for sample in run["test_set"]]
+        wer = {r["wav"]: r["wer"] for r in run_asr_wer((0, args.lang, all_test_set, args.asr_ckpt_dir))}
+        sim = {}
+        if args.wavlm_ckpt:
+            sim = {r["wav"]: r["sim"] for r in run_sim((0, all_test_set, args.wavlm_ckpt))}
+        for run in runs:
+            stems = [os.path.splitext(os.path.basename(gen_wav))[0] for gen_wav, _, _ in run["test_set"]]
+            run["wer"] = float(np.mean([wer[stem] for stem in stems]))
+            run["sim"] = float(np.mean([sim[stem] for stem in stems])) if sim else None
+
+    print(f"\n{'solver':>10} | {'nfe':>4} | {'sway':>5} | {'wall (s)':>9} | {'RTF':>7} | {'WER':>7} | {'SIM':>6}")
+    for run in runs:
+        wer = f"{run['wer']:.4f}" if run.get("wer") is not None else "-"
+        sim = f"{run['sim']:.4f}" if run.get("sim") is not None else "-"
+        print(
+            f"{run['solver']:>10} | {run['nfe']:>4} | {run['sway']:>5} | {run['wall_time']:>9.2f} | "
+            f"{run['rtf']:>7.4f} | {wer:>7} | {sim:>6}"
+        )
+
+    result_path = os.path.join(args.output_dir, "results.jsonl")
+    with open(result_path, "w") as f:
+        for run in runs:
+            run.pop("test_set")
+            f.write(json.dumps(run) + "\n")
+    print(f"\nResults saved to {result_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# Cross-request dynamic batching for CFM.sample
+# Chunks submitted from concurrent requests (different users / speakers) are grouped by similar target duration,
+# and each group is solved with one batched ODE integration, then vocoded in one batched call.
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from f5_tts.infer.utils_infer import (
+    cfg_strength,
+    hop_length,
+    mel_spec_type,
+    nfe_step,
+    prepare_chunk,
+    sway_sampling_coef,
+    target_rms,
+    uncond_interval,
+    vocode_batch,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRequest:
+    """A single text chunk waiting to be sampled."""
+
+    def __init__(self, cond, text, ref_audio_len, duration, rms):
+        self.cond = cond  # n d, reference mel
+        self.text = text  # ref_text + gen_text, already converted to pinyin / char list
+        self.ref_audio_len = ref_audio_len
+        self.duration = duration  # total mel frames, reference included
+        self.rms = rms
+        self.future = Future()
+        self.arrival = time.perf_counter()
+
+
+class DynamicBatchScheduler:
+    """Collects chunks from concurrent callers and runs them through CFM.sample in batches.
+
+    A batch is dispatched once the oldest pending chunk waited `max_wait` seconds, or enough chunks are pending to
+    fill `max_batch_size` / `max_frames`. Chunks are grouped around the oldest one by target duration, within
+    `duration_tolerance` (relative), so that padding stays small. `max_frames` bounds batch * longest duration,
+    i.e. the padded mel frames of one ODE solve.
+
+    Chunks of different durations are only grouped if the model masks batch padding (CFM.masks_batch_padding),
+    otherwise a chunk would attend to the padding up to the longest one and get another output than sampled alone,
+    so only chunks of the same duration are batched.
+
+    Sampling settings (nfe_step, cfg_strength, sway_sampling_coef, uncond_interval) are shared by all chunks of
+    a scheduler.
+    """
+
+    def __init__(
+        self,
+        model_obj,
+        vocoder,
+        mel_spec_type=mel_spec_type,
+        target_rms=target_rms,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        uncond_interval=uncond_interval,
+        max_batch_size=8,
+        max_frames=16384,
+        max_wait=0.02,
+        duration_tolerance=0.25,
+    ):
+        self.model_obj = model_obj
+        self.vocoder = vocoder
+        self.mel_spec_type = mel_spec_type
+        self.target_rms = target_rms
+        self.nfe_step = nfe_step
+        self.cfg_strength = cfg_strength
+        self.sway_sampling_coef = sway_sampling_coef
+        self.uncond_interval = uncond_interval
+
+        self.max_batch_size = max_batch_size
+        self.max_frames = max_frames
+        self.max_wait = max_wait
+        self.duration_tolerance = duration_tolerance if getattr(model_obj, "masks_batch_padding", False) else 0.0
+
+        self.num_batches = 0
+        self.num_requests = 0
+
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(
+        self, audio, ref_text, gen_text, rms=None, speed=1.0, fix_duration=None, ref_mel=None, ref_text_tokens=None
+    ):
+        """Queue one chunk, returns a Future resolving to (generated_wave, generated_mel_spec).
+
+        `audio` is the preprocessed reference waveform (1 nw) at target sample rate, as in infer_batch_process.
+        `ref_mel` (1 n d) is its mel spectrogram if already known, e.g. from a cached RefPrompt.
+        """
+        if self.stop_event.is_set():
+            raise RuntimeError("DynamicBatchScheduler is stopped.")
+
+        ref_audio_len = audio.shape[-1] // hop_length
+        final_text_list, duration = prepare_chunk(
+            ref_text, gen_text, ref_audio_len, speed, fix_duration, ref_text_tokens=ref_text_tokens
+        )
+
+        if ref_mel is None:
+            with torch.inference_mode():
+                ref_mel = self.model_obj.mel_spec(audio.to(self.model_obj.device)).permute(0, 2, 1)  # 1 n d
+        cond = ref_mel[0, :ref_audio_len]
+        # the duration sample() actually generates (lengthened to the text / reference, capped), to group and slice
+        lens = torch.tensor([ref_audio_len], device=cond.device)
+        duration = self.model_obj.sample_duration(final_text_list, lens, duration).item()
+
+        request = BatchRequest(cond, final_text_list[0], ref_audio_len, duration, rms)
+        self.queue.put(request)
+        return request.future
+
+    def stop(self):
+        """Stop accepting chunks, finish pending ones and join the worker."""
+        self.stop_event.set()
+        self.worker.join()
+
+    def stats(self):
+        return dict(
+            num_batches=self.num_batches,
+            num_requests=self.num_requests,
+            avg_batch_size=self.num_requests / self.num_batches if self.num_batches else 0.0,
+        )
+
+    def run(self):
+        pending = []
+        while not self.stop_event.is_set() or pending or not self.queue.empty():
+            if pending:
+                timeout = max(0.0, pending[0].arrival + self.max_wait - time.perf_counter())
+            else:
+                timeout = 0.1
+            try:
+                pending.append(self.queue.get(timeout=timeout))
+                while True:
+                    pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if not pending:
+                continue
+            waited = time.perf_counter() - pending[0].arrival
+            if waited < self.max_wait and not self.is_full(pending) and not self.stop_event.is_set():
+                continue
+
+            batch = self.pick_batch(pending)
+            pending = [request for request in pending if request not in batch]
+            self.run_batch(batch)
+
+    def is_full(self, pending):
+        return len(pending) >= self.max_batch_size or sum(r.duration for r in pending) >= self.max_frames
+
+    def pick_batch(self, pending):
+        # always serve the oldest chunk first, then fill with the closest durations around it
+        anchor = pending[0]
+        batch = [anchor]
+        max_duration = anchor.duration
+        candidates = sorted(pending[1:], key=lambda r: abs(r.duration - anchor.duration))
+        for request in candidates:
+            if len(batch) >= self.max_batch_size:
+                break
+            if abs(request.duration - anchor.duration) > self.duration_tolerance * anchor.duration:
+                break
+            if max(max_duration, request.duration) * (len(batch) + 1) > self.max_frames:
+                continue
+            batch.append(request)
+            max_duration = max(max_duration, request.duration)
+        return batch
+
+    def run_batch(self, batch):
+        device = self.model_obj.device
+        try:
+            cond = pad_sequence([r.cond for r in batch], padding_value=0, batch_first=True).to(device)
+            lens = torch.tensor([r.ref_audio_len for r in batch], device=device, dtype=torch.long)
+            duration = torch.tensor([r.duration for r in batch], device=device, dtype=torch.long)
+
+            with torch.inference_mode():
+                generated, _ = self.model_obj.sample(
+                    cond=cond,
+                    text=[r.text for r in batch],
+                    duration=duration,
+                    lens=lens,
+                    steps=self.nfe_step,
+                    cfg_strength=self.cfg_strength,
+                    sway_sampling_coef=self.sway_sampling_coef,
+                    uncond_interval=self.uncond_interval,
+                )
+                del _
+
+                generated = generated.to(torch.float32)  # generated mel spectrogram
+                gens = [generated[i, r.ref_audio_len : r.duration, :].permute(1, 0) for i, r in enumerate(batch)]
+                gains = [
+                    r.rms / self.target_rms if r.rms is not None and r.rms < self.target_rms else 1.0 for r in batch
+                ]
+                generated_waves = vocode_batch(gens, self.vocoder, self.mel_spec_type, gains=gains)
+
+                # spectrograms to host in one transfer as well
+                generated = generated.cpu()
+                for i, (request, generated_wave) in enumerate(zip(batch, generated_waves)):
+                    gen = generated[i, request.ref_audio_len : request.duration, :].permute(1, 0)
+                    request.future.set_result((generated_wave, gen.numpy()))
+
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            logger.debug(f"Sampled batch of {len(batch)} chunks, max duration {duration.amax().item()} frames")
+
+        except Exception as e:
+            logger.error(f"Error during batched sampling: {e}")
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
@@ -0,0 +1,45 @@
+"""Example Usage
+f5-tts_export-ckpt --model F5TTS_v1_Base --ckpt_file ckpts/my_run/model_last.pt --output model_infer.safetensors
+"""
+
+# Export a training checkpoint (model, ema, optimizer and scheduler states) to an inference only safetensors file:
+# ema weights in half precision, identical tensors stored once, and a header with the model config, vocab hash and
+# mel settings. load_model / load_checkpoint recognize the file and memory-map it straight to the target device.
+
+import argparse
+import os
+from importlib.resources import files
+
+from omegaconf import OmegaConf
+
+from f5_tts.infer.utils_infer import export_inference_checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export an inference only checkpoint")
+    parser.add_argument("-m", "--model", default="F5TTS_v1_Base", help="Model config name, e.g. F5TTS_v1_Base")
+    parser.add_argument("-c", "--config", default="", help="Model config file, in place of --model")
+    parser.add_argument("-p", "--ckpt_file", required=True, help="Training checkpoint (.pt) or weights (.safetensors)")
+    parser.add_argument("-v", "--vocab_file", default="", help="Vocab the model was trained with")
+    parser.add_argument("-o", "--output", required=True, help="Output .safetensors file")
+    parser.add_argument("--dtype", default="float16", choices=["float16", "bfloat16", "float32"])
+    parser.add_argument("--no_ema", action="store_true", help="Export the online model weights instead of ema")
+    args = parser.parse_args()
+
+    config = args.config or str(files("f5_tts").joinpath(f"configs/{args.model}.yaml"))
+    model_cfg = OmegaConf.to_container(OmegaConf.load(config).model, resolve=True)
+    vocab_file = args.vocab_file or str(files("f5_tts").joinpath("infer/examples/vocab.txt"))
+    if not args.output.endswith(".safetensors"):
+        parser.error("--output must be a .safetensors file")
+
+    num_tensors, num_aliases = export_inference_checkpoint(
+        args.ckpt_file, args.output, model_cfg, vocab_file, dtype=args.dtype, use_ema=not args.no_ema
+    )
+    print(f"Exported {num_tensors} tensors ({num_aliases} duplicates stored once) in {args.dtype} to {args.output}")
+    print(
+        f"Size: {os.path.getsize(args.ckpt_file) / 1024**3:.2f} GB -> {os.path.getsize(args.output) / 1024**3:.2f} GB"
+    )
+
+
+if __name__ == "__main__":
+    main()
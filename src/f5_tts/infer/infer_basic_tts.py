@@ -10,6 +10,7 @@ import soundfile as sf
 import torchaudio
 
 from f5_tts.infer.infer_gradio import load_f5tts, load_custom
+from f5_tts.infer.model_registry import ModelRegistry, model_key
 from f5_tts.infer.utils_infer_basic import get_available_models, get_vocab_files, get_model_configs
 
 logger = logging.getLogger(__name__)
@@ -50,7 +51,8 @@ DEMO_DIR = os.path.join(project_root, "demo")
 vocoder = load_vocoder()
 
 F5TTS_ema_model = load_f5tts()
-custom_ema_model, pre_custom_path = None, ""
+# custom models kept loaded, alternating between them needs no reload
+custom_models = ModelRegistry(load_custom, device, max_models=2)
 
 chat_model_state = None
 chat_tokenizer_state = None
@@ -96,12 +98,9 @@ def infer(
     if "F5-TTS" in model:
         ema_model = F5TTS_ema_model
     elif isinstance(model, list) and model[0] == "Custom":
-        global custom_ema_model, pre_custom_path
-        if pre_custom_path != model[1]:
+        if model_key(model[1], model[2], model[3]) not in custom_models.models:
             show_info("Loading Custom TTS model...")
-            custom_ema_model = load_custom(model[1], vocab_path=model[2], model_cfg=model[3])
-            pre_custom_path = model[1]
-        ema_model = custom_ema_model
+        ema_model = custom_models.switch(model[1], vocab_path=model[2], model_cfg=model[3])
 
     final_wave, final_sample_rate, combined_spectrogram = infer_process(
         ref_audio,
@@ -16,6 +16,7 @@ from unidecode import unidecode
 
 from f5_tts.infer.utils_infer import (
     cfg_strength,
+    chunk_batch_size,
     cross_fade_duration,
     device,
     fix_duration,
@@ -29,6 +30,7 @@ from f5_tts.infer.utils_infer import (
     speed,
     sway_sampling_coef,
     target_rms,
+    uncond_interval,
 )
 
 
@@ -159,6 +161,17 @@ parser.add_argument(
     type=float,
     help=f"Sway Sampling coefficient, default {sway_sampling_coef}",
 )
+parser.add_argument(
+    "--uncond_interval",
+    type=int,
+    help=f"Run the cfg unconditional branch every n steps and reuse it in between (faster), default {uncond_interval}",
+)
+parser.add_argument(
+    "--chunk_batch_size",
+    type=int,
+    help=f"Number of text chunks sampled together in one batch, if the model masks batch padding (attn_mask_enabled), "
+    f"default {chunk_batch_size}",
+)
 parser.add_argument(
     "--speed",
     type=float,
@@ -218,6 +231,8 @@ cross_fade_duration = args.cross_fade_duration or config.get("cross_fade_duratio
 nfe_step = args.nfe_step or config.get("nfe_step", nfe_step)
 cfg_strength = args.cfg_strength or config.get("cfg_strength", cfg_strength)
 sway_sampling_coef = args.sway_sampling_coef or config.get("sway_sampling_coef", sway_sampling_coef)
+uncond_interval = args.uncond_interval or config.get("uncond_interval", uncond_interval)
+chunk_batch_size = args.chunk_batch_size or config.get("chunk_batch_size", chunk_batch_size)
 speed = args.speed or config.get("speed", speed)
 fix_duration = args.fix_duration or config.get("fix_duration", fix_duration)
 device = args.device or config.get("device", device)
@@ -351,6 +366,8 @@ def main():
             speed=local_speed,
             fix_duration=fix_duration,
             device=device,
+            uncond_interval=uncond_interval,
+            chunk_batch_size=chunk_batch_size,
         )
         generated_audio_segments.append(audio_segment)
 
@@ -35,7 +35,9 @@ def gpu_decorator(func):
         return func
 
 
+from f5_tts.infer.model_registry import ModelRegistry, model_key
 from f5_tts.infer.utils_infer import (
+    device,
     infer_process,
     load_model,
     load_vocoder,
@@ -89,7 +91,8 @@ def load_custom(ckpt_path: str, vocab_path="", model_cfg=None):
 
 F5TTS_ema_model = load_f5tts()
 E2TTS_ema_model = load_e2tts() if USING_SPACES else None
-custom_ema_model, pre_custom_path = None, ""
+# custom models kept loaded, alternating between them needs no reload
+custom_models = ModelRegistry(load_custom, device, max_models=2)
 
 chat_model_state = None
 chat_tokenizer_state = None
@@ -169,12 +172,9 @@ def infer(
         ema_model = E2TTS_ema_model
     elif isinstance(model, tuple) and model[0] == "Custom":
         assert not USING_SPACES, "Only official checkpoints allowed in Spaces."
-        global custom_ema_model, pre_custom_path
-        if pre_custom_path != model[1]:
+        if model_key(model[1], model[2], model[3]) not in custom_models.models:
             show_info("Loading Custom TTS model...")
-            custom_ema_model = load_custom(model[1], vocab_path=model[2], model_cfg=model[3])
-            pre_custom_path = model[1]
-        ema_model = custom_ema_model
+        ema_model = custom_models.switch(model[1], vocab_path=model[2], model_cfg=model[3])
 
     final_wave, final_sample_rate, combined_spectrogram = infer_process(
         ref_audio,
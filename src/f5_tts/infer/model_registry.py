@@ -0,0 +1,184 @@
+"""
+Registry of the TTS models resident in a serving process, to switch between checkpoints without reloading them.
+
+Models are keyed by (ckpt_path, vocab_path, model_cfg). Up to max_models / device_budget, models stay on the device;
+beyond that, the least recently used ones are offloaded to CPU memory, and beyond cpu_budget dropped (reloaded from
+disk on next use). A switch loads the new model in the background and makes it active atomically once ready, the
+previous one serving requests meanwhile. Models in use by a request are never moved.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+
+def model_key(ckpt_path: str, vocab_path: str = "", model_cfg=None):
+    if isinstance(model_cfg, str):
+        model_cfg = json.loads(model_cfg)
+    model_cfg = json.dumps(model_cfg, sort_keys=True) if model_cfg is not None else ""
+    return ckpt_path.strip(), (vocab_path or "").strip(), model_cfg
+
+
+def model_bytes(model):
+    return sum(t.numel() * t.element_size() for t in itertools.chain(model.parameters(), model.buffers()))
+
+
+def model_device(model):
+    return next(model.parameters()).device
+
+
+class ModelRegistry:
+    def __init__(
+        self,
+        load_fn,
+        device: str,
+        max_models: int | None = None,
+        device_budget: int | None = None,
+        cpu_budget: int = 0,
+    ):
+        """
+        load_fn         - load_fn(ckpt_path, vocab_path, model_cfg) returns the model on device
+        max_models      - max models kept on device, None for no limit
+        device_budget   - max bytes of models kept on device, None for no limit
+        cpu_budget      - max bytes of models offloaded to cpu memory, 0 to drop them instead
+        """
+        self.load_fn = load_fn
+        self.device_type = torch.device(device).type
+        self.device = device
+        self.max_models = max_models
+        self.device_budget = device_budget
+        self.cpu_budget = cpu_budget
+
+        self.models = OrderedDict()  # key -> model, least recently used first
+        self.in_use = {}  # key -> number of requests using it
+        self.loading = {}  # key -> future of the model on device
+        self.active_key = None
+        self.requested_key = None  # latest switch, the only one allowed to become active
+        self.lock = threading.RLock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model_loader")
+
+    def on_device(self, model):
+        return self.device_type == "cpu" or model_device(model).type == self.device_type
+
+    def make_room(self, needed: int, keep):
+        """Offload (then drop) least recently used models, so that one more model of `needed` bytes fits."""
+        offloadable = [
+            key for key in self.models if key not in keep and not self.in_use.get(key) and key != self.active_key
+        ]
+        for key in offloadable:
+            on_device = [m for m in self.models.values() if self.on_device(m)]
+            over_count = self.max_models is not None and len(on_device) + 1 > self.max_models
+            over_budget = (
+                self.device_budget is not None and sum(map(model_bytes, on_device)) + needed > self.device_budget
+            )
+            if not (over_count or over_budget):
+                break
+            if self.on_device(self.models[key]):
+                if self.device_type == "cpu" or not self.cpu_budget:
+                    del self.models[key]
+                else:
+                    self.models[key].to("cpu")
+        if self.device_type == "cuda":
+            torch.cuda.empty_cache()
+
+        for key in offloadable:
+            offloaded = [m for m in self.models.values() if not self.on_device(m)]
+            if sum(map(model_bytes, offloaded)) <= self.cpu_budget:
+                break
+            if key in self.models and not self.on_device(self.models[key]):
+                del self.models[key]
+
+    def bring(self, key):
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.make_room(model_bytes(model), keep={key})
+                model.to(self.device)  # back from cpu, no reload
+                self.models.move_to_end(key)
+                return model
+            # size unknown before loading, models served together are mostly of the same size
+            self.make_room(max(map(model_bytes, self.models.values()), default=0), keep={key})
+
+        ckpt_path, vocab_path, model_cfg = key
+        model = self.load_fn(ckpt_path, vocab_path, json.loads(model_cfg) if model_cfg else None)
+        with self.lock:
+            self.models[key] = model
+            return model
+
+    def prepare(self, key) -> Future:
+        """Future of the model on device, loaded in the background if not resident there already."""
+        with self.lock:
+            model = self.models.get(key)
+            if model is not None and self.on_device(model):
+                self.models.move_to_end(key)
+                future = Future()
+                future.set_result(model)
+                return future
+            future = self.loading.get(key)
+            if future is None:
+                future = self.executor.submit(self.bring, key)
+                self.loading[key] = future
+                future.add_done_callback(lambda _: self.loading.pop(key, None))
+            return future
+
+    def preload(self, ckpt_path: str, vocab_path: str = "", model_cfg=None) -> Future:
+        return self.prepare(model_key(ckpt_path, vocab_path, model_cfg))
+
+    def switch(self, ckpt_path: str, vocab_path: str = "", model_cfg=None, wait: bool = True):
+        """Make a model active once loaded, returns it if wait, else the future of it."""
+        key = model_key(ckpt_path, vocab_path, model_cfg)
+        with self.lock:
+            self.requested_key = key
+            future = self.prepare(key)
+
+        def activate(future):
+            with self.lock:
+                if future.exception() is None and self.requested_key == key:
+                    self.active_key = key
+
+        if not wait:
+            future.add_done_callback(activate)
+            return future
+        model = future.result()
+        activate(future)
+        return model
+
+    @contextlib.contextmanager
+    def use(self, ckpt_path: str | None = None, vocab_path: str = "", model_cfg=None):
+        """The active model (or the given one), kept on device for the duration of a request."""
+        with self.lock:
+            key = self.active_key if ckpt_path is None else model_key(ckpt_path, vocab_path, model_cfg)
+            if key is None:
+                raise RuntimeError("No active model, switch to one first")
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+        try:
+            yield self.prepare(key).result()
+        finally:
+            with self.lock:
+                self.in_use[key] -= 1
+                if not self.in_use[key]:
+                    del self.in_use[key]
+
+    def stats(self):
+        with self.lock:
+            resident = [
+                dict(
+                    checkpoint=key[0],
+                    vocab=key[1],
+                    config=key[2],
+                    device=str(model_device(model)),
+                    size_mb=round(model_bytes(model) / 1024**2, 1),
+                    in_use=self.in_use.get(key, 0),
+                    active=key == self.active_key,
+                )
+                for key, model in reversed(self.models.items())  # most recently used first
+            ]
+            loading = [key[0] for key in self.loading]
+        return dict(resident=resident, loading=loading)
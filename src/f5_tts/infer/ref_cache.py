@@ -0,0 +1,200 @@
+# Bounded caches for reference prompts
+# Repeated requests with the same reference audio skip decoding, silence clipping, resampling and mel extraction.
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class LRUCache:
+    """Thread-safe, size-bounded mapping with least recently used eviction and hit / miss counters."""
+
+    def __init__(self, max_items=128, on_evict=None):
+        self.max_items = max_items
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        evicted = []
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_items:
+                evicted.append(self.data.popitem(last=False))
+                self.evictions += 1
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        return dict(size=len(self.data), hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+# content hash of a file, memoized by (path, size, mtime) so that a known file is not re-read to hash it
+
+_file_hash_cache = LRUCache(max_items=4096)
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = _file_hash_cache.get(stat_key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        _file_hash_cache.put(stat_key, digest)
+    return digest
+
+
+class RefPrompt:
+    """Preprocessed reference prompt, everything infer_batch_process needs from the reference audio."""
+
+    def __init__(self, audio, mel, rms, ref_text=None, ref_text_tokens=None):
+        self.audio = audio  # 1 nw, trimmed, rms-normalized and resampled to target sample rate
+        self.mel = mel  # 1 n d, mel spectrogram of audio
+        self.rms = rms  # rms of the trimmed audio before normalization, used to restore the loudness of output
+        self.ref_text = ref_text  # normalized text used when no custom text is given, None if not known yet
+        self.ref_text_tokens = ref_text_tokens  # ref_text converted with convert_char_to_pinyin, if precomputed
+
+    def state_dict(self):
+        return dict(
+            audio=self.audio, mel=self.mel, rms=self.rms, ref_text=self.ref_text, ref_text_tokens=self.ref_text_tokens
+        )
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        return cls(
+            state_dict["audio"],
+            state_dict["mel"],
+            state_dict["rms"],
+            state_dict["ref_text"],
+            state_dict.get("ref_text_tokens"),
+        )
+
+    def save(self, path, metadata=None):
+        """Save as a safetensors artifact, tensors as is and the rest in the metadata header."""
+        from safetensors.torch import save_file
+
+        metadata = dict(
+            metadata or {},
+            rms=str(self.rms),
+            ref_text=json.dumps(self.ref_text, ensure_ascii=False),
+            ref_text_tokens=json.dumps(self.ref_text_tokens, ensure_ascii=False),
+        )
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        save_file({"audio": self.audio.contiguous(), "mel": self.mel.contiguous()}, tmp_path, metadata=metadata)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a safetensors artifact written by save(), returns (RefPrompt, metadata)."""
+        from safetensors import safe_open
+
+        with safe_open(path, framework="pt", device="cpu") as f:
+            metadata = f.metadata()
+            audio, mel = f.get_tensor("audio"), f.get_tensor("mel")
+        prompt = cls(
+            audio,
+            mel,
+            float(metadata["rms"]),
+            json.loads(metadata["ref_text"]),
+            json.loads(metadata["ref_text_tokens"]),
+        )
+        return prompt, metadata
+
+
+class RefPromptCache(LRUCache):
+    """
+    LRU cache of RefPrompt in memory, with an optional on-disk tier under `cache_dir` surviving restarts.
+    The disk tier keeps at most `max_disk_items` files, the least recently used (by mtime) are removed.
+    """
+
+    def __init__(self, max_items=64, cache_dir=None, max_disk_items=1024):
+        super().__init__(max_items=max_items)
+        self.cache_dir = cache_dir
+        self.max_disk_items = max_disk_items
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def get(self, key, default=None):
+        prompt = super().get(key)
+        if prompt is not None or self.cache_dir is None or not os.path.exists(self.disk_path(key)):
+            return default if prompt is None else prompt
+
+        prompt = RefPrompt.from_state_dict(torch.load(self.disk_path(key), map_location="cpu", weights_only=True))
+        try:
+            os.utime(self.disk_path(key))  # recently used, pruned last
+        except OSError:
+            pass
+        super().put(key, prompt)
+        with self.lock:
+            self.misses -= 1
+            self.disk_hits += 1
+        return prompt
+
+    def put(self, key, prompt):
+        super().put(key, prompt)
+        if self.cache_dir is not None:
+            # write then rename, so that a concurrent reader never sees a partial file
+            tmp_path = f"{self.disk_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            torch.save(prompt.state_dict(), tmp_path)
+            os.replace(tmp_path, self.disk_path(key))
+            self.prune_disk()
+
+    def prune_disk(self):
+        # the directory may be shared by processes, a file removed by another one meanwhile is skipped
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pt"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.max_disk_items:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - self.max_disk_items]:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            with self.lock:
+                self.disk_evictions += 1
+
+    def stats(self):
+        return dict(super().stats(), disk_hits=self.disk_hits, disk_evictions=self.disk_evictions)
@@ -8,9 +8,16 @@ from concurrent.futures import ThreadPoolExecutor
 os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"  # for MPS device compatibility
 sys.path.append(f"{os.path.dirname(os.path.abspath(__file__))}/../../third_party/BigVGAN/")
 
+import contextlib
+import functools
 import hashlib
+import json
+import math
+import queue
 import re
 import tempfile
+import threading
+import time
 from importlib.resources import files
 
 import matplotlib
@@ -21,6 +28,7 @@ matplotlib.use("Agg")
 import matplotlib.pylab as plt
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchaudio
 import tqdm
 from huggingface_hub import hf_hub_download
@@ -28,12 +36,19 @@ from pydub import AudioSegment, silence
 from transformers import pipeline
 from vocos import Vocos
 
+from f5_tts.infer.ref_cache import LRUCache, RefPrompt, RefPromptCache, file_hash
 from f5_tts.model import CFM
+from f5_tts.model.modules import MelSpec
 from f5_tts.model.utils import convert_char_to_pinyin, get_tokenizer
 
 
-_ref_audio_cache = {}
-_ref_text_cache = {}
+def _remove_temp_file(key, path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+_ref_audio_cache = LRUCache(max_items=256, on_evict=_remove_temp_file)
+_ref_text_cache = LRUCache(max_items=1024)
 
 device = (
     "cuda"
@@ -61,6 +76,11 @@ ode_method = "euler"
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
 sway_sampling_coef = -1.0
+uncond_interval = 1  # cfg uncond branch every n evaluations, 1 for exact cfg
+vocode_batch_frames = 16384  # padded mel frames per batched vocoder call
+# chunks of one request sampled together, without streaming or a batch scheduler, and only with a backbone that
+# masks batch padding (CFM.masks_batch_padding), otherwise shorter chunks would attend to the padding of longer ones
+chunk_batch_size = 1
 speed = 1.0
 fix_duration = None
 
@@ -194,9 +214,16 @@ def load_checkpoint(model, ckpt_path, device: str, dtype=None, use_ema=True):
             and not torch.cuda.get_device_name().endswith("[ZLUDA]")
             else torch.float32
         )
-    model = model.to(dtype)
+    # on device before loading, the weights are read to device and copied there, no round trip through the cpu
+    model = model.to(device, dtype)
 
     ckpt_type = ckpt_path.split(".")[-1]
+    if read_inference_checkpoint_metadata(ckpt_path) is not None:
+        # exported with export_inference_checkpoint, ema weights only, read lazily straight to device
+        model.load_state_dict(load_inference_state_dict(ckpt_path, device))
+        torch.cuda.empty_cache()
+        return model
+
     if ckpt_type == "safetensors":
         from safetensors.torch import load_file
 
@@ -227,7 +254,97 @@ def load_checkpoint(model, ckpt_path, device: str, dtype=None, use_ema=True):
     del checkpoint
     torch.cuda.empty_cache()
 
-    return model.to(device)
+    return model
+
+
+# inference only checkpoint, see export_cli.py
+
+inference_ckpt_format = "f5_tts_inference"
+
+
+def vocab_hash(vocab_char_map):
+    return hashlib.sha256("\n".join(vocab_char_map).encode("utf-8")).hexdigest()
+
+
+def read_inference_checkpoint_metadata(ckpt_path):
+    """Metadata header of a checkpoint exported with export_inference_checkpoint, None for any other checkpoint."""
+    if not ckpt_path.endswith(".safetensors"):
+        return None
+    from safetensors import safe_open
+
+    with safe_open(ckpt_path, framework="pt") as f:
+        metadata = f.metadata() or {}
+    if metadata.get("format") != inference_ckpt_format:
+        return None
+    return {key: json.loads(value) for key, value in metadata.items() if key != "format"}
+
+
+def load_inference_state_dict(ckpt_path, device):
+    from safetensors import safe_open
+
+    state_dict = {}
+    with safe_open(ckpt_path, framework="pt", device=device) as f:  # memory-mapped, each tensor read on demand
+        aliases = json.loads(f.metadata()["aliases"])
+        for key in f.keys():
+            state_dict[key] = f.get_tensor(key)
+    for alias, key in aliases.items():
+        state_dict[alias] = state_dict[key]
+    return state_dict
+
+
+def export_inference_checkpoint(ckpt_path, out_path, model_cfg: dict, vocab_file, dtype="float16", use_ema=True):
+    """
+    Export a training checkpoint for inference: only the ema (or online) weights, floating point ones cast to dtype,
+    identical tensors stored once, with the model config, vocab hash and mel settings in the safetensors header.
+    """
+    from safetensors.torch import load_file, save_file
+
+    if ckpt_path.endswith(".safetensors"):
+        checkpoint = load_file(ckpt_path, device="cpu")
+        checkpoint = {"ema_model_state_dict": checkpoint, "model_state_dict": checkpoint}
+    else:
+        checkpoint = torch.load(ckpt_path, map_location="cpu", weights_only=True, mmap=True)
+
+    if use_ema:
+        state_dict = {
+            k.replace("ema_model.", ""): v
+            for k, v in checkpoint["ema_model_state_dict"].items()
+            if k not in ["initted", "step"]
+        }
+    else:
+        state_dict = dict(checkpoint["model_state_dict"])
+    # patch for backward compatibility, 305e3ea
+    for key in ["mel_spec.mel_stft.mel_scale.fb", "mel_spec.mel_stft.spectrogram.window"]:
+        state_dict.pop(key, None)
+
+    tensors, aliases, by_content = {}, {}, {}
+    for key, tensor in state_dict.items():
+        if tensor.is_floating_point():
+            tensor = tensor.to(getattr(torch, dtype))
+        tensor = tensor.contiguous()
+        content = (
+            tuple(tensor.shape),
+            tensor.dtype,
+            hashlib.sha256(tensor.reshape(-1).view(torch.uint8).numpy().tobytes()).hexdigest(),
+        )
+        if content in by_content:
+            aliases[key] = by_content[content]
+        else:
+            by_content[content] = key
+            tensors[key] = tensor.clone()
+
+    vocab_char_map, _ = get_tokenizer(vocab_file, "custom")
+    metadata = dict(
+        format=inference_ckpt_format,
+        model=json.dumps(model_cfg),
+        mel_spec=json.dumps(model_cfg.get("mel_spec", {})),
+        vocab_hash=json.dumps(vocab_hash(vocab_char_map)),
+        dtype=json.dumps(dtype),
+        aliases=json.dumps(aliases),
+    )
+    save_file(tensors, f"{out_path}.tmp", metadata=metadata)
+    os.replace(f"{out_path}.tmp", out_path)
+    return len(tensors), len(aliases)
 
 
 # load model for inference
@@ -252,6 +369,13 @@ def load_model(
     print("model : ", ckpt_path, "\n")
 
     vocab_char_map, vocab_size = get_tokenizer(vocab_file, tokenizer)
+    metadata = read_inference_checkpoint_metadata(ckpt_path)
+    if metadata is not None:
+        if metadata["vocab_hash"] != vocab_hash(vocab_char_map):
+            raise ValueError(f"{ckpt_path} was exported with another vocab than {vocab_file}")
+        if metadata["mel_spec"].get("mel_spec_type", mel_spec_type) != mel_spec_type:
+            raise ValueError(f"{ckpt_path} was exported for {metadata['mel_spec']['mel_spec_type']} mels")
+
     model = CFM(
         transformer=model_cls(**model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels),
         mel_spec_kwargs=dict(
@@ -297,15 +421,11 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=print):
     show_info("Converting audio...")
 
     # Compute a hash of the reference audio file
-    with open(ref_audio_orig, "rb") as audio_file:
-        audio_data = audio_file.read()
-        audio_hash = hashlib.md5(audio_data).hexdigest()
+    audio_hash = file_hash(ref_audio_orig)
 
-    global _ref_audio_cache
-
-    if audio_hash in _ref_audio_cache:
+    ref_audio = _ref_audio_cache.get(audio_hash)
+    if ref_audio is not None and os.path.exists(ref_audio):
         show_info("Using cached preprocessed reference audio...")
-        ref_audio = _ref_audio_cache[audio_hash]
 
     else:  # first pass, do preprocess
         with tempfile.NamedTemporaryFile(suffix=".wav", **tempfile_kwargs) as f:
@@ -348,32 +468,151 @@ def preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=print):
         ref_audio = temp_path
 
         # Cache the processed reference audio
-        _ref_audio_cache[audio_hash] = ref_audio
+        _ref_audio_cache.put(audio_hash, ref_audio)
 
     if not ref_text.strip():
-        global _ref_text_cache
-        if audio_hash in _ref_text_cache:
+        cached_ref_text = _ref_text_cache.get(audio_hash)
+        if cached_ref_text is not None:
             # Use cached asr transcription
             show_info("Using cached reference text...")
-            ref_text = _ref_text_cache[audio_hash]
+            ref_text = cached_ref_text
         else:
             show_info("No reference text provided, transcribing reference audio...")
             ref_text = transcribe(ref_audio)
             # Cache the transcribed text (not caching custom ref_text, enabling users to do manual tweak)
-            _ref_text_cache[audio_hash] = ref_text
+            _ref_text_cache.put(audio_hash, ref_text)
     else:
         show_info("Using custom reference text...")
 
+    ref_text = normalize_ref_text(ref_text)
+
+    print("\nref_text  ", ref_text)
+
+    return ref_audio, ref_text
+
+
+def normalize_ref_text(ref_text):
     # Ensure ref_text ends with a proper sentence-ending punctuation
     if not ref_text.endswith(". ") and not ref_text.endswith("。"):
         if ref_text.endswith("."):
             ref_text += " "
         else:
             ref_text += ". "
+    return ref_text
 
-    print("\nref_text  ", ref_text)
 
-    return ref_audio, ref_text
+# reference prompt: trimmed waveform, mel, rms and transcript, cached across requests
+# set F5_TTS_REF_CACHE_DIR to keep the cache on disk as well, at most F5_TTS_REF_CACHE_MAX_FILES files
+
+ref_prompt_cache = RefPromptCache(
+    max_items=64,
+    cache_dir=os.environ.get("F5_TTS_REF_CACHE_DIR"),
+    max_disk_items=int(os.environ.get("F5_TTS_REF_CACHE_MAX_FILES", 1024)),
+)
+
+
+def make_ref_prompt(audio, sr, mel_spec, ref_text=None, target_rms=target_rms):
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio))).item()
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    if sr != target_sample_rate:
+        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+        audio = resampler(audio)
+
+    with torch.inference_mode():
+        mel = mel_spec(audio.to(mel_spec.dummy.device)).permute(0, 2, 1).cpu()
+
+    return RefPrompt(audio, mel, rms, ref_text=ref_text)
+
+
+def get_ref_prompt(
+    ref_audio_orig,
+    ref_text,
+    model_obj,
+    mel_spec_type=mel_spec_type,
+    cache=ref_prompt_cache,
+    cache_key=None,
+    prompt_file=None,
+    show_info=print,
+    target_rms=target_rms,
+):
+    """
+    Preprocess reference audio and text into a RefPrompt, served from `cache` for repeated references.
+
+    Args:
+        cache_key (str): stable key of the reference (e.g. a speaker id), content hash of the file if not given.
+        prompt_file (str): artifact written by precompute_ref_prompt, loaded instead of preprocessing if it exists.
+
+    Returns:
+        (RefPrompt, str): the prompt, and the normalized reference text to use.
+    """
+    use_prompt_file = prompt_file is not None and os.path.exists(prompt_file)
+    if use_prompt_file:
+        prompt_file_key = f"{os.path.abspath(prompt_file)}_{os.stat(prompt_file).st_mtime_ns}"
+        cache_key = hashlib.md5(prompt_file_key.encode("utf-8")).hexdigest()
+    key = f"{cache_key or file_hash(ref_audio_orig)}_{mel_spec_type}"
+
+    prompt = cache.get(key)
+    if prompt is None and use_prompt_file:
+        prompt, metadata = RefPrompt.load(prompt_file)
+        if metadata.get("mel_spec_type") == mel_spec_type:
+            show_info("Using precomputed reference prompt...")
+            cache.put(key, prompt)
+        else:
+            prompt = None
+
+    if prompt is None:
+        ref_audio, processed_ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text, show_info=show_info)
+        audio, sr = torchaudio.load(ref_audio)
+        transcript = None if ref_text.strip() else processed_ref_text
+        prompt = make_ref_prompt(audio, sr, model_obj.mel_spec, ref_text=transcript, target_rms=target_rms)
+        cache.put(key, prompt)
+        return prompt, processed_ref_text
+
+    show_info("Using cached reference prompt...")
+    if ref_text.strip():
+        show_info("Using custom reference text...")
+    elif prompt.ref_text is not None:
+        ref_text = prompt.ref_text
+    else:
+        show_info("No reference text provided, transcribing reference audio...")
+        prompt.ref_text = normalize_ref_text(
+            transcribe({"raw": prompt.audio[0].numpy(), "sampling_rate": target_sample_rate})
+        )
+        cache.put(key, prompt)
+        ref_text = prompt.ref_text
+
+    return prompt, normalize_ref_text(ref_text)
+
+
+def precompute_ref_prompt(ref_audio_orig, ref_text, prompt_file, mel_spec_type=mel_spec_type, device=device):
+    """
+    Preprocess a reference once and save it as a safetensors artifact, for a fixed voice that is then served by
+    get_ref_prompt(prompt_file=...) without any per-request preprocessing, also right after a restart.
+    Stores the trimmed waveform, its mel spectrogram, the rms gain, the normalized ref_text and its tokens.
+    """
+    mel_spec = MelSpec(
+        n_fft=n_fft,
+        hop_length=hop_length,
+        win_length=win_length,
+        n_mel_channels=n_mel_channels,
+        target_sample_rate=target_sample_rate,
+        mel_spec_type=mel_spec_type,
+    ).to(device)
+
+    ref_audio, ref_text = preprocess_ref_audio_text(ref_audio_orig, ref_text)
+    audio, sr = torchaudio.load(ref_audio)
+    prompt = make_ref_prompt(audio, sr, mel_spec, ref_text=ref_text)
+
+    # same spacing as applied to ref_text in infer_batch_process
+    text = ref_text + " " if len(ref_text[-1].encode("utf-8")) == 1 else ref_text
+    prompt.ref_text_tokens = convert_char_to_pinyin([text])[0]
+
+    prompt.save(prompt_file, metadata=dict(mel_spec_type=mel_spec_type))
+    return prompt
 
 
 # infer process: chunk text -> infer batches [i.e. infer_batch_process()]
@@ -396,9 +635,14 @@ def infer_process(
     speed=speed,
     fix_duration=fix_duration,
     device=device,
+    uncond_interval=uncond_interval,
+    chunk_batch_size=chunk_batch_size,
 ):
     # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
+    if isinstance(ref_audio, RefPrompt):
+        audio, sr = ref_audio.audio, target_sample_rate
+    else:
+        audio, sr = torchaudio.load(ref_audio)
     max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (22 - audio.shape[-1] / sr) * speed)
     gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
     for i, gen_text in enumerate(gen_text_batches):
@@ -408,7 +652,7 @@ def infer_process(
     show_info(f"Generating audio in {len(gen_text_batches)} batches...")
     return next(
         infer_batch_process(
-            (audio, sr),
+            ref_audio if isinstance(ref_audio, RefPrompt) else (audio, sr),
             ref_text,
             gen_text_batches,
             model_obj,
@@ -423,10 +667,187 @@ def infer_process(
             speed=speed,
             fix_duration=fix_duration,
             device=device,
+            uncond_interval=uncond_interval,
+            chunk_batch_size=chunk_batch_size,
         )
     )
 
 
+# prepare text tokens and total duration (in mel frames) of a single chunk
+
+
+def prepare_chunk(ref_text, gen_text, ref_audio_len, speed=speed, fix_duration=fix_duration, ref_text_tokens=None):
+    local_speed = speed
+    if len(gen_text.encode("utf-8")) < 10:
+        local_speed = 0.3
+
+    # Prepare the text, reuse precomputed reference tokens if any
+    if ref_text_tokens is not None:
+        final_text_list = [ref_text_tokens + convert_char_to_pinyin([gen_text])[0]]
+    else:
+        text_list = [ref_text + gen_text]
+        final_text_list = convert_char_to_pinyin(text_list)
+
+    if fix_duration is not None:
+        duration = int(fix_duration * target_sample_rate / hop_length)
+    else:
+        # Calculate duration
+        ref_text_len = len(ref_text.encode("utf-8"))
+        gen_text_len = len(gen_text.encode("utf-8"))
+        duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / local_speed)
+
+    return final_text_list, duration
+
+
+# streaming latency metrics
+
+
+class StreamMetrics:
+    """Latency of one streaming infer_batch_process call, filled in as audio is yielded."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.time_to_first_audio = None  # seconds from the call until the first audio samples are yielded
+        self.total_time = None
+        self.audio_duration = 0.0  # seconds of audio yielded
+
+    def reset(self):
+        self.__init__()
+
+    def on_audio(self, num_samples, sample_rate=target_sample_rate):
+        if self.time_to_first_audio is None:
+            self.time_to_first_audio = time.perf_counter() - self.start
+        self.audio_duration += num_samples / sample_rate
+
+    def on_finish(self):
+        self.total_time = time.perf_counter() - self.start
+
+    @property
+    def rtf(self):
+        return self.total_time / self.audio_duration if self.total_time and self.audio_duration else None
+
+    def __repr__(self):
+        return (
+            f"StreamMetrics(time_to_first_audio={self.time_to_first_audio}, total_time={self.total_time}, "
+            f"audio_duration={self.audio_duration}, rtf={self.rtf})"
+        )
+
+
+# cross-fade assembly, overlap-add of consecutive waves into preallocated buffers
+
+
+@functools.lru_cache(maxsize=16)
+def fade_windows(num_samples, dtype=np.float32):
+    """Linear (fade_out, fade_in) ramps of num_samples, cached and read-only."""
+    fade_out = np.linspace(1, 0, num_samples, dtype=dtype)
+    fade_in = np.linspace(0, 1, num_samples, dtype=dtype)
+    fade_out.flags.writeable = False
+    fade_in.flags.writeable = False
+    return fade_out, fade_in
+
+
+def overlap_add(out, pos, wave, overlap):
+    """Write wave into out so that it cross-fades into the `overlap` samples before pos, returns the new end."""
+    if overlap > 0:
+        fade_out, fade_in = fade_windows(overlap, out.dtype)
+        faded = out[pos - overlap : pos]
+        faded *= fade_out
+        faded += wave[:overlap] * fade_in
+    end = pos + len(wave) - overlap
+    out[pos:end] = wave[overlap:]
+    return end
+
+
+def cross_fade_concat(waves, cross_fade_duration=cross_fade_duration, sample_rate=target_sample_rate):
+    """Join waves with cross-fading, each overlap is the cross-fade length capped by the audio on both sides."""
+    cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+    overlaps, total = [], 0
+    for wave in waves:
+        overlap = min(cross_fade_samples, total, len(wave))
+        overlaps.append(overlap)
+        total += len(wave) - overlap
+
+    out = np.empty(total, dtype=np.result_type(*{wave.dtype for wave in waves}))
+    pos = 0
+    for wave, overlap in zip(waves, overlaps):
+        pos = overlap_add(out, pos, wave, overlap)
+    return out
+
+
+def cross_fade_stream(waves, cross_fade_duration=cross_fade_duration, sample_rate=target_sample_rate):
+    """Incremental cross_fade_concat, yields audio as waves arrive, holding back only the samples the next wave
+    fades into."""
+    cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+    tail = None
+    for wave in waves:
+        if tail is None or len(tail) == 0:
+            if cross_fade_samples == 0:
+                yield wave
+                continue
+            tail, overlap = wave[:0], 0
+        else:
+            overlap = min(len(tail), len(wave))
+
+        out = np.empty(len(tail) + len(wave) - overlap, dtype=np.result_type(tail.dtype, wave.dtype))
+        out[: len(tail)] = tail
+        overlap_add(out, len(tail), wave, overlap)
+
+        holdback = min(cross_fade_samples, len(out))
+        if len(out) > holdback:
+            yield out[: len(out) - holdback]
+        tail = out[len(out) - holdback :].copy()
+
+    if tail is not None and len(tail) > 0:
+        yield tail
+
+
+# vocode the mels of many chunks in one padded batch
+
+
+mel_pad_value = math.log(1e-5)  # log mel of silence, the clamp floor of MelSpec
+
+
+def vocode_batch(mels, vocoder, mel_spec_type=mel_spec_type, gains=None, max_batch_frames=vocode_batch_frames):
+    """Vocode mels (list of d n tensors of differing n) in padded batches, one vocoder call and one device-to-host
+    transfer per batch.
+
+    Consecutive mels are grouped so that each batch holds at most max_batch_frames padded frames. Shorter mels are
+    padded with silence at the end, and their waves trimmed by the padded frames. `gains` are optional per item
+    volume factors. Returns a list of numpy waves.
+    """
+    gains = [1.0] * len(mels) if gains is None else [float(gain) for gain in gains]
+    groups, group, group_frames = [], [], 0
+    for i, mel in enumerate(mels):
+        if group and max(group_frames, mel.shape[-1]) * (len(group) + 1) > max_batch_frames:
+            groups.append(group)
+            group, group_frames = [], 0
+        group.append(i)
+        group_frames = max(group_frames, mel.shape[-1])
+    if group:
+        groups.append(group)
+
+    waves = []
+    for group in groups:
+        num_frames = [mels[i].shape[-1] for i in group]
+        max_frames = max(num_frames)
+        batch = torch.stack([F.pad(mels[i], (0, max_frames - mels[i].shape[-1]), value=mel_pad_value) for i in group])
+
+        with torch.inference_mode():
+            if mel_spec_type == "vocos":
+                batch_waves = vocoder.decode(batch)
+            elif mel_spec_type == "bigvgan":
+                batch_waves = vocoder(batch).squeeze(1)
+            if any(gains[i] != 1.0 for i in group):
+                gain = torch.tensor([gains[i] for i in group], dtype=batch_waves.dtype, device=batch_waves.device)
+                batch_waves = batch_waves * gain.unsqueeze(1)
+            batch_waves = batch_waves.cpu().numpy()
+
+        # the vocoder output grows by hop_length per frame, whatever it does at the edges
+        num_samples = batch_waves.shape[-1]
+        waves.extend(wave[: num_samples - (max_frames - n) * hop_length] for wave, n in zip(batch_waves, num_frames))
+    return waves
+
+
 # infer batches
 
 
@@ -448,18 +869,52 @@ def infer_batch_process(
     device=None,
     streaming=False,
     chunk_size=2048,
+    batch_scheduler=None,
+    max_pending_chunks=None,
+    metrics=None,
+    uncond_interval=1,
+    chunk_batch_size=1,
 ):
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
+    """Generate audio for each text chunk of gen_text_batches and join them with cross-fading.
 
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+    Without streaming, yields once (final_wave, sample_rate, combined_spectrogram).
+    With streaming, yields (wave_piece, sample_rate) of at most chunk_size samples as soon as each chunk is vocoded.
+    The ODE solve of the next chunk runs in the background while the current one is vocoded and consumed, and the
+    cross-fade is applied on the fly, holding back only cross_fade_duration of audio. Pass a StreamMetrics as
+    `metrics` to get the time to first audio.
+
+    With a `batch_scheduler`, chunks are sampled by the shared DynamicBatchScheduler instead, with at most
+    `max_pending_chunks` of them submitted ahead of the consumer (all at once if None).
+
+    `uncond_interval` > 1 runs the unconditional cfg branch only every that many ODE evaluations and reuses its
+    last output in between, faster at some cost in quality.
+
+    Otherwise (no streaming, no scheduler) up to `chunk_batch_size` chunks are sampled together in one batched ODE
+    solve, overlapped with text preparation of the next chunks and vocoding of the previous batch. Chunks are only
+    batched if the model masks batch padding (CFM.masks_batch_padding), one at a time otherwise.
+    """
+    if metrics is not None:
+        metrics.reset()
+
+    ref_text_tokens = None
+    if isinstance(ref_audio, RefPrompt):
+        # preprocessed prompt, reuse its mel instead of recomputing it at every chunk
+        audio, rms, ref_mel = ref_audio.audio.to(device), ref_audio.rms, ref_audio.mel.to(device)
+        if ref_audio.ref_text == ref_text:
+            ref_text_tokens = ref_audio.ref_text_tokens
+    else:
+        audio, sr = ref_audio
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+
+        rms = torch.sqrt(torch.mean(torch.square(audio)))
+        if rms < target_rms:
+            audio = audio * target_rms / rms
+        if sr != target_sample_rate:
+            resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
+            audio = resampler(audio)
+        audio = audio.to(device)
+        ref_mel = None
 
     generated_waves = []
     spectrograms = []
@@ -467,116 +922,179 @@ def infer_batch_process(
     if len(ref_text[-1].encode("utf-8")) == 1:
         ref_text = ref_text + " "
 
-    def process_batch(gen_text):
-        local_speed = speed
-        if len(gen_text.encode("utf-8")) < 10:
-            local_speed = 0.3
+    ref_audio_len = audio.shape[-1] // hop_length
 
-        # Prepare the text
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
+    gain = rms / target_rms if rms < target_rms else 1.0  # restore the loudness of a quiet reference
 
-        ref_audio_len = audio.shape[-1] // hop_length
-        if fix_duration is not None:
-            duration = int(fix_duration * target_sample_rate / hop_length)
-        else:
-            # Calculate duration
-            ref_text_len = len(ref_text.encode("utf-8"))
-            gen_text_len = len(gen_text.encode("utf-8"))
-            duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / local_speed)
+    def prepare(gen_text):
+        return prepare_chunk(ref_text, gen_text, ref_audio_len, speed, fix_duration, ref_text_tokens=ref_text_tokens)
 
-        # inference
+    def sample_prepared(prepared):
+        # chunks of prepared [(final_text_list, duration), ...] in one batched ODE solve, returns their mels (d n)
+        texts = [final_text_list[0] for final_text_list, _ in prepared]
+        durations = [duration for _, duration in prepared]
         with torch.inference_mode():
+            cond = ref_mel
+            if cond is None:
+                cond = audio if len(prepared) == 1 else model_obj.mel_spec(audio).permute(0, 2, 1)
+            if len(prepared) > 1:
+                # sample() lengthens durations shorter than the text / reference and caps them, slice at its own
+                lens = torch.full((len(prepared),), cond.shape[1], device=cond.device, dtype=torch.long)
+                durations = model_obj.sample_duration(texts, lens, torch.tensor(durations, device=cond.device))
             generated, _ = model_obj.sample(
-                cond=audio,
-                text=final_text_list,
-                duration=duration,
+                cond=cond.expand(len(prepared), *cond.shape[1:]),
+                text=texts,
+                duration=durations[0] if len(prepared) == 1 else durations,
                 steps=nfe_step,
                 cfg_strength=cfg_strength,
                 sway_sampling_coef=sway_sampling_coef,
+                uncond_interval=uncond_interval,
             )
             del _
 
             generated = generated.to(torch.float32)  # generated mel spectrogram
-            generated = generated[:, ref_audio_len:, :]
-            generated = generated.permute(0, 2, 1)
-            if mel_spec_type == "vocos":
-                generated_wave = vocoder.decode(generated)
-            elif mel_spec_type == "bigvgan":
-                generated_wave = vocoder(generated)
-            if rms < target_rms:
-                generated_wave = generated_wave * rms / target_rms
-
-            # wav -> numpy
-            generated_wave = generated_wave.squeeze().cpu().numpy()
+            if len(prepared) == 1:
+                return [generated[0, ref_audio_len:, :].permute(1, 0)]
+            return [
+                generated[i, ref_audio_len:duration, :].permute(1, 0) for i, duration in enumerate(durations.tolist())
+            ]
+
+    def sample_batch(gen_text):
+        return sample_prepared([prepare(gen_text)])[0]
+
+    def vocode(generated):
+        return vocode_batch([generated], vocoder, mel_spec_type, gains=[gain])[0]
+
+    def pipelined_waves():
+        # ODE solves run one chunk ahead in a background thread, while this thread vocodes and delivers
+        solved = queue.Queue(maxsize=1)
+        stop_event = threading.Event()
+
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    solved.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def solve():
+            try:
+                for gen_text in gen_text_batches:
+                    if not put(sample_batch(gen_text)):
+                        return
+            except Exception as e:
+                put(e)
+
+        solver = threading.Thread(target=solve, daemon=True)
+        solver.start()
+        try:
+            for _ in progress.tqdm(gen_text_batches) if progress is not None else gen_text_batches:
+                generated = solved.get()
+                if isinstance(generated, Exception):
+                    raise generated
+                yield vocode(generated)
+        finally:
+            # also when the consumer closes early: wait for the solve in progress, so that no sample runs on the
+            # model once the caller has released it
+            stop_event.set()
+            while solver.is_alive():
+                try:
+                    solved.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            solver.join()
+            while not solved.empty():
+                solved.get_nowait()
+
+    def scheduled_results():
+        # hand chunks over to the shared scheduler, which batches them with chunks of other requests
+        # at most max_pending_chunks are in flight, so a slow consumer does not get ahead of itself on the GPU
+        def submit(gen_text):
+            return batch_scheduler.submit(
+                audio,
+                ref_text,
+                gen_text,
+                rms=rms,
+                speed=speed,
+                fix_duration=fix_duration,
+                ref_mel=ref_mel,
+                ref_text_tokens=ref_text_tokens,
+            )
 
-            if streaming:
-                for j in range(0, len(generated_wave), chunk_size):
-                    yield generated_wave[j : j + chunk_size], target_sample_rate
-            else:
-                generated_cpu = generated[0].cpu().numpy()
-                del generated
-                yield generated_wave, generated_cpu
+        lookahead = max_pending_chunks or len(gen_text_batches)
+        futures = [submit(gen_text) for gen_text in gen_text_batches[:lookahead]]
+        indices = range(len(gen_text_batches))
+        for i in progress.tqdm(indices) if progress is not None else indices:
+            if i + lookahead < len(gen_text_batches):
+                futures.append(submit(gen_text_batches[i + lookahead]))
+            yield futures[i].result()
+
+    def pipelined_results():
+        # three stages overlap: text of upcoming chunks is prepared on a CPU thread, chunk_batch_size chunks at a
+        # time are sampled with one batched ODE solve, and each sampled batch is vocoded and copied to the host by
+        # another thread (on its own CUDA stream) while the next batch is sampled. Results come in chunk order.
+        vocode_stream = torch.cuda.Stream(device=audio.device) if audio.device.type == "cuda" else None
+
+        def postprocess(mels, sampled):
+            with torch.cuda.stream(vocode_stream) if vocode_stream is not None else contextlib.nullcontext():
+                if vocode_stream is not None:
+                    vocode_stream.wait_event(sampled)
+                waves = vocode_batch(mels, vocoder, mel_spec_type, gains=[gain] * len(mels))
+                return waves, torch.cat(mels, dim=-1).cpu().numpy()
+
+        with ThreadPoolExecutor(max_workers=1) as text_pool, ThreadPoolExecutor(max_workers=1) as vocode_pool:
+            prepared = [text_pool.submit(prepare, gen_text) for gen_text in gen_text_batches]
+            postprocessed = []
+            batch_size = max(chunk_batch_size, 1) if getattr(model_obj, "masks_batch_padding", False) else 1
+            starts = range(0, len(gen_text_batches), batch_size)
+            for start in progress.tqdm(starts) if progress is not None else starts:
+                mels = sample_prepared([future.result() for future in prepared[start : start + batch_size]])
+                sampled = None
+                if vocode_stream is not None:
+                    sampled = torch.cuda.Event()
+                    sampled.record()
+                    for mel in mels:
+                        mel.record_stream(vocode_stream)
+                postprocessed.append(vocode_pool.submit(postprocess, mels, sampled))
+            for future in postprocessed:
+                yield future.result()
 
     if streaming:
-        for gen_text in progress.tqdm(gen_text_batches) if progress is not None else gen_text_batches:
-            for chunk in process_batch(gen_text):
-                yield chunk
+        if batch_scheduler is not None:
+            waves = (generated_wave for generated_wave, _ in scheduled_results())
+        else:
+            waves = pipelined_waves()
+        for wave in cross_fade_stream(waves, cross_fade_duration):
+            for j in range(0, len(wave), chunk_size):
+                if metrics is not None:
+                    metrics.on_audio(len(wave[j : j + chunk_size]))
+                yield wave[j : j + chunk_size], target_sample_rate
+        if metrics is not None:
+            metrics.on_finish()
+        return
+
+    if batch_scheduler is not None:
+        for generated_wave, generated_mel_spec in scheduled_results():
+            generated_waves.append(generated_wave)
+            spectrograms.append(generated_mel_spec)
     else:
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(process_batch, gen_text) for gen_text in gen_text_batches]
-            for future in progress.tqdm(futures) if progress is not None else futures:
-                result = future.result()
-                if result:
-                    generated_wave, generated_mel_spec = next(result)
-                    generated_waves.append(generated_wave)
-                    spectrograms.append(generated_mel_spec)
-
-        if generated_waves:
-            if cross_fade_duration <= 0:
-                # Simply concatenate
-                final_wave = np.concatenate(generated_waves)
-            else:
-                # Combine all generated waves with cross-fading
-                final_wave = generated_waves[0]
-                for i in range(1, len(generated_waves)):
-                    prev_wave = final_wave
-                    next_wave = generated_waves[i]
-
-                    # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-                    cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-                    cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-                    if cross_fade_samples <= 0:
-                        # No overlap possible, concatenate
-                        final_wave = np.concatenate([prev_wave, next_wave])
-                        continue
-
-                    # Overlapping parts
-                    prev_overlap = prev_wave[-cross_fade_samples:]
-                    next_overlap = next_wave[:cross_fade_samples]
-
-                    # Fade out and fade in
-                    fade_out = np.linspace(1, 0, cross_fade_samples)
-                    fade_in = np.linspace(0, 1, cross_fade_samples)
-
-                    # Cross-faded overlap
-                    cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-                    # Combine
-                    new_wave = np.concatenate(
-                        [prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]]
-                    )
-
-                    final_wave = new_wave
-
-            # Create a combined spectrogram
-            combined_spectrogram = np.concatenate(spectrograms, axis=1)
-
-            yield final_wave, target_sample_rate, combined_spectrogram
+        for waves, spectrogram in pipelined_results():
+            generated_waves.extend(waves)
+            spectrograms.append(spectrogram)
 
-        else:
-            yield None, target_sample_rate, None
+    if generated_waves:
+        # Combine all generated waves with cross-fading, in a single preallocated buffer
+        final_wave = cross_fade_concat(generated_waves, cross_fade_duration)
+
+        # Create a combined spectrogram
+        combined_spectrogram = np.concatenate(spectrograms, axis=1)
+
+        yield final_wave, target_sample_rate, combined_spectrogram
+
+    else:
+        yield None, target_sample_rate, None
 
 
 # remove silence from generated wav
@@ -20,7 +20,9 @@ from f5_tts.model.modules import (
     ConvPositionEmbedding,
     DiTBlock,
     TimestepEmbedding,
+    get_packed_attn_segments,
     get_pos_embed_indices,
+    get_segment_pos_indices,
     precompute_freqs_cis,
 )
 
@@ -84,15 +86,33 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim=out_dim)
 
-    def forward(self, x: float["b n d"], cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
-        if drop_audio_cond:  # cfg for cond audio
-            cond = torch.zeros_like(cond)
+    def embed_cond_text(self, cond: float["b n d"], text_embed: float["b n d"], drop_audio_cond=False):  # noqa: F722
+        # proj(x, cond, text) = W_x @ x + W_ct @ (cond, text) + b, the second part is fixed across ode steps
+        if drop_audio_cond:  # cfg for cond audio, zeroed cond adds nothing
+            return F.linear(text_embed, self.proj.weight[:, self.mel_dim * 2 :], self.proj.bias)
+        return F.linear(torch.cat((cond, text_embed), dim=-1), self.proj.weight[:, self.mel_dim :], self.proj.bias)
 
-        x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
-        x = self.conv_pos_embed(x) + x
+    def forward(
+        self,
+        x: float["b n d"],  # noqa: F722
+        cond: float["b n d"],  # noqa: F722
+        text_embed: float["b n d"],  # noqa: F722
+        drop_audio_cond=False,
+        cond_text_embed: float["b n d"] | None = None,  # noqa: F722
+        mask: bool["b n"] | None = None,  # noqa: F722
+    ):
+        if cond_text_embed is not None:  # precomputed with embed_cond_text, only project the noised audio
+            x = F.linear(x, self.proj.weight[:, : self.mel_dim]) + cond_text_embed
+        else:
+            if drop_audio_cond:  # cfg for cond audio
+                cond = torch.zeros_like(cond)
+
+            x = self.proj(torch.cat((x, cond, text_embed), dim=-1))
+        x = self.conv_pos_embed(x, mask=mask) + x
         return x
 
 
@@ -129,13 +149,15 @@ class DiT(nn.Module):
         self.text_embed = TextEmbedding(
             text_num_embeds, text_dim, mask_padding=text_mask_padding, conv_layers=conv_layers
         )
-        self.text_cond, self.text_uncond = None, None  # text cache
+        self.text_cond, self.text_uncond = None, None  # text and cond audio projection cache
         self.input_embed = InputEmbedding(mel_dim, text_dim, dim)
 
         self.rotary_embed = RotaryEmbedding(dim_head)
 
         self.dim = dim
         self.depth = depth
+        self.attn_backend = attn_backend
+        self.attn_mask_enabled = attn_mask_enabled
 
         self.transformer_blocks = nn.ModuleList(
             [
@@ -190,24 +212,61 @@ class DiT(nn.Module):
         drop_audio_cond: bool = False,
         drop_text: bool = False,
         cache: bool = True,
+        seg_ids=None,  # b n, packed rows only
+        positions=None,  # b n, packed rows only
+        mask=None,  # b n, inference (cache) only
     ):
         seq_len = x.shape[1]
         if cache:
+            # text embedding and cond audio do not change across ode steps, keep their input projection
             if drop_text:
                 if self.text_uncond is None:
-                    self.text_uncond = self.text_embed(text, seq_len, drop_text=True)
-                text_embed = self.text_uncond
+                    text_embed = self.get_batch_text_embed(text, seq_len, mask, drop_text=True)
+                    self.text_uncond = self.input_embed.embed_cond_text(cond, text_embed, drop_audio_cond)
+                cond_text_embed = self.text_uncond
             else:
                 if self.text_cond is None:
-                    self.text_cond = self.text_embed(text, seq_len, drop_text=False)
-                text_embed = self.text_cond
+                    text_embed = self.get_batch_text_embed(text, seq_len, mask, drop_text=False)
+                    self.text_cond = self.input_embed.embed_cond_text(cond, text_embed, drop_audio_cond)
+                cond_text_embed = self.text_cond
+            x = self.input_embed(x, cond, None, cond_text_embed=cond_text_embed, mask=mask)
+        elif seg_ids is not None:
+            text_embed = self.get_packed_text_embed(text, seg_ids, positions, drop_text=drop_text)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond, mask=seg_ids > 0)
         else:
             text_embed = self.text_embed(text, seq_len, drop_text=drop_text)
-
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
+            x = self.input_embed(x, cond, text_embed, drop_audio_cond=drop_audio_cond)
 
         return x
 
+    def get_batch_text_embed(self, text, seq_len, mask=None, drop_text: bool = False):
+        # rows of different durations (mask) embedded each at its own length, as if sampled alone: the text convnext
+        # blocks normalize over the whole sequence (GRN), a row must not see the padding up to the longest one
+        if mask is None or bool(mask.all()):
+            return self.text_embed(text, seq_len, drop_text=drop_text)
+        text_embed = None
+        for i, row_len in enumerate(mask.sum(dim=-1).tolist()):
+            row_embed = self.text_embed(text[i : i + 1], row_len, drop_text=drop_text)
+            if text_embed is None:
+                text_embed = row_embed.new_zeros(text.shape[0], seq_len, row_embed.shape[-1])
+            text_embed[i, :row_len] = row_embed[0]
+        return text_embed
+
+    def get_packed_text_embed(self, text, seg_ids, positions, drop_text: bool = False):
+        # text of packed rows (b n, see pack_segment_text) embedded one segment per row, then put back in place:
+        # the text convnext blocks normalize over the whole sequence (GRN), segments must not share it
+        valid = seg_ids > 0
+        is_start = valid & (positions == 0)
+        segment = (is_start.flatten().cumsum(0) - 1).view_as(seg_ids)[valid]
+        seg_len = int(positions[valid].max()) + 1
+        seg_text = text.new_full((int(is_start.sum()), seg_len), -1)
+        seg_text[segment, positions[valid]] = text[:, : seg_ids.shape[1]][valid]
+
+        seg_text_embed = self.text_embed(seg_text, seg_len, drop_text=drop_text)
+        text_embed = seg_text_embed.new_zeros(*seg_ids.shape, seg_text_embed.shape[-1])
+        text_embed[valid] = seg_text_embed[segment, positions[valid]]
+        return text_embed
+
     def clear_cache(self):
         self.text_cond, self.text_uncond = None, None
 
@@ -222,6 +281,7 @@ class DiT(nn.Module):
         drop_text: bool = False,  # cfg for text
         cfg_infer: bool = False,  # cfg inference, pack cond & uncond forward
         cache: bool = False,
+        seg_ids: int["b n"] | None = None,  # packed rows, segment of each frame, 0 for padding  # noqa: F722
     ):
         batch, seq_len = x.shape[0], x.shape[1]
         if time.ndim == 0:
@@ -230,15 +290,40 @@ class DiT(nn.Module):
         # t: conditioning time, text: text, x: noised audio + cond audio + text
         t = self.time_embed(time)
         if cfg_infer:  # pack cond & uncond forward: b n d -> 2b n d
-            x_cond = self.get_input_embed(x, cond, text, drop_audio_cond=False, drop_text=False, cache=cache)
-            x_uncond = self.get_input_embed(x, cond, text, drop_audio_cond=True, drop_text=True, cache=cache)
+            assert seg_ids is None, "packed rows are for training only"
+            x_cond = self.get_input_embed(
+                x, cond, text, drop_audio_cond=False, drop_text=False, cache=cache, mask=mask if cache else None
+            )
+            x_uncond = self.get_input_embed(
+                x, cond, text, drop_audio_cond=True, drop_text=True, cache=cache, mask=mask if cache else None
+            )
             x = torch.cat((x_cond, x_uncond), dim=0)
             t = torch.cat((t, t), dim=0)
             mask = torch.cat((mask, mask), dim=0) if mask is not None else None
+        elif seg_ids is not None:
+            # packed rows, each segment with its own positions from 0, and seen by none of the others
+            positions = get_segment_pos_indices(seg_ids)
+            x = self.get_input_embed(
+                x, cond, text, drop_audio_cond, drop_text, cache=False, seg_ids=seg_ids, positions=positions
+            )
         else:
-            x = self.get_input_embed(x, cond, text, drop_audio_cond=drop_audio_cond, drop_text=drop_text, cache=cache)
+            x = self.get_input_embed(
+                x,
+                cond,
+                text,
+                drop_audio_cond=drop_audio_cond,
+                drop_text=drop_text,
+                cache=cache,
+                mask=mask if cache else None,
+            )
 
-        rope = self.rotary_embed.forward_from_seq_len(seq_len)
+        if seg_ids is not None:
+            freqs, xpos_scale = self.rotary_embed.forward(positions.flatten())
+            rope = (freqs.reshape(batch, 1, seq_len, -1), xpos_scale)  # 'b 1 n d', broadcast over heads
+            segments = get_packed_attn_segments(seg_ids, self.attn_backend)
+        else:
+            rope = self.rotary_embed.forward_from_seq_len(seq_len)
+            segments = None
 
         if self.long_skip_connection is not None:
             residual = x
@@ -246,9 +331,11 @@ class DiT(nn.Module):
         for block in self.transformer_blocks:
             if self.checkpoint_activations:
                 # https://pytorch.org/docs/stable/checkpoint.html#torch.utils.checkpoint.checkpoint
-                x = torch.utils.checkpoint.checkpoint(self.ckpt_wrapper(block), x, t, mask, rope, use_reentrant=False)
+                x = torch.utils.checkpoint.checkpoint(
+                    self.ckpt_wrapper(block), x, t, mask, rope, segments, use_reentrant=False
+                )
             else:
-                x = block(x, t, mask=mask, rope=rope)
+                x = block(x, t, mask=mask, rope=rope, segments=segments)
 
         if self.long_skip_connection is not None:
             x = self.long_skip_connection(torch.cat((x, residual), dim=-1))
@@ -19,6 +19,7 @@ from torch.nn.utils.rnn import pad_sequence
 from torchdiffeq import odeint
 
 from f5_tts.model.modules import MelSpec
+from f5_tts.model.solvers import SOLVERS, solve_ode
 from f5_tts.model.utils import (
     default,
     exists,
@@ -27,6 +28,8 @@ from f5_tts.model.utils import (
     list_str_to_idx,
     list_str_to_tensor,
     mask_from_frac_lengths,
+    pack_segment_text,
+    segments_to_ids,
 )
 
 
@@ -38,7 +41,7 @@ class CFM(nn.Module):
         odeint_kwargs: dict = dict(
             # atol = 1e-5,
             # rtol = 1e-5,
-            method="euler"  # 'midpoint'
+            method="euler"  # 'midpoint', 'heun', 'rk4', 'ab2', 'dpmpp_2m' (see solvers.py) or any torchdiffeq method
         ),
         audio_drop_prob=0.3,
         cond_drop_prob=0.2,
@@ -79,6 +82,39 @@ class CFM(nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    @property
+    def masks_batch_padding(self):
+        """
+        Whether the backbone masks out the padding of batched items in attention, so that an item sampled in a batch
+        with longer ones gives the same output as sampled alone (with the same seed).
+        Otherwise only items of the same duration should be batched.
+        """
+        return getattr(self.transformer, "attn_mask_enabled", False)
+
+    def encode_text(self, text: int["b nt"] | list[str], device=None):  # noqa: F722
+        if isinstance(text, list):
+            if exists(self.vocab_char_map):
+                text = list_str_to_idx(text, self.vocab_char_map)
+            else:
+                text = list_str_to_tensor(text)
+        return text.to(device) if device is not None else text
+
+    def sample_duration(
+        self,
+        text: int["b nt"] | list[str],  # noqa: F722
+        lens: int["b"],  # noqa: F821
+        duration: int | int["b"],  # noqa: F821
+        max_duration=4096,
+    ):
+        """Frames sample() generates for each item, reference included, e.g. to slice its output."""
+        text = self.encode_text(text, lens.device)
+        if isinstance(duration, int):
+            duration = torch.full(lens.shape, duration, device=lens.device, dtype=torch.long)
+        duration = torch.maximum(
+            torch.maximum((text != -1).sum(dim=-1), lens) + 1, duration
+        )  # duration at least text/audio prompt length plus one token, so something is generated
+        return duration.clamp(max=max_duration)
+
     @torch.no_grad()
     def sample(
         self,
@@ -98,6 +134,8 @@ class CFM(nn.Module):
         duplicate_test=False,
         t_inter=0.1,
         edit_mask=None,
+        uncond_interval=1,  # run the cfg uncond branch every n evaluations, reuse its last output in between
+        return_trajectory=False,  # also return all steps+1 ode states, otherwise only the final one is kept
     ):
         self.eval()
         # raw wave
@@ -116,10 +154,7 @@ class CFM(nn.Module):
         # text
 
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            text = self.encode_text(text, device)
             assert text.shape[0] == batch
 
         # duration
@@ -128,13 +163,7 @@ class CFM(nn.Module):
         if edit_mask is not None:
             cond_mask = cond_mask & edit_mask
 
-        if isinstance(duration, int):
-            duration = torch.full((batch,), duration, device=device, dtype=torch.long)
-
-        duration = torch.maximum(
-            torch.maximum((text != -1).sum(dim=-1), lens) + 1, duration
-        )  # duration at least text/audio prompt length plus one token, so something is generated
-        duration = duration.clamp(max=max_duration)
+        duration = self.sample_duration(text, lens, duration, max_duration=max_duration)
         max_duration = duration.amax()
 
         # duplicate test corner for inner time step oberservation
@@ -158,7 +187,11 @@ class CFM(nn.Module):
 
         # neural ode
 
+        nfe, null_pred = 0, None
+
         def fn(t, x):
+            nonlocal nfe, null_pred
+
             # at each step, conditioning is fixed
             # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
 
@@ -176,7 +209,23 @@ class CFM(nn.Module):
                 )
                 return pred
 
+            # reuse the last uncond prediction, trading some quality for (almost) half the compute of this step
+            if null_pred is not None and nfe % uncond_interval != 0:
+                nfe += 1
+                pred = self.transformer(
+                    x=x,
+                    cond=step_cond,
+                    text=text,
+                    time=t,
+                    mask=mask,
+                    drop_audio_cond=False,
+                    drop_text=False,
+                    cache=True,
+                )
+                return pred + (pred - null_pred) * cfg_strength
+
             # predict flow (cond and uncond), for classifier-free guidance
+            nfe += 1
             pred_cfg = self.transformer(
                 x=x,
                 cond=step_cond,
@@ -214,10 +263,18 @@ class CFM(nn.Module):
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+        # built-in fixed-grid solvers (see solvers.py), torchdiffeq for adaptive methods or extra odeint options
+        if self.odeint_kwargs.keys() == {"method"} and self.odeint_kwargs["method"] in SOLVERS:
+            sampled, trajectory = solve_ode(
+                fn, y0, t, method=self.odeint_kwargs["method"], return_trajectory=return_trajectory
+            )
+        else:
+            trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+            sampled = trajectory[-1]
+            if not return_trajectory:
+                trajectory = None
         self.transformer.clear_cache()
 
-        sampled = trajectory[-1]
         out = sampled
         out = torch.where(cond_mask, cond, out)
 
@@ -234,6 +291,8 @@ class CFM(nn.Module):
         *,
         lens: int["b"] | None = None,  # noqa: F821
         noise_scheduler: str | None = None,
+        seg_starts: int["b s"] | None = None,  # packed rows, see collate_packed_fn  # noqa: F722
+        seg_lens: int["b s"] | None = None,  # noqa: F722
     ):
         # handle raw wave
         if inp.ndim == 2:
@@ -245,21 +304,34 @@ class CFM(nn.Module):
 
         # handle text as string
         if isinstance(text, list):
+            if exists(seg_lens):  # packed rows, text of each segment
+                text = [segment_text for row_text in text for segment_text in row_text]
             if exists(self.vocab_char_map):
                 text = list_str_to_idx(text, self.vocab_char_map).to(device)
             else:
                 text = list_str_to_tensor(text).to(device)
+            if exists(seg_lens):
+                text = pack_segment_text(text, seg_starts, seg_lens, seq_len)
             assert text.shape[0] == batch
 
-        # lens and mask
-        if not exists(lens):
-            lens = torch.full((batch,), seq_len, device=device)
+        if exists(seg_lens):
+            # packed rows, masks and a random span to mask out within each segment
+            seg_ids = segments_to_ids(seg_starts, seg_lens, seq_len)
+            mask = seg_ids > 0
+            frac_lengths = torch.zeros(seg_lens.shape, device=self.device).float().uniform_(*self.frac_lengths_mask)
+            rand_span_mask = mask_from_frac_lengths(seg_lens, frac_lengths, seg_starts=seg_starts, length=seq_len)
+        else:
+            seg_ids = None
+
+            # lens and mask
+            if not exists(lens):
+                lens = torch.full((batch,), seq_len, device=device)
 
-        mask = lens_to_mask(lens, length=seq_len)  # useless here, as collate_fn will pad to max length in batch
+            mask = lens_to_mask(lens, length=seq_len)  # useless here, as collate_fn will pad to max length in batch
 
-        # get a random span to mask out for training conditionally
-        frac_lengths = torch.zeros((batch,), device=self.device).float().uniform_(*self.frac_lengths_mask)
-        rand_span_mask = mask_from_frac_lengths(lens, frac_lengths)
+            # get a random span to mask out for training conditionally
+            frac_lengths = torch.zeros((batch,), device=self.device).float().uniform_(*self.frac_lengths_mask)
+            rand_span_mask = mask_from_frac_lengths(lens, frac_lengths)
 
         if exists(mask):
             rand_span_mask &= mask
@@ -270,7 +342,7 @@ class CFM(nn.Module):
         # x0 is gaussian noise
         x0 = torch.randn_like(x1)
 
-        # time step
+        # time step, shared by the segments of a packed row (time modulation is per row)
         time = torch.rand((batch,), dtype=dtype, device=self.device)
         # TODO. noise_scheduler
 
@@ -291,8 +363,16 @@ class CFM(nn.Module):
             drop_text = False
 
         # apply mask will use more memory; might adjust batchsize or batchsampler long sequence threshold
+        packed = dict(seg_ids=seg_ids) if exists(seg_ids) else {}  # DiT only
         pred = self.transformer(
-            x=φ, cond=cond, text=text, time=time, drop_audio_cond=drop_audio_cond, drop_text=drop_text, mask=mask
+            x=φ,
+            cond=cond,
+            text=text,
+            time=time,
+            drop_audio_cond=drop_audio_cond,
+            drop_text=drop_text,
+            mask=mask,
+            **packed,
         )
 
         # flow matching loss
@@ -1,13 +1,15 @@
+import hashlib
 import json
+import os
 from importlib.resources import files
 
+import numpy as np
 import torch
-import torch.nn.functional as F
 import torchaudio
 from datasets import Dataset as Dataset_
-from datasets import load_from_disk
+from datasets import concatenate_datasets, load_from_disk
 from torch import nn
-from torch.utils.data import Dataset, Sampler
+from torch.utils.data import Dataset, Sampler, SequentialSampler
 from tqdm import tqdm
 
 from f5_tts.model.modules import MelSpec
@@ -101,6 +103,7 @@ class CustomDataset(Dataset):
         self.win_length = win_length
         self.mel_spec_type = mel_spec_type
         self.preprocessed_mel = preprocessed_mel
+        self.resamplers = {}  # source sample rate -> Resample, built once per worker
 
         if not preprocessed_mel:
             self.mel_spectrogram = default(
@@ -122,6 +125,19 @@ class CustomDataset(Dataset):
             return self.durations[index] * self.target_sample_rate / self.hop_length
         return self.data[index]["duration"] * self.target_sample_rate / self.hop_length
 
+    def get_frame_lens(self):
+        """Frame lengths of all samples at once, for DynamicBatchSampler."""
+        durations = self.durations if self.durations is not None else self.data["duration"]
+        return np.asarray(durations, dtype=np.float64) * self.target_sample_rate / self.hop_length
+
+    def dataset_fingerprint(self):
+        fingerprint = getattr(self.data, "_fingerprint", None)
+        if fingerprint is None or self.durations is None:
+            return fingerprint
+        # the separately provided durations (duration.json) can change without the dataset, e.g. on re-preparation
+        durations = np.ascontiguousarray(self.durations, dtype=np.float64)
+        return f"{fingerprint}_{hashlib.md5(durations.tobytes()).hexdigest()}"
+
     def __len__(self):
         return len(self.data)
 
@@ -149,8 +165,11 @@ class CustomDataset(Dataset):
 
             # resample if necessary
             if source_sample_rate != self.target_sample_rate:
-                resampler = torchaudio.transforms.Resample(source_sample_rate, self.target_sample_rate)
-                audio = resampler(audio)
+                if source_sample_rate not in self.resamplers:
+                    self.resamplers[source_sample_rate] = torchaudio.transforms.Resample(
+                        source_sample_rate, self.target_sample_rate
+                    )
+                audio = self.resamplers[source_sample_rate](audio)
 
             # to mel spectrogram
             mel_spec = self.mel_spectrogram(audio)
@@ -162,7 +181,104 @@ class CustomDataset(Dataset):
         }
 
 
+class MemmapMelDataset(Dataset):
+    """
+    Dataset over mels precomputed by train/datasets/prepare_mel.py, stored in <mel_dir>:
+    mel.bin     - float16 mels of all samples, each a contiguous (n_mel_channels, frames) block
+    index.npy   - int64 (offset, frames) of each sample in mel.bin, in dataset order, 0 frames if skipped
+    meta.json   - mel settings the mels were extracted with
+
+    Mels are returned as views of the memory-mapped file, no audio decoding nor STFT in the workers.
+    """
+
+    def __init__(
+        self,
+        custom_dataset: Dataset,
+        mel_dir: str,
+        durations=None,
+        target_sample_rate=24_000,
+        hop_length=256,
+        n_mel_channels=100,
+        n_fft=1024,
+        win_length=1024,
+        mel_spec_type="vocos",
+    ):
+        self.data = custom_dataset
+        self.mel_dir = mel_dir
+        self.durations = durations
+        self.target_sample_rate = target_sample_rate
+        self.hop_length = hop_length
+        self.n_mel_channels = n_mel_channels
+
+        with open(f"{mel_dir}/meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        expected = dict(
+            target_sample_rate=target_sample_rate,
+            hop_length=hop_length,
+            n_mel_channels=n_mel_channels,
+            n_fft=n_fft,
+            win_length=win_length,
+            mel_spec_type=mel_spec_type,
+        )
+        mismatch = {k: (meta[k], v) for k, v in expected.items() if meta[k] != v}
+        if mismatch:
+            raise ValueError(f"Mels in {mel_dir} were extracted with other settings (stored, expected): {mismatch}")
+
+        self.index = np.load(f"{mel_dir}/index.npy")
+        if len(self.index) != len(self.data):
+            raise ValueError(f"Mels in {mel_dir} are for {len(self.index)} samples, dataset has {len(self.data)}")
+        self.mels = None  # memory-mapped in each worker on first access
+
+    def __getstate__(self):
+        # never pickle the mapping itself to DataLoader workers, that would copy the whole file
+        state = self.__dict__.copy()
+        state["mels"] = None
+        return state
+
+    def get_frame_len(self, index):
+        return int(self.index[index, 1])
+
+    def get_frame_lens(self):
+        return self.index[:, 1].astype(np.float64)
+
+    def dataset_fingerprint(self):
+        fingerprint = getattr(self.data, "_fingerprint", None)
+        index_path = os.path.abspath(f"{self.mel_dir}/index.npy")
+        return fingerprint and f"{fingerprint}_{index_path}_{os.path.getmtime(index_path)}"
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if self.mels is None:
+            self.mels = np.memmap(f"{self.mel_dir}/mel.bin", dtype=np.float16, mode="c")
+
+        while True:
+            duration = self.durations[index] if self.durations is not None else self.data[index]["duration"]
+            offset, frames = (int(v) for v in self.index[index])
+
+            # filter by given length
+            if 0.3 <= duration <= 30 and frames > 0:
+                break  # valid
+
+            index = (index + 1) % len(self.data)
+
+        mel_spec = torch.from_numpy(self.mels[offset : offset + self.n_mel_channels * frames]).view(
+            self.n_mel_channels, frames
+        )
+
+        return {
+            "mel_spec": mel_spec,
+            "text": self.data[index]["text"],
+        }
+
+
 # Dynamic Batch Sampler
+# bump when the content of cached batch plans changes, plans of other versions are then recomputed
+BATCH_PLAN_VERSION = 3
+BATCH_PLAN_KEYS = ("indices", "bucket_starts", "bucket_max_frames", "bucket_batch_sizes", "frame_lens")
+
+
 class DynamicBatchSampler(Sampler[list[int]]):
     """Extension of Sampler that will do the following:
     1.  Change the batch size (essentially number of sequences)
@@ -170,76 +286,186 @@ class DynamicBatchSampler(Sampler[list[int]]):
         than a certain threshold.
     2.  Make sure the padding efficiency in the batch is high.
     3.  Shuffle batches each epoch while maintaining reproducibility.
+
+    Samples are bucketed by frame length (geometric buckets of bucket_ratio), each bucket with a batch size such that
+    its padded batches fit frames_threshold. Each epoch, samples are shuffled within their bucket before being cut
+    into batches, and batches are shuffled across buckets. Consecutive groups of num_replicas batches, dispatched one
+    per rank by accelerate, are of similar frame counts so that no rank waits for the others at each step.
+    With packing, batches are instead random samples of about frames_threshold frames in total (max_samples unused),
+    packed into rows by collate_packed_fn.
+    The bucketed plan is computed with vectorized ops and cached in cache_dir, keyed by dataset fingerprint and
+    settings, so that restarts skip reading all frame lengths.
     """
 
     def __init__(
-        self, sampler: Sampler[int], frames_threshold: int, max_samples=0, random_seed=None, drop_residual: bool = False
+        self,
+        sampler: Sampler[int],
+        frames_threshold: int,
+        max_samples=0,
+        random_seed=None,
+        drop_residual: bool = False,
+        num_replicas: int = 1,
+        bucket_ratio: float = 1.05,
+        cache_dir: str | None = None,
+        packing: bool = False,
     ):
         self.sampler = sampler
         self.frames_threshold = frames_threshold
         self.max_samples = max_samples
         self.random_seed = random_seed
+        self.drop_residual = drop_residual
+        self.num_replicas = num_replicas
+        self.bucket_ratio = bucket_ratio
+        self.packing = packing
         self.epoch = 0
 
-        indices, batches = [], []
-        data_source = self.sampler.data_source
-
-        for idx in tqdm(
-            self.sampler, desc="Sorting with sampler... if slow, check whether dataset is provided with duration"
-        ):
-            indices.append((idx, data_source.get_frame_len(idx)))
-        indices.sort(key=lambda elem: elem[1])
+        plan = self.load_plan(cache_dir)
+        self.indices = plan["indices"]  # samples sorted by bucket
+        self.bucket_starts = plan["bucket_starts"]
+        self.bucket_max_frames = plan["bucket_max_frames"]
+        self.bucket_batch_sizes = plan["bucket_batch_sizes"]
+        self.frame_lens = plan["frame_lens"]
 
-        batch = []
-        batch_frames = 0
-        for idx, frame_len in tqdm(
-            indices, desc=f"Creating dynamic batches with {frames_threshold} audio frames per gpu"
-        ):
-            if batch_frames + frame_len <= self.frames_threshold and (max_samples == 0 or len(batch) < max_samples):
-                batch.append(idx)
-                batch_frames += frame_len
-            else:
-                if len(batch) > 0:
-                    batches.append(batch)
-                if frame_len <= self.frames_threshold:
-                    batch = [idx]
-                    batch_frames = frame_len
-                else:
-                    batch = []
-                    batch_frames = 0
-
-        if not drop_residual and len(batch) > 0:
-            batches.append(batch)
-
-        del indices
-        self.batches = batches
+        if packing:
+            self.num_batches = int(np.ceil(self.frame_lens.sum() / frames_threshold))
+        else:
+            bucket_sizes = np.diff(np.append(self.bucket_starts, len(self.indices)))
+            full, residual = bucket_sizes // self.bucket_batch_sizes, bucket_sizes % self.bucket_batch_sizes
+            self.num_batches = int(full.sum() + (0 if drop_residual else np.count_nonzero(residual)))
 
         # Ensure even batches with accelerate BatchSamplerShard cls under frame_per_batch setting
         self.drop_last = True
 
+    def plan_key(self, data_source):
+        fingerprint = getattr(data_source, "dataset_fingerprint", lambda: None)()
+        if fingerprint is None or not isinstance(self.sampler, SequentialSampler):
+            return None
+        settings = (
+            f"v{BATCH_PLAN_VERSION}_{fingerprint}_{len(data_source)}_"
+            f"{self.frames_threshold}_{self.max_samples}_{self.bucket_ratio}"
+        )
+        return hashlib.md5(settings.encode()).hexdigest()
+
+    def load_plan(self, cache_dir):
+        data_source = self.sampler.data_source
+        key = self.plan_key(data_source) if cache_dir else None
+        cache_path = os.path.join(cache_dir, f"batch_plan_{key}.npz") if key else None
+        if cache_path and os.path.exists(cache_path):
+            with np.load(cache_path) as plan:
+                plan = dict(plan)
+            if all(name in plan for name in BATCH_PLAN_KEYS):
+                return plan
+
+        plan = self.compute_plan(data_source)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"  # ranks may write at once, each renames its own
+            np.savez(tmp_path, **plan)
+            os.replace(tmp_path, cache_path)
+        return plan
+
+    def compute_plan(self, data_source):
+        if isinstance(self.sampler, SequentialSampler):
+            indices = np.arange(len(data_source), dtype=np.int64)
+        else:
+            indices = np.fromiter(self.sampler, dtype=np.int64)
+
+        if hasattr(data_source, "get_frame_lens"):
+            frame_lens = data_source.get_frame_lens()[indices]
+        else:
+            frame_lens = np.fromiter(
+                (
+                    data_source.get_frame_len(idx)
+                    for idx in tqdm(
+                        indices, desc="Sorting with sampler... if slow, check whether dataset is provided with duration"
+                    )
+                ),
+                dtype=np.float64,
+                count=len(indices),
+            )
+
+        # samples skipped by prepare_mel have no frames, __getitem__ would replace them with another, larger one
+        keep = (frame_lens > 0) & (frame_lens <= self.frames_threshold)
+        indices, frame_lens = indices[keep], frame_lens[keep]
+
+        buckets = np.floor(np.log(frame_lens / frame_lens.min()) / np.log(self.bucket_ratio)).astype(np.int64)
+        order = np.lexsort((frame_lens, buckets))
+        indices, frame_lens, buckets = indices[order], frame_lens[order], buckets[order]
+
+        bucket_starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        bucket_max_frames = np.maximum.reduceat(frame_lens, bucket_starts)
+        bucket_batch_sizes = np.maximum(np.floor(self.frames_threshold / bucket_max_frames), 1).astype(np.int64)
+        if self.max_samples > 0:
+            bucket_batch_sizes = np.minimum(bucket_batch_sizes, self.max_samples)
+
+        return dict(
+            indices=indices,
+            bucket_starts=bucket_starts,
+            bucket_max_frames=bucket_max_frames,
+            bucket_batch_sizes=bucket_batch_sizes,
+            frame_lens=frame_lens,
+        )
+
     def set_epoch(self, epoch: int) -> None:
         """Sets the epoch for this sampler."""
         self.epoch = epoch
 
     def __iter__(self):
         # Use both random_seed and epoch for deterministic but different shuffling per epoch
-        if self.random_seed is not None:
-            g = torch.Generator()
-            g.manual_seed(self.random_seed + self.epoch)
-            # Use PyTorch's random permutation for better reproducibility across PyTorch versions
-            indices = torch.randperm(len(self.batches), generator=g).tolist()
-            batches = [self.batches[i] for i in indices]
-        else:
-            batches = self.batches
-        return iter(batches)
+        rng = np.random.default_rng(self.random_seed + self.epoch) if self.random_seed is not None else None
+
+        if self.packing:
+            # consecutive samples, by their first frame in the shuffled order, into num_batches equal frame ranges
+            order = rng.permutation(len(self.indices)) if rng is not None else np.arange(len(self.indices))
+            frame_starts = np.cumsum(self.frame_lens[order]) - self.frame_lens[order]
+            batch_ids = np.floor(frame_starts * self.num_batches / self.frame_lens.sum()).astype(np.int64)
+            batches = np.split(self.indices[order], np.flatnonzero(np.diff(batch_ids)) + 1)
+            return iter([batch.tolist() for batch in batches])
+
+        batches, costs = [], []
+        bucket_ends = np.append(self.bucket_starts[1:], len(self.indices))
+        for start, end, batch_size, max_frames in zip(
+            self.bucket_starts, bucket_ends, self.bucket_batch_sizes, self.bucket_max_frames
+        ):
+            members = self.indices[start:end]
+            if rng is not None:
+                members = rng.permutation(members)
+            num_full = len(members) // batch_size
+            bucket_batches = np.split(members[: num_full * batch_size], num_full) if num_full else []
+            if not self.drop_residual and len(members) % batch_size:
+                bucket_batches.append(members[num_full * batch_size :])
+            batches.extend(bucket_batches)
+            costs.extend(len(batch) * max_frames for batch in bucket_batches)  # padded frames
+
+        order = rng.permutation(len(batches)) if rng is not None else np.arange(len(batches))
+        if self.num_replicas > 1:
+            # groups of num_replicas batches of similar cost, one batch per rank, the cheapest leftover ones last
+            by_cost = order[np.argsort(np.asarray(costs)[order], kind="stable")]
+            num_leftover = len(by_cost) % self.num_replicas
+            groups = by_cost[num_leftover:].reshape(-1, self.num_replicas)
+            if rng is not None:
+                groups = groups[rng.permutation(len(groups))]
+            order = np.concatenate([groups.reshape(-1), by_cost[:num_leftover]])
+
+        return iter([batches[i].tolist() for i in order])
 
     def __len__(self):
-        return len(self.batches)
+        return self.num_batches
 
 
 # Load dataset
 
 
+def load_raw_dataset(data_path: str) -> Dataset_:
+    """raw.arrow of a prepared dataset, or its shards in order if prepared with prepare_sharded"""
+    shards_path = f"{data_path}/shards.json"
+    if os.path.exists(shards_path):
+        with open(shards_path, "r", encoding="utf-8") as f:
+            shards = json.load(f)["shards"]
+        return concatenate_datasets([Dataset_.from_file(f"{data_path}/{shard}") for shard in shards])
+    return Dataset_.from_file(f"{data_path}/raw.arrow")
+
+
 def load_dataset(
     dataset_name: str,
     tokenizer: str = "pinyin",
@@ -251,6 +477,8 @@ def load_dataset(
     """
     dataset_type    - "CustomDataset" if you want to use tokenizer name and default data path to load for train_dataset
                     - "CustomDatasetPath" if you just want to pass the full path to a preprocessed dataset without relying on tokenizer
+    audio_type      - "raw" to extract mels from audio on the fly
+                    - "memmap_mel" to read mels precomputed by train/datasets/prepare_mel.py into <data_path>/mel
     """
 
     print("Loading dataset ...")
@@ -261,7 +489,7 @@ def load_dataset(
             try:
                 train_dataset = load_from_disk(f"{rel_data_path}/raw")
             except:  # noqa: E722
-                train_dataset = Dataset_.from_file(f"{rel_data_path}/raw.arrow")
+                train_dataset = load_raw_dataset(rel_data_path)
             preprocessed_mel = False
         elif audio_type == "mel":
             train_dataset = Dataset_.from_file(f"{rel_data_path}/mel.arrow")
@@ -269,6 +497,10 @@ def load_dataset(
         with open(f"{rel_data_path}/duration.json", "r", encoding="utf-8") as f:
             data_dict = json.load(f)
         durations = data_dict["duration"]
+        if audio_type == "memmap_mel":
+            return MemmapMelDataset(
+                load_raw_dataset(rel_data_path), f"{rel_data_path}/mel", durations=durations, **mel_spec_kwargs
+            )
         train_dataset = CustomDataset(
             train_dataset,
             durations=durations,
@@ -278,10 +510,16 @@ def load_dataset(
         )
 
     elif dataset_type == "CustomDatasetPath":
+        if audio_type == "memmap_mel":
+            with open(f"{dataset_name}/duration.json", "r", encoding="utf-8") as f:
+                durations = json.load(f)["duration"]
+            return MemmapMelDataset(
+                load_raw_dataset(dataset_name), f"{dataset_name}/mel", durations=durations, **mel_spec_kwargs
+            )
         try:
             train_dataset = load_from_disk(f"{dataset_name}/raw")
         except:  # noqa: E722
-            train_dataset = Dataset_.from_file(f"{dataset_name}/raw.arrow")
+            train_dataset = load_raw_dataset(dataset_name)
 
         with open(f"{dataset_name}/duration.json", "r", encoding="utf-8") as f:
             data_dict = json.load(f)
@@ -311,13 +549,12 @@ def collate_fn(batch):
     mel_lengths = torch.LongTensor([spec.shape[-1] for spec in mel_specs])
     max_mel_length = mel_lengths.amax()
 
-    padded_mel_specs = []
-    for spec in mel_specs:
-        padding = (0, max_mel_length - spec.size(-1))
-        padded_spec = F.pad(spec, padding, value=0)
-        padded_mel_specs.append(padded_spec)
+    # pad straight into the batch, one copy per mel (also casting float16 memory-mapped mels)
+    padded_mel_specs = torch.zeros(len(mel_specs), mel_specs[0].shape[0], max_mel_length)
+    for i, spec in enumerate(mel_specs):
+        padded_mel_specs[i, :, : spec.shape[-1]] = spec
 
-    mel_specs = torch.stack(padded_mel_specs)
+    mel_specs = padded_mel_specs
 
     text = [item["text"] for item in batch]
     text_lengths = torch.LongTensor([len(item) for item in text])
@@ -328,3 +565,44 @@ def collate_fn(batch):
         text=text,
         text_lengths=text_lengths,
     )
+
+
+def collate_packed_fn(batch, pack_length=4096, segment_gap=30):
+    """
+    Pack the mels of a batch into rows of pack_length frames (first fit decreasing) instead of padding each of them,
+    for DiT training with packed rows (CFM.forward seg_starts, seg_lens). Segments of a row are separated by
+    segment_gap masked frames, the receptive field of the ConvPositionEmbedding convolutions (kernel 31, twice),
+    so that no segment sees another. Rows are padded to the longest one, a mel longer than pack_length has its own.
+    """
+    mel_specs = [item["mel_spec"].squeeze(0) for item in batch]
+
+    rows, row_lengths = [], []
+    for i in sorted(range(len(mel_specs)), key=lambda i: -mel_specs[i].shape[-1]):
+        length = mel_specs[i].shape[-1]
+        for r, row_length in enumerate(row_lengths):
+            if row_length + segment_gap + length <= pack_length:
+                rows[r].append(i)
+                row_lengths[r] += segment_gap + length
+                break
+        else:
+            rows.append([i])
+            row_lengths.append(length)
+
+    packed_mel_specs = torch.zeros(len(rows), mel_specs[0].shape[0], max(row_lengths))
+    seg_starts = torch.zeros(len(rows), max(map(len, rows)), dtype=torch.long)
+    seg_lens = torch.zeros_like(seg_starts)
+    for r, row in enumerate(rows):
+        start = 0
+        for s, i in enumerate(row):
+            length = mel_specs[i].shape[-1]
+            packed_mel_specs[r, :, start : start + length] = mel_specs[i]
+            seg_starts[r, s], seg_lens[r, s] = start, length
+            start += length + segment_gap
+
+    return dict(
+        mel=packed_mel_specs,
+        mel_lengths=torch.LongTensor(row_lengths),  # end of the last segment of each row
+        text=[[batch[i]["text"] for i in row] for row in rows],  # text of each segment of each row
+        seg_starts=seg_starts,
+        seg_lens=seg_lens,
+    )
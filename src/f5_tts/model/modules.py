@@ -184,7 +184,14 @@ class ConvPositionEmbedding(nn.Module):
             x = x.masked_fill(~mask, 0.0)
 
         x = x.permute(0, 2, 1)
-        x = self.conv1d(x)
+        if mask is None:
+            x = self.conv1d(x)
+        else:
+            # also between the convs, padding is no longer zero after the first one (bias) and the second one sees it
+            for layer in self.conv1d:
+                x = layer(x)
+                if isinstance(layer, nn.Mish):
+                    x = x.masked_fill(~mask.permute(0, 2, 1), 0.0)
         out = x.permute(0, 2, 1)
 
         if mask is not None:
@@ -222,6 +229,14 @@ def get_pos_embed_indices(start, length, max_pos, scale=1.0):
     return pos
 
 
+def get_segment_pos_indices(seg_ids: int["b n"]) -> int["b n"]:  # noqa: F722
+    # position of each frame within its segment of packed rows, segments being contiguous runs of the same id
+    idx = torch.arange(seg_ids.shape[1], device=seg_ids.device).expand_as(seg_ids)
+    is_start = F.pad(seg_ids[:, 1:] != seg_ids[:, :-1], (1, 0), value=True)
+    start = torch.where(is_start, idx, torch.zeros_like(idx)).cummax(dim=1).values
+    return idx - start
+
+
 # Global Response Normalization layer (Instance Normalization ?)
 
 
@@ -425,11 +440,12 @@ class Attention(nn.Module):
         mask: bool["b n"] | None = None,
         rope=None,  # rotary position embedding for x
         c_rope=None,  # rotary position embedding for c
+        segments=None,  # packed rows, see get_packed_attn_segments
     ) -> torch.Tensor:
         if c is not None:
             return self.processor(self, x, c=c, mask=mask, rope=rope, c_rope=c_rope)
         else:
-            return self.processor(self, x, mask=mask, rope=rope)
+            return self.processor(self, x, mask=mask, rope=rope, segments=segments)
 
 
 # Attention processor
@@ -439,6 +455,23 @@ if is_package_available("flash_attn"):
     from flash_attn import flash_attn_varlen_func, flash_attn_func
 
 
+def get_packed_attn_segments(seg_ids: int["b n"], attn_backend: str = "torch"):  # noqa: F722
+    """
+    Attention inputs restricting each frame of packed rows to its own segment (seg_ids, 0 for padding), computed once
+    per forward: (indices, cu_seqlens, max_seqlen) of the segments as varlen sequences for flash_attn, else a mask.
+    """
+    if attn_backend == "flash_attn":
+        # segments are contiguous and in order, so that the non padding frames flattened are their concatenation
+        indices = torch.nonzero(seg_ids.flatten(), as_tuple=True)[0]
+        row_offsets = torch.arange(seg_ids.shape[0], device=seg_ids.device)[:, None] * (seg_ids.max() + 1)
+        _, seqlens = torch.unique_consecutive((seg_ids + row_offsets).flatten()[indices], return_counts=True)
+        cu_seqlens = F.pad(seqlens.cumsum(0, dtype=torch.int32), (1, 0))
+        return indices, cu_seqlens, seqlens.max().item()
+
+    # padding attends to padding, so that no query is left without any key
+    return (seg_ids[:, :, None] == seg_ids[:, None, :]).unsqueeze(1)  # 'b n n -> b 1 n n'
+
+
 class AttnProcessor:
     def __init__(
         self,
@@ -459,6 +492,7 @@ class AttnProcessor:
         x: float["b n d"],  # noised input x
         mask: bool["b n"] | None = None,
         rope=None,  # rotary position embedding
+        segments=None,  # packed rows, attention within each segment only, see get_packed_attn_segments
     ) -> torch.FloatTensor:
         batch_size = x.shape[0]
 
@@ -495,7 +529,9 @@ class AttnProcessor:
 
         if self.attn_backend == "torch":
             # mask. e.g. inference got a batch with different target durations, mask out the padding
-            if self.attn_mask_enabled and mask is not None:
+            if segments is not None:  # whatever attn_mask_enabled, segments must not attend to each other
+                attn_mask = segments
+            elif self.attn_mask_enabled and mask is not None:
                 attn_mask = mask
                 attn_mask = attn_mask.unsqueeze(1).unsqueeze(1)  # 'b n -> b 1 1 n'
                 attn_mask = attn_mask.expand(batch_size, attn.heads, query.shape[-2], key.shape[-2])
@@ -508,7 +544,14 @@ class AttnProcessor:
             query = query.transpose(1, 2)  # [b, h, n, d] -> [b, n, h, d]
             key = key.transpose(1, 2)
             value = value.transpose(1, 2)
-            if self.attn_mask_enabled and mask is not None:
+            if segments is not None:  # whatever attn_mask_enabled, segments must not attend to each other
+                indices, cu_seqlens, max_seqlen = segments
+                seq_len = query.shape[1]
+                query, key, value = (t.reshape(-1, attn.heads, head_dim)[indices] for t in (query, key, value))
+                x = flash_attn_varlen_func(query, key, value, cu_seqlens, cu_seqlens, max_seqlen, max_seqlen)
+                x = pad_input(x, indices, batch_size, seq_len)
+                x = x.reshape(batch_size, -1, attn.heads * head_dim)
+            elif self.attn_mask_enabled and mask is not None:
                 query, indices, q_cu_seqlens, q_max_seqlen_in_batch, _ = unpad_input(query, mask)
                 key, _, k_cu_seqlens, k_max_seqlen_in_batch, _ = unpad_input(key, mask)
                 value, _, _, _, _ = unpad_input(value, mask)
@@ -677,12 +720,12 @@ class DiTBlock(nn.Module):
         self.ff_norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff = FeedForward(dim=dim, mult=ff_mult, dropout=dropout, approximate="tanh")
 
-    def forward(self, x, t, mask=None, rope=None):  # x: noised input, t: time embedding
+    def forward(self, x, t, mask=None, rope=None, segments=None):  # x: noised input, t: time embedding
         # pre-norm & modulation for attention input
         norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
 
         # attention
-        attn_output = self.attn(x=norm, mask=mask, rope=rope)
+        attn_output = self.attn(x=norm, mask=mask, rope=rope, segments=segments)
 
         # process attention output for input x
         x = x + gate_msa.unsqueeze(1) * attn_output
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import copy
 import gc
 import math
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import torch
 import torchaudio
@@ -16,10 +19,63 @@ from torch.utils.data import DataLoader, Dataset, SequentialSampler
 from tqdm import tqdm
 
 from f5_tts.model import CFM
-from f5_tts.model.dataset import DynamicBatchSampler, collate_fn
+from f5_tts.model.dataset import DynamicBatchSampler, collate_fn, collate_packed_fn
 from f5_tts.model.utils import default, exists
 
 
+# checkpoint writer
+
+
+class AsyncCheckpointWriter:
+    """
+    Writes checkpoints on a background thread, so that training only stalls for the device to host copy.
+
+    snapshot() copies the tensors of a checkpoint into pinned CPU buffers, reused from one save to the next,
+    and write() saves a snapshot to a temporary file renamed into place once complete.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint_writer")
+        self.buffers = {}
+        self.pending = []
+
+    def copy_to_buffers(self, obj, key=()):
+        if isinstance(obj, torch.Tensor):
+            buffer = self.buffers.get(key)
+            if buffer is None or buffer.shape != obj.shape or buffer.dtype != obj.dtype:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=torch.cuda.is_available())
+                self.buffers[key] = buffer
+            buffer.copy_(obj.detach(), non_blocking=True)
+            return buffer
+        if isinstance(obj, dict):
+            return {k: self.copy_to_buffers(v, key + (k,)) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.copy_to_buffers(v, key + (i,)) for i, v in enumerate(obj))
+        return copy.deepcopy(obj)
+
+    def snapshot(self, checkpoint):
+        self.wait()  # the buffers may still be read by the previous write
+        snapshot = self.copy_to_buffers(checkpoint)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()  # copies done before training changes the state again
+        return snapshot
+
+    def write(self, snapshot, path, on_saved=None):
+        def save():
+            torch.save(snapshot, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            if on_saved is not None:
+                on_saved()
+
+        self.pending.append(self.executor.submit(save))
+
+    def wait(self):
+        """Wait for pending writes, raising their errors if any."""
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
 # trainer
 
 
@@ -53,6 +109,8 @@ class Trainer:
         is_local_vocoder: bool = False,  # use local path vocoder
         local_vocoder_path: str = "",  # local vocoder path
         model_cfg_dict: dict = dict(),  # training config
+        async_checkpoint: bool = True,  # write checkpoints in background, from a copy in pinned cpu memory
+        pack_length: int | None = None,  # pack samples into rows of pack_length frames instead of padding, DiT only
     ):
         ddp_kwargs = DistributedDataParallelKwargs(find_unused_parameters=True)
 
@@ -116,10 +174,13 @@ class Trainer:
         self.keep_last_n_checkpoints = keep_last_n_checkpoints
         self.last_per_updates = default(last_per_updates, save_per_updates)
         self.checkpoint_path = default(checkpoint_path, "ckpts/test_f5-tts")
+        self.checkpoint_writer = AsyncCheckpointWriter() if async_checkpoint and self.is_main else None
+        self.checkpoint_snapshot = None  # (update, snapshot), shared by the last and the regular save of an update
 
         self.batch_size_per_gpu = batch_size_per_gpu
         self.batch_size_type = batch_size_type
         self.max_samples = max_samples
+        self.pack_length = pack_length
         self.grad_accumulation_steps = grad_accumulation_steps
         self.max_grad_norm = max_grad_norm
 
@@ -147,6 +208,8 @@ class Trainer:
     def save_checkpoint(self, update, last=False):
         self.accelerator.wait_for_everyone()
         if self.is_main:
+            if not last and self.keep_last_n_checkpoints == 0:
+                return
             checkpoint = dict(
                 model_state_dict=self.accelerator.unwrap_model(self.model).state_dict(),
                 optimizer_state_dict=self.optimizer.state_dict(),
@@ -157,27 +220,39 @@ class Trainer:
             if not os.path.exists(self.checkpoint_path):
                 os.makedirs(self.checkpoint_path)
             if last:
-                self.accelerator.save(checkpoint, f"{self.checkpoint_path}/model_last.pt")
-                print(f"Saved last checkpoint at update {update}")
+                path = f"{self.checkpoint_path}/model_last.pt"
+
+                def on_saved():
+                    print(f"Saved last checkpoint at update {update}")
             else:
-                if self.keep_last_n_checkpoints == 0:
-                    return
-                self.accelerator.save(checkpoint, f"{self.checkpoint_path}/model_{update}.pt")
-                if self.keep_last_n_checkpoints > 0:
-                    # Updated logic to exclude pretrained model from rotation
-                    checkpoints = [
-                        f
-                        for f in os.listdir(self.checkpoint_path)
-                        if f.startswith("model_")
-                        and not f.startswith("pretrained_")  # Exclude pretrained models
-                        and f.endswith(".pt")
-                        and f != "model_last.pt"
-                    ]
-                    checkpoints.sort(key=lambda x: int(x.split("_")[1].split(".")[0]))
-                    while len(checkpoints) > self.keep_last_n_checkpoints:
-                        oldest_checkpoint = checkpoints.pop(0)
-                        os.remove(os.path.join(self.checkpoint_path, oldest_checkpoint))
-                        print(f"Removed old checkpoint: {oldest_checkpoint}")
+                path = f"{self.checkpoint_path}/model_{update}.pt"
+                on_saved = self.remove_old_checkpoints
+
+            if self.checkpoint_writer is None:
+                self.accelerator.save(checkpoint, path)
+                on_saved()
+                return
+            if self.checkpoint_snapshot is None or self.checkpoint_snapshot[0] != update:
+                self.checkpoint_snapshot = (update, self.checkpoint_writer.snapshot(checkpoint))
+            # old checkpoints are only removed once the new one is written
+            self.checkpoint_writer.write(self.checkpoint_snapshot[1], path, on_saved=on_saved)
+
+    def remove_old_checkpoints(self):
+        if self.keep_last_n_checkpoints > 0:
+            # Updated logic to exclude pretrained model from rotation
+            checkpoints = [
+                f
+                for f in os.listdir(self.checkpoint_path)
+                if f.startswith("model_")
+                and not f.startswith("pretrained_")  # Exclude pretrained models
+                and f.endswith(".pt")
+                and f != "model_last.pt"
+            ]
+            checkpoints.sort(key=lambda x: int(x.split("_")[1].split(".")[0]))
+            while len(checkpoints) > self.keep_last_n_checkpoints:
+                oldest_checkpoint = checkpoints.pop(0)
+                os.remove(os.path.join(self.checkpoint_path, oldest_checkpoint))
+                print(f"Removed old checkpoint: {oldest_checkpoint}")
 
     def load_checkpoint(self):
         if (
@@ -276,6 +351,9 @@ class Trainer:
         else:
             generator = None
 
+        if exists(self.pack_length) and self.batch_size_type != "frame":
+            raise ValueError("pack_length requires batch_size_type 'frame'")
+
         if self.batch_size_type == "sample":
             train_dataloader = DataLoader(
                 train_dataset,
@@ -296,10 +374,13 @@ class Trainer:
                 max_samples=self.max_samples,
                 random_seed=resumable_with_seed,  # This enables reproducible shuffling
                 drop_residual=False,
+                num_replicas=self.accelerator.num_processes,  # balance frames across ranks at each step
+                cache_dir=f"{self.checkpoint_path}/batch_plans",
+                packing=exists(self.pack_length),
             )
             train_dataloader = DataLoader(
                 train_dataset,
-                collate_fn=collate_fn,
+                collate_fn=partial(collate_packed_fn, pack_length=self.pack_length) if self.pack_length else collate_fn,
                 num_workers=num_workers,
                 pin_memory=True,
                 persistent_workers=True,
@@ -369,7 +450,12 @@ class Trainer:
                         self.accelerator.log({"duration loss": dur_loss.item()}, step=global_update)
 
                     loss, cond, pred = self.model(
-                        mel_spec, text=text_inputs, lens=mel_lengths, noise_scheduler=self.noise_scheduler
+                        mel_spec,
+                        text=text_inputs,
+                        lens=mel_lengths,
+                        noise_scheduler=self.noise_scheduler,
+                        seg_starts=batch.get("seg_starts"),
+                        seg_lens=batch.get("seg_lens"),
                     )
                     self.accelerator.backward(loss)
 
@@ -403,10 +489,11 @@ class Trainer:
                     self.save_checkpoint(global_update)
 
                     if self.log_samples and self.accelerator.is_local_main_process:
-                        ref_audio_len = mel_lengths[0]
-                        infer_text = [
-                            text_inputs[0] + ([" "] if isinstance(text_inputs[0], list) else " ") + text_inputs[0]
-                        ]
+                        if "seg_lens" in batch:  # packed rows, first segment of the first row
+                            ref_audio_len, ref_text = batch["seg_lens"][0, 0], text_inputs[0][0]
+                        else:
+                            ref_audio_len, ref_text = mel_lengths[0], text_inputs[0]
+                        infer_text = [ref_text + ([" "] if isinstance(ref_text, list) else " ") + ref_text]
                         with torch.inference_mode():
                             generated, _ = self.accelerator.unwrap_model(self.model).sample(
                                 cond=mel_spec[0][:ref_audio_len].unsqueeze(0),
@@ -418,7 +505,7 @@ class Trainer:
                             )
                             generated = generated.to(torch.float32)
                             gen_mel_spec = generated[:, ref_audio_len:, :].permute(0, 2, 1).to(self.accelerator.device)
-                            ref_mel_spec = batch["mel"][0].unsqueeze(0)
+                            ref_mel_spec = batch["mel"][0][:, :ref_audio_len].unsqueeze(0)
                             if self.vocoder_name == "vocos":
                                 gen_audio = vocoder.decode(gen_mel_spec).cpu()
                                 ref_audio = vocoder.decode(ref_mel_spec).cpu()
@@ -435,5 +522,7 @@ class Trainer:
                         self.model.train()
 
         self.save_checkpoint(global_update, last=True)
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
 
         self.accelerator.end_training()
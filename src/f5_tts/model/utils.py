@@ -64,7 +64,12 @@ def mask_from_start_end_indices(seq_len: int["b"], start: int["b"], end: int["b"
     return start_mask & end_mask
 
 
-def mask_from_frac_lengths(seq_len: int["b"], frac_lengths: float["b"]):  # noqa: F722 F821
+def mask_from_frac_lengths(
+    seq_len: int["b"] | int["b s"],  # noqa: F722 F821
+    frac_lengths: float["b"] | float["b s"],  # noqa: F722 F821
+    seg_starts: int["b s"] | None = None,  # noqa: F722
+    length: int | None = None,
+):
     lengths = (frac_lengths * seq_len).long()
     max_start = seq_len - lengths
 
@@ -72,7 +77,21 @@ def mask_from_frac_lengths(seq_len: int["b"], frac_lengths: float["b"]):  # noqa
     start = (max_start * rand).long().clamp(min=0)
     end = start + lengths
 
-    return mask_from_start_end_indices(seq_len, start, end)
+    if not exists(seg_starts):
+        return mask_from_start_end_indices(seq_len, start, end)
+
+    # packed rows, one span within each segment: b s -> b n
+    seq = torch.arange(length, device=start.device).long()
+    start, end = seg_starts + start, seg_starts + end
+    return ((seq >= start[..., None]) & (seq < end[..., None])).any(dim=1)
+
+
+def segments_to_ids(seg_starts: int["b s"], seg_lens: int["b s"], length: int) -> int["b n"]:  # noqa: F722
+    """Segment of each frame of packed rows, numbered from 1 in each row, 0 for padding and gaps."""
+    seq = torch.arange(length, device=seg_starts.device)
+    inside = (seq >= seg_starts[..., None]) & (seq < (seg_starts + seg_lens)[..., None])  # b s n
+    seg_nums = torch.arange(1, seg_starts.shape[1] + 1, device=seg_starts.device)
+    return (inside.long() * seg_nums[:, None]).sum(dim=1)
 
 
 def maybe_masked_mean(t: float["b n d"], mask: bool["b n"] = None) -> float["b d"]:  # noqa: F722
@@ -104,6 +123,25 @@ def list_str_to_idx(
     return text
 
 
+# tokens of each segment placed at its start in packed rows, filler elsewhere and beyond the segment
+def pack_segment_text(
+    text: int["s nt"],  # noqa: F722
+    seg_starts: int["b s"],  # noqa: F722
+    seg_lens: int["b s"],  # noqa: F722
+    length: int,
+    padding_value=-1,
+) -> int["b n"]:  # noqa: F722
+    valid = seg_lens > 0  # text rows are the valid segments, in row-major order
+    rows = torch.nonzero(valid)[:, 0]
+    starts, lens = seg_starts[valid], seg_lens[valid]
+    pos = torch.arange(text.shape[1], device=text.device)
+    keep = (text != padding_value) & (pos[None, :] < lens[:, None])
+
+    packed = torch.full((seg_lens.shape[0], length), padding_value, dtype=text.dtype, device=text.device)
+    packed[rows[:, None].expand_as(text)[keep], (starts[:, None] + pos[None, :])[keep]] = text[keep]
+    return packed
+
+
 # Get tokenizer
 
 
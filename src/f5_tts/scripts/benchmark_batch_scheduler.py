@@ -0,0 +1,179 @@
+""" Example Usage
+python src/f5_tts/scripts/benchmark_batch_scheduler.py \
+--model F5TTS_v1_Base \
+--num_requests 64 \
+--concurrency 16 \
+--max_batch_size 8 \
+--max_wait 0.02
+"""
+
+import argparse
+import random
+import threading
+import time
+from importlib.resources import files
+
+import numpy as np
+import torch
+import torchaudio
+from cached_path import cached_path
+from hydra.utils import get_class
+from omegaconf import OmegaConf
+
+from f5_tts.infer.batch_scheduler import DynamicBatchScheduler
+from f5_tts.infer.utils_infer import (
+    chunk_text,
+    infer_batch_process,
+    load_model,
+    load_vocoder,
+    preprocess_ref_audio_text,
+)
+
+
+GEN_TEXTS = [
+    "I don't really care what you call me.",
+    "I've been a silent spectator, watching species evolve, empires rise and fall.",
+    "But always remember, I am mighty and enduring.",
+    "Respect me and I'll nurture you; ignore me and you shall face the consequences.",
+    "The quick brown fox jumps over the lazy dog, again and again, until the sun goes down.",
+    "Thank you for calling, please hold the line.",
+]
+
+
+def run_clients(requests, concurrency, infer_fn):
+    """Replay `requests` with `concurrency` client threads, returns (per-request latencies, wall time)."""
+    latencies = []
+    lock = threading.Lock()
+    cursor = iter(requests)
+
+    def client():
+        while True:
+            with lock:
+                request = next(cursor, None)
+            if request is None:
+                return
+            start = time.perf_counter()
+            infer_fn(*request)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), time.perf_counter() - start
+
+
+def report(name, latencies, wall_time):
+    print(
+        f"{name:>12} | {len(latencies) / wall_time:8.2f} req/s"
+        f" | p50 {np.percentile(latencies, 50) * 1000:8.1f} ms"
+        f" | p99 {np.percentile(latencies, 99) * 1000:8.1f} ms"
+        f" | wall {wall_time:7.2f} s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark dynamic batching against one-at-a-time inference")
+    parser.add_argument("--model", default="F5TTS_v1_Base")
+    parser.add_argument("--ckpt_file", default="")
+    parser.add_argument("--vocab_file", default="")
+    parser.add_argument(
+        "--ref_audio",
+        nargs="+",
+        default=[str(files("f5_tts").joinpath("infer/examples/basic/basic_ref_en.wav"))],
+        help="One or more reference audios, requests pick a speaker at random",
+    )
+    parser.add_argument("--ref_text", nargs="+", default=["Some call me nature, others call me mother nature."])
+    parser.add_argument("--num_requests", default=64, type=int)
+    parser.add_argument("--concurrency", default=16, type=int)
+    parser.add_argument("--nfe_step", default=32, type=int)
+    parser.add_argument("--max_batch_size", default=8, type=int)
+    parser.add_argument("--max_frames", default=16384, type=int)
+    parser.add_argument("--max_wait", default=0.02, type=float, help="Max seconds a chunk waits for batching")
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml")))
+    model_cls = get_class(f"f5_tts.model.{model_cfg.model.backbone}")
+    mel_spec_type = model_cfg.model.mel_spec.mel_spec_type
+    ckpt_file = args.ckpt_file or str(cached_path(f"hf://SWivid/F5-TTS/{args.model}/model_1250000.safetensors"))
+
+    vocoder = load_vocoder(vocoder_name=mel_spec_type)
+    model = load_model(model_cls, model_cfg.model.arch, ckpt_file, mel_spec_type, args.vocab_file)
+
+    speakers = []
+    for ref_audio, ref_text in zip(args.ref_audio, args.ref_text):
+        ref_audio, ref_text = preprocess_ref_audio_text(ref_audio, ref_text)
+        audio, sr = torchaudio.load(ref_audio)
+        max_chars = int(len(ref_text.encode("utf-8")) / (audio.shape[-1] / sr) * (22 - audio.shape[-1] / sr))
+        speakers.append((audio, sr, ref_text, max_chars))
+
+    requests = []
+    for _ in range(args.num_requests):
+        audio, sr, ref_text, max_chars = random.choice(speakers)
+        gen_text_batches = chunk_text(random.choice(GEN_TEXTS), max_chars=max_chars)
+        requests.append(((audio, sr), ref_text, gen_text_batches))
+
+    # warm up
+    next(infer_batch_process(*requests[0], model, vocoder, mel_spec_type=mel_spec_type, progress=None, nfe_step=4))
+
+    # current path, single model served one request at a time
+    model_lock = threading.Lock()
+
+    def infer_sequential(ref_audio, ref_text, gen_text_batches):
+        with model_lock:
+            return next(
+                infer_batch_process(
+                    ref_audio,
+                    ref_text,
+                    gen_text_batches,
+                    model,
+                    vocoder,
+                    mel_spec_type=mel_spec_type,
+                    progress=None,
+                    nfe_step=args.nfe_step,
+                    device=model.device,
+                )
+            )
+
+    scheduler = DynamicBatchScheduler(
+        model,
+        vocoder,
+        mel_spec_type=mel_spec_type,
+        nfe_step=args.nfe_step,
+        max_batch_size=args.max_batch_size,
+        max_frames=args.max_frames,
+        max_wait=args.max_wait,
+    )
+
+    def infer_batched(ref_audio, ref_text, gen_text_batches):
+        return next(
+            infer_batch_process(
+                ref_audio,
+                ref_text,
+                gen_text_batches,
+                model,
+                vocoder,
+                mel_spec_type=mel_spec_type,
+                progress=None,
+                device=model.device,
+                batch_scheduler=scheduler,
+            )
+        )
+
+    print(f"\n{args.num_requests} requests, {args.concurrency} concurrent clients, nfe {args.nfe_step}\n")
+    report("sequential", *run_clients(requests, args.concurrency, infer_sequential))
+    report("batched", *run_clients(requests, args.concurrency, infer_batched))
+
+    scheduler.stop()
+    print(f"\nscheduler stats: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Example Usage
+python src/f5_tts/scripts/check_batched_sampling.py --model F5TTS_v1_Base --ckpt_file ckpts/model_1250000.safetensors
+python src/f5_tts/scripts/check_batched_sampling.py --dim 256 --depth 2  # random weights, seconds on CPU
+
+Checks that text chunks of different durations sampled in one batch get the same mels as sampled one at a time,
+which batched inference (chunk_batch_size of infer_batch_process, DynamicBatchScheduler) relies on.
+This holds if the backbone masks batch padding (CFM.masks_batch_padding), the model is checked with the mask forced
+on, and the difference without it is printed for comparison.
+"""
+
+import argparse
+import random
+import sys
+from importlib.resources import files
+
+import torch
+from hydra.utils import get_class
+from omegaconf import OmegaConf
+
+from f5_tts.model import CFM
+from f5_tts.model.utils import get_tokenizer
+
+
+def build_model(model_cfg, vocab_file, masked, overrides):
+    vocab_char_map, vocab_size = get_tokenizer(vocab_file, "custom")
+    arch = dict(OmegaConf.to_container(model_cfg.model.arch), **overrides)
+    arch.update(attn_mask_enabled=masked)
+    model_cls = get_class(f"f5_tts.model.{model_cfg.model.backbone}")
+    mel_spec_kwargs = OmegaConf.to_container(model_cfg.model.mel_spec)
+    return CFM(
+        transformer=model_cls(**arch, text_num_embeds=vocab_size, mel_dim=mel_spec_kwargs["n_mel_channels"]),
+        mel_spec_kwargs=mel_spec_kwargs,
+        vocab_char_map=vocab_char_map,
+    )
+
+
+def sample(model, cond, texts, durations, seed, nfe_step):
+    """Mels of texts sampled in one batch, each sliced at the duration sample() actually generated."""
+    lens = torch.full((len(texts),), cond.shape[1], dtype=torch.long, device=cond.device)
+    durations = model.sample_duration(texts, lens, torch.tensor(durations, device=cond.device))
+    with torch.inference_mode():
+        generated, _ = model.sample(
+            cond=cond.expand(len(texts), *cond.shape[1:]),
+            text=texts,
+            duration=durations,
+            steps=nfe_step,
+            cfg_strength=2.0,
+            sway_sampling_coef=-1.0,
+            seed=seed,
+        )
+    return [generated[i, cond.shape[1] : duration].float() for i, duration in enumerate(durations.tolist())]
+
+
+def max_difference(model, cond, texts, durations, seed, nfe_step):
+    batched = sample(model, cond, texts, durations, seed, nfe_step)
+    single = [sample(model, cond, [text], [duration], seed, nfe_step)[0] for text, duration in zip(texts, durations)]
+    return max((b - s).abs().max().item() for b, s in zip(batched, single))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="check that batched sampling matches sampling chunks one at a time")
+    parser.add_argument("--model", default="F5TTS_v1_Base")
+    parser.add_argument("--ckpt_file", default="", help="Checkpoint to check, random weights if not given")
+    parser.add_argument("--vocab_file", default=str(files("f5_tts").joinpath("infer/examples/vocab.txt")))
+    parser.add_argument("--dim", type=int, help="Override the model dim, e.g. for a quick check with random weights")
+    parser.add_argument("--depth", type=int, help="Override the model depth")
+    parser.add_argument("--nfe_step", default=8, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--atol", default=1e-3, type=float, help="Max abs difference of mels allowed")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model_cfg = OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.model}.yaml")))
+    overrides = {key: value for key, value in dict(dim=args.dim, depth=args.depth).items() if value is not None}
+
+    torch.manual_seed(args.seed)
+    random.seed(args.seed)
+    vocab = [line.rstrip("\n") for line in open(args.vocab_file, encoding="utf-8") if line.strip()]
+    ref_len = 120
+    texts = [random.choices(vocab, k=k) for k in (ref_len // 3, ref_len // 2, ref_len)]
+    durations = [ref_len + 40, ref_len + 90, ref_len + 200]
+    cond = torch.randn(1, ref_len, model_cfg.model.mel_spec.n_mel_channels, device=device)
+
+    state_dict = None
+    for masked in (True, False):
+        model = build_model(model_cfg, args.vocab_file, masked, overrides)
+        if args.ckpt_file:
+            from f5_tts.infer.utils_infer import load_checkpoint
+
+            model = load_checkpoint(model, args.ckpt_file, device, dtype=torch.float32)
+        else:
+            # random weights, with the zero-initialized output layers too, so that the flow is not all zeros
+            if state_dict is None:
+                for parameter in model.parameters():
+                    torch.nn.init.normal_(parameter, std=0.02)
+                state_dict = model.state_dict()
+            model.load_state_dict(state_dict)
+            model = model.to(device)
+
+        difference = max_difference(model.eval(), cond, texts, durations, args.seed, args.nfe_step)
+        print(f"batch padding {'masked' if masked else 'not masked'}: max abs difference {difference:.2e}")
+        if masked and difference > args.atol:
+            print(f"Batched sampling differs from single-chunk sampling by more than {args.atol}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
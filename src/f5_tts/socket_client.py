@@ -1,42 +1,64 @@
 import asyncio
+import json
 import logging
 import socket
 import time
 
-import numpy as np
 import pyaudio
 
+from f5_tts.socket_protocol import (
+    DEFAULT_ENCODING,
+    MSG_AUDIO,
+    MSG_END,
+    MSG_ERROR,
+    MSG_HELLO,
+    MSG_READY,
+    MSG_TEXT,
+    AudioDecoder,
+    recv_frame,
+    send_frame,
+)
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def listen_to_F5TTS(text, server_ip="localhost", server_port=9998):
+async def listen_to_F5TTS(
+    text, server_ip="localhost", server_port=9998, ref_audio=None, ref_text="", encoding=DEFAULT_ENCODING
+):
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     await asyncio.get_event_loop().run_in_executor(None, client_socket.connect, (server_ip, int(server_port)))
 
     start_time = time.time()
     first_chunk_time = None
+    sample_rate = 24000
 
-    async def play_audio_stream():
+    async def play_audio_stream(decoder):
         nonlocal first_chunk_time
         p = pyaudio.PyAudio()
-        stream = p.open(format=pyaudio.paFloat32, channels=1, rate=24000, output=True, frames_per_buffer=2048)
+        stream = p.open(format=pyaudio.paFloat32, channels=1, rate=sample_rate, output=True, frames_per_buffer=2048)
 
         try:
             while True:
-                data = await asyncio.get_event_loop().run_in_executor(None, client_socket.recv, 8192)
-                if not data:
+                msg_type, payload = await asyncio.get_event_loop().run_in_executor(None, recv_frame, client_socket)
+                if msg_type is None:
                     break
-                if data == b"END":
+                if msg_type == MSG_END:
                     logger.info("End of audio received.")
                     break
+                if msg_type == MSG_ERROR:
+                    logger.error(f"Server error: {payload.decode('utf-8')}")
+                    break
+                if msg_type != MSG_AUDIO:
+                    continue
 
-                audio_array = np.frombuffer(data, dtype=np.float32)
+                audio_array = decoder.decode(payload)
                 stream.write(audio_array.tobytes())
 
                 if first_chunk_time is None:
                     first_chunk_time = time.time()
+                    logger.info(f"Time to first audio: {first_chunk_time - start_time:.4f} seconds")
 
         finally:
             stream.stop_stream()
@@ -46,9 +68,22 @@ async def listen_to_F5TTS(text, server_ip="localhost", server_port=9998):
         logger.info(f"Total time taken: {time.time() - start_time:.4f} seconds")
 
     try:
+        # pick the reference voice (a file name in the server --voices_dir) and audio encoding of this connection
+        hello = {"encoding": encoding}
+        if ref_audio is not None:
+            hello.update(ref_audio=ref_audio, ref_text=ref_text)
+        await asyncio.get_event_loop().run_in_executor(
+            None, send_frame, client_socket, MSG_HELLO, json.dumps(hello).encode("utf-8")
+        )
+        msg_type, payload = await asyncio.get_event_loop().run_in_executor(None, recv_frame, client_socket)
+        if msg_type != MSG_READY:
+            raise RuntimeError(f"Rejected by server: {payload.decode('utf-8') if payload else 'connection closed'}")
+        ready = json.loads(payload.decode("utf-8"))
+        sample_rate = ready["sample_rate"]
+
         data_to_send = f"{text}".encode("utf-8")
-        await asyncio.get_event_loop().run_in_executor(None, client_socket.sendall, data_to_send)
-        await play_audio_stream()
+        await asyncio.get_event_loop().run_in_executor(None, send_frame, client_socket, MSG_TEXT, data_to_send)
+        await play_audio_stream(AudioDecoder(ready["encoding"], sample_rate))
 
     except Exception as e:
         logger.error(f"Error in listen_to_F5TTS: {e}")
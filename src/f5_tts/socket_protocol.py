@@ -0,0 +1,129 @@
+# Framing protocol of socket_server.py / socket_client.py
+# Every message is a frame: 1 byte message type, 4 bytes big-endian payload length, then the payload.
+#
+#   HELLO  client -> server  JSON {"ref_audio": ..., "ref_text": ..., "encoding": ...}, all optional, before any TEXT
+#   READY  server -> client  JSON {"sample_rate": ..., "encoding": ...}, reply to HELLO
+#   TEXT   client -> server  UTF-8 text to synthesize
+#   AUDIO  server -> client  audio payload in the negotiated encoding (float32 / int16 PCM, or one opus packet)
+#   END    server -> client  end of the audio of one TEXT
+#   ERROR  server -> client  UTF-8 error message
+
+import struct
+
+import numpy as np
+
+
+HEADER = struct.Struct("!BI")
+
+MSG_HELLO = 1
+MSG_READY = 2
+MSG_TEXT = 3
+MSG_AUDIO = 4
+MSG_END = 5
+MSG_ERROR = 6
+
+ENCODINGS = ("int16", "float32", "opus")
+DEFAULT_ENCODING = "int16"
+
+OPUS_FRAME_DURATION = 0.02  # 20 ms opus frames
+
+MAX_PAYLOAD = 1 << 20  # 1 MiB, HELLO / TEXT from clients and AUDIO pieces are far below
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+def send_frame(sock, msg_type, payload=b""):
+    sock.sendall(HEADER.pack(msg_type, len(payload)) + payload)
+
+
+def recv_exactly(sock, num_bytes):
+    buffer = bytearray(num_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < num_bytes:
+        n = sock.recv_into(view[received:], num_bytes - received)
+        if n == 0:
+            return None
+        received += n
+    return bytes(buffer)
+
+
+def recv_frame(sock, max_payload=MAX_PAYLOAD):
+    """
+    Read one frame, returns (msg_type, payload), or (None, None) if the connection was closed.
+    Raises FrameTooLarge before reading a payload over max_payload bytes, the connection should then be closed.
+    """
+    header = recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None, None
+    msg_type, length = HEADER.unpack(header)
+    if length > max_payload:
+        raise FrameTooLarge(f"Frame of {length} bytes, over the {max_payload} bytes limit")
+    payload = recv_exactly(sock, length) if length else b""
+    if payload is None:
+        return None, None
+    return msg_type, payload
+
+
+class AudioEncoder:
+    """Float waveform -> AUDIO payloads in the given encoding."""
+
+    def __init__(self, encoding=DEFAULT_ENCODING, sample_rate=24000):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding}, expected one of {ENCODINGS}")
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        if encoding == "opus":
+            import opuslib
+
+            self.opus = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_AUDIO)
+            self.frame_size = int(sample_rate * OPUS_FRAME_DURATION)
+            self.leftover = np.zeros(0, dtype=np.int16)
+
+    def encode(self, wave):
+        if self.encoding == "float32":
+            return [wave.astype(np.float32, copy=False).tobytes()]
+        pcm = (np.clip(wave, -1.0, 1.0) * 32767).astype(np.int16)
+        if self.encoding == "int16":
+            return [pcm.tobytes()]
+
+        # opus works on fixed size frames, keep the remainder for the next call
+        pcm = np.concatenate([self.leftover, pcm])
+        num_frames = len(pcm) // self.frame_size
+        self.leftover = pcm[num_frames * self.frame_size :]
+        return [
+            self.opus.encode(pcm[i * self.frame_size : (i + 1) * self.frame_size].tobytes(), self.frame_size)
+            for i in range(num_frames)
+        ]
+
+    def flush(self):
+        """Payloads of audio held back by the encoder, call at the end of each stream."""
+        if self.encoding != "opus" or len(self.leftover) == 0:
+            return []
+        pcm = np.zeros(self.frame_size, dtype=np.int16)
+        pcm[: len(self.leftover)] = self.leftover
+        self.leftover = np.zeros(0, dtype=np.int16)
+        return [self.opus.encode(pcm.tobytes(), self.frame_size)]
+
+
+class AudioDecoder:
+    """AUDIO payloads in the given encoding -> float32 waveform."""
+
+    def __init__(self, encoding=DEFAULT_ENCODING, sample_rate=24000):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding {encoding}, expected one of {ENCODINGS}")
+        self.encoding = encoding
+        if encoding == "opus":
+            import opuslib
+
+            self.opus = opuslib.Decoder(sample_rate, 1)
+            self.frame_size = int(sample_rate * OPUS_FRAME_DURATION)
+
+    def decode(self, payload):
+        if self.encoding == "float32":
+            return np.frombuffer(payload, dtype=np.float32)
+        if self.encoding == "opus":
+            payload = self.opus.decode(payload, self.frame_size)
+        return np.frombuffer(payload, dtype=np.int16).astype(np.float32) / 32768
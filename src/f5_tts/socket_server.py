@@ -1,9 +1,10 @@
 import argparse
 import gc
+import json
 import logging
+import os
 import queue
 import socket
-import struct
 import threading
 import traceback
 import wave
@@ -11,17 +12,32 @@ from importlib.resources import files
 
 import numpy as np
 import torch
-import torchaudio
 from huggingface_hub import hf_hub_download
 from hydra.utils import get_class
 from omegaconf import OmegaConf
 
+from f5_tts.infer.batch_scheduler import DynamicBatchScheduler
 from f5_tts.infer.utils_infer import (
+    StreamMetrics,
     chunk_text,
+    get_ref_prompt,
     infer_batch_process,
     load_model,
     load_vocoder,
-    preprocess_ref_audio_text,
+    target_sample_rate,
+)
+from f5_tts.socket_protocol import (
+    DEFAULT_ENCODING,
+    MSG_AUDIO,
+    MSG_END,
+    MSG_ERROR,
+    MSG_HELLO,
+    MSG_READY,
+    MSG_TEXT,
+    AudioEncoder,
+    FrameTooLarge,
+    recv_frame,
+    send_frame,
 )
 
 
@@ -70,7 +86,27 @@ class AudioFileWriterThread(threading.Thread):
 
 
 class TTSStreamingProcessor:
-    def __init__(self, model, ckpt_file, vocab_file, ref_audio, ref_text, device=None, dtype=torch.float32):
+    """Model, vocoder and a shared GPU worker, serving any number of client sessions.
+
+    Text chunks of all connections go through one DynamicBatchScheduler, so concurrent clients are batched
+    together on the GPU instead of waiting for each other. Each session keeps at most `max_pending_chunks`
+    chunks in flight, so a slow client only slows down its own generation.
+    """
+
+    def __init__(
+        self,
+        model,
+        ckpt_file,
+        vocab_file,
+        ref_audio,
+        ref_text,
+        device=None,
+        dtype=torch.float32,
+        max_batch_size=8,
+        max_pending_chunks=2,
+        voices_dir=None,
+    ):
+        self.voices_dir = os.path.realpath(voices_dir) if voices_dir else None
         self.device = device or (
             "cuda"
             if torch.cuda.is_available()
@@ -85,14 +121,18 @@ class TTSStreamingProcessor:
         self.model_arc = model_cfg.model.arch
         self.mel_spec_type = model_cfg.model.mel_spec.mel_spec_type
         self.sampling_rate = model_cfg.model.mel_spec.target_sample_rate
+        self.max_pending_chunks = max_pending_chunks
 
         self.model = self.load_ema_model(ckpt_file, vocab_file, dtype)
         self.vocoder = self.load_vocoder_model()
+        self.scheduler = DynamicBatchScheduler(
+            self.model, self.vocoder, mel_spec_type=self.mel_spec_type, max_batch_size=max_batch_size
+        )
 
-        self.update_reference(ref_audio, ref_text)
+        # reference preprocessing may run ASR and the mel spectrogram, one at a time
+        self.reference_lock = threading.Lock()
+        self.default_reference = self.get_reference(ref_audio, ref_text)
         self._warm_up()
-        self.file_writer_thread = None
-        self.first_package = True
 
     def load_ema_model(self, ckpt_file, vocab_file, dtype):
         return load_model(
@@ -109,113 +149,223 @@ class TTSStreamingProcessor:
     def load_vocoder_model(self):
         return load_vocoder(vocoder_name=self.mel_spec_type, is_local=False, local_path=None, device=self.device)
 
-    def update_reference(self, ref_audio, ref_text):
-        self.ref_audio, self.ref_text = preprocess_ref_audio_text(ref_audio, ref_text)
-        self.audio, self.sr = torchaudio.load(self.ref_audio)
-
-        ref_audio_duration = self.audio.shape[-1] / self.sr
-        ref_text_byte_len = len(self.ref_text.encode("utf-8"))
-        self.max_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration))
-        self.few_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 2)
-        self.min_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 4)
+    def resolve_voice(self, name):
+        """Path of a voice requested by a client, a file name relative to voices_dir, None if not allowed."""
+        if not self.voices_dir or not isinstance(name, str) or os.path.isabs(name) or ".." in name.split("/"):
+            return None
+        path = os.path.realpath(os.path.join(self.voices_dir, name))
+        if os.path.commonpath([path, self.voices_dir]) != self.voices_dir or not os.path.isfile(path):
+            return None
+        return path
+
+    def get_reference(self, ref_audio, ref_text):
+        """Reference prompt and normalized text of a voice, preprocessed once and then served from the cache."""
+        with self.reference_lock:
+            return get_ref_prompt(
+                ref_audio, ref_text, self.model, mel_spec_type=self.mel_spec_type, show_info=logger.info
+            )
 
     def _warm_up(self):
         logger.info("Warming up the model...")
         gen_text = "Warm-up text for the model."
+        prompt, ref_text = self.default_reference
         for _ in infer_batch_process(
-            (self.audio, self.sr),
-            self.ref_text,
+            prompt,
+            ref_text,
             [gen_text],
             self.model,
             self.vocoder,
+            mel_spec_type=self.mel_spec_type,
             progress=None,
             device=self.device,
             streaming=True,
+            batch_scheduler=self.scheduler,
         ):
             pass
         logger.info("Warm-up completed.")
 
-    def generate_stream(self, text, conn):
-        text_batches = chunk_text(text, max_chars=self.max_chars)
-        if self.first_package:
-            text_batches = chunk_text(text_batches[0], max_chars=self.few_chars) + text_batches[1:]
-            text_batches = chunk_text(text_batches[0], max_chars=self.min_chars) + text_batches[1:]
-            self.first_package = False
+    def generate_stream(self, session, text, conn):
+        text_batches = chunk_text(text, max_chars=session.max_chars)
+        if session.first_package:
+            text_batches = chunk_text(text_batches[0], max_chars=session.few_chars) + text_batches[1:]
+            text_batches = chunk_text(text_batches[0], max_chars=session.min_chars) + text_batches[1:]
+            session.first_package = False
 
+        metrics = StreamMetrics()
         audio_stream = infer_batch_process(
-            (self.audio, self.sr),
-            self.ref_text,
+            session.prompt,
+            session.ref_text,
             text_batches,
             self.model,
             self.vocoder,
+            mel_spec_type=self.mel_spec_type,
             progress=None,
             device=self.device,
             streaming=True,
             chunk_size=2048,
+            batch_scheduler=self.scheduler,
+            max_pending_chunks=self.max_pending_chunks,
+            metrics=metrics,
         )
 
         # Reset the file writer thread
-        if self.file_writer_thread is not None:
-            self.file_writer_thread.stop()
-        self.file_writer_thread = AudioFileWriterThread("output.wav", self.sampling_rate)
-        self.file_writer_thread.start()
+        if session.file_writer_thread is not None:
+            session.file_writer_thread.stop()
+            session.file_writer_thread = None
+        if session.output_file is not None:
+            session.file_writer_thread = AudioFileWriterThread(session.output_file, self.sampling_rate)
+            session.file_writer_thread.start()
 
         for audio_chunk, _ in audio_stream:
             if len(audio_chunk) > 0:
-                logger.info(f"Generated audio chunk of size: {len(audio_chunk)}")
+                logger.debug(f"[{session.addr}] Generated audio chunk of size: {len(audio_chunk)}")
 
-                # Send audio chunk via socket
-                conn.sendall(struct.pack(f"{len(audio_chunk)}f", *audio_chunk))
+                # Send audio chunk via socket, blocks while the client is not reading (backpressure)
+                for payload in session.encoder.encode(audio_chunk):
+                    send_frame(conn, MSG_AUDIO, payload)
 
                 # Write to file asynchronously
-                self.file_writer_thread.add_chunk(audio_chunk)
+                if session.file_writer_thread is not None:
+                    session.file_writer_thread.add_chunk(audio_chunk)
 
-        logger.info("Finished sending audio stream.")
-        conn.sendall(b"END")  # Send end signal
+        for payload in session.encoder.flush():
+            send_frame(conn, MSG_AUDIO, payload)
+        logger.info(f"[{session.addr}] Finished sending audio stream, {metrics}")
+        send_frame(conn, MSG_END)  # Send end signal
 
         # Ensure all audio data is written before exiting
-        self.file_writer_thread.stop()
+        if session.file_writer_thread is not None:
+            session.file_writer_thread.stop()
+            session.file_writer_thread = None
+
+
+class ClientSession:
+    """Per-connection state: the reference voice, audio encoding, text chunking limits and the first-package flag."""
+
+    def __init__(self, addr, reference, output_file=None):
+        self.addr = addr
+        self.output_file = output_file
+        self.file_writer_thread = None
+        self.first_package = True
+        self.encoder = AudioEncoder(DEFAULT_ENCODING, target_sample_rate)
+        self.set_reference(*reference)
 
+    def set_reference(self, prompt, ref_text):
+        self.prompt, self.ref_text = prompt, ref_text
 
-def handle_client(conn, processor):
+        ref_audio_duration = prompt.audio.shape[-1] / target_sample_rate
+        ref_text_byte_len = len(ref_text.encode("utf-8"))
+        self.max_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration))
+        self.few_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 2)
+        self.min_chars = int(ref_text_byte_len / (ref_audio_duration) * (25 - ref_audio_duration) / 4)
+
+
+def handle_hello(session, payload, processor):
+    """Apply the HELLO options of a connection, reference voice and audio encoding, returns the READY reply."""
+    hello = json.loads(payload.decode("utf-8"))
+    if hello.get("ref_audio"):
+        # only voices of the server voices_dir, never any path of the server file system
+        ref_audio = processor.resolve_voice(hello["ref_audio"])
+        if ref_audio is None:
+            raise ValueError(f"Unknown voice {hello['ref_audio']!r}")
+        logger.info(f"[{session.addr}] Using reference voice: {ref_audio}")
+        session.set_reference(*processor.get_reference(ref_audio, hello.get("ref_text", "")))
+        session.first_package = True
+    session.encoder = AudioEncoder(hello.get("encoding", DEFAULT_ENCODING), target_sample_rate)
+    return dict(sample_rate=target_sample_rate, encoding=session.encoder.encoding)
+
+
+def handle_client(conn, addr, processor, output_dir=None):
+    output_file = os.path.join(output_dir, f"output_{addr[0]}_{addr[1]}.wav") if output_dir else None
+    session = ClientSession(addr, processor.default_reference, output_file=output_file)
     try:
         with conn:
             conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             while True:
-                data = conn.recv(1024)
-                if not data:
-                    processor.first_package = True
+                try:
+                    msg_type, payload = recv_frame(conn)
+                except FrameTooLarge as inner_e:
+                    logger.warning(f"[{addr}] {inner_e}, closing the connection")
+                    send_frame(conn, MSG_ERROR, b"Frame too large")
+                    break
+                if msg_type is None:
                     break
-                data_str = data.decode("utf-8").strip()
-                logger.info(f"Received text: {data_str}")
 
+                if msg_type == MSG_HELLO:
+                    try:
+                        ready = handle_hello(session, payload, processor)
+                        send_frame(conn, MSG_READY, json.dumps(ready).encode("utf-8"))
+                    except Exception as inner_e:
+                        logger.error(f"[{addr}] Invalid HELLO: {inner_e}")
+                        send_frame(conn, MSG_ERROR, b"Invalid HELLO or unknown voice")
+                    continue
+
+                if msg_type != MSG_TEXT:
+                    send_frame(conn, MSG_ERROR, f"Unexpected message type {msg_type}".encode("utf-8"))
+                    continue
+
+                text = payload.decode("utf-8").strip()
+                logger.info(f"[{addr}] Received text: {text}")
                 try:
-                    processor.generate_stream(data_str, conn)
+                    processor.generate_stream(session, text, conn)
                 except Exception as inner_e:
-                    logger.error(f"Error during processing: {inner_e}")
+                    logger.error(f"[{addr}] Error during processing: {inner_e}")
                     traceback.print_exc()
+                    send_frame(conn, MSG_ERROR, b"Synthesis failed")
                     break
     except Exception as e:
-        logger.error(f"Error handling client: {e}")
+        logger.error(f"[{addr}] Error handling client: {e}")
         traceback.print_exc()
+    finally:
+        if session.file_writer_thread is not None:
+            session.file_writer_thread.stop()
+
+
+def start_server(host, port, processor, max_connections=16, output_dir=None):
+    connections = threading.BoundedSemaphore(max_connections)
 
+    def serve(conn, addr):
+        try:
+            handle_client(conn, addr, processor, output_dir=output_dir)
+        finally:
+            connections.release()
+            logger.info(f"Disconnected {addr}")
 
-def start_server(host, port, processor):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         s.bind((host, port))
         s.listen()
-        logger.info(f"Server started on {host}:{port}")
+        logger.info(f"Server started on {host}:{port}, up to {max_connections} concurrent connections")
         while True:
             conn, addr = s.accept()
+            if not connections.acquire(blocking=False):
+                logger.warning(f"Rejected {addr}, max connections reached")
+                with conn:
+                    send_frame(conn, MSG_ERROR, b"Server busy, max connections reached")
+                continue
             logger.info(f"Connected by {addr}")
-            handle_client(conn, processor)
+            threading.Thread(target=serve, args=(conn, addr), daemon=True).start()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--host", default="0.0.0.0")
-    parser.add_argument("--port", default=9998)
+    parser.add_argument("--port", default=9998, type=int)
+    parser.add_argument("--max_connections", default=16, type=int, help="Max concurrent client connections")
+    parser.add_argument("--max_batch_size", default=8, type=int, help="Max text chunks sampled in one batch")
+    parser.add_argument(
+        "--max_pending_chunks",
+        default=2,
+        type=int,
+        help="Max text chunks of a connection in flight ahead of what it has received",
+    )
+    parser.add_argument("--output_dir", default=None, help="Write the audio of each connection to this directory")
+    parser.add_argument(
+        "--voices_dir",
+        default=None,
+        help="Directory of the reference voices clients may pick by file name in HELLO, none allowed if unset",
+    )
 
     parser.add_argument(
         "--model",
@@ -259,10 +409,13 @@ if __name__ == "__main__":
             ref_text=args.ref_text,
             device=args.device,
             dtype=args.dtype,
+            max_batch_size=args.max_batch_size,
+            max_pending_chunks=args.max_pending_chunks,
+            voices_dir=args.voices_dir,
         )
 
         # Start the server
-        start_server(args.host, args.port, processor)
+        start_server(args.host, args.port, processor, max_connections=args.max_connections, output_dir=args.output_dir)
 
     except KeyboardInterrupt:
         gc.collect()
@@ -1,12 +1,18 @@
 import os
+import queue
 import re
+import threading
+import time
 import wave
 import logging
 import warnings
+from concurrent.futures import Future
+from typing import List
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from pythainlp.tokenize import word_tokenize, sent_tokenize
+from third_party.deep_phonemizer.lexicon import Lexicon
 from third_party.deep_phonemizer.phonemizer import Phonemizer
 
 # ──────────────────────────── Logging / Warnings ──────────────────────────── #
@@ -22,6 +28,11 @@ warnings.simplefilter(action="ignore", category=UserWarning)
 # Path to your DeepPhonemizer checkpoint (adjust as needed)
 PHONEMIZER_MODEL_PATH = "/home/wjeamwat/F5-TTS/src/third_party/DeepPhonemizer/ckpts/best_model.pt"
 
+# Lexicon of predicted words, shared by server workers and kept across restarts (None to keep it in memory only),
+# and an optional prebuilt dump (lang<TAB>word<TAB>phonemes<TAB>confidence per line) to load at startup
+LEXICON_PATH = os.environ.get("LEXICON_PATH", os.path.expanduser("~/.cache/deep_phonemizer/lexicon.sqlite"))
+LEXICON_DUMP = os.environ.get("LEXICON_DUMP")
+
 # If you eventually want to add a duration endpoint, set WAVS_PATH. For now, we only do text→phoneme
 # WAVS_PATH = "/project/lt200249-speech/hall/datasets/multi-tts/th/gigaspeech2/wavs"
 
@@ -38,10 +49,92 @@ phonemizer = None
 
 if phonemizer is None:
     # Force CPU inference
-    phonemizer = Phonemizer.from_checkpoint(PHONEMIZER_MODEL_PATH, device="cpu")
+    lexicon = Lexicon(LEXICON_PATH)
+    if LEXICON_DUMP:
+        lexicon.load(LEXICON_DUMP)
+    phonemizer = Phonemizer.from_checkpoint(PHONEMIZER_MODEL_PATH, device="cpu", lexicon=lexicon)
     # Put model into half-precision to reduce memory
     phonemizer.predictor.model = phonemizer.predictor.model.half()
 
+# ──────────────────────────── MICRO-BATCHING ──────────────────────────── #
+
+# Words of concurrent requests are phonemized together: the batcher waits up to MAX_WAIT seconds after the first
+# pending request, or until MAX_BATCH_WORDS distinct words are pending, then runs one Phonemizer call. The predictor
+# sorts the words by length before splitting them into PREDICT_BATCH_SIZE model batches, so padding stays small.
+MAX_WAIT = 0.01
+MAX_BATCH_WORDS = 4096
+PREDICT_BATCH_SIZE = 128
+
+
+class MicroBatcher:
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def phonemize(self, words):
+        """Phonemes of each distinct word (e.g. "ph1 ph2 ph3"), blocks until its batch is done."""
+        future = Future()
+        self.queue.put((set(words), future))
+        return future.result()
+
+    def run(self):
+        while True:
+            pending = [self.queue.get()]
+            words = set(pending[0][0])
+            deadline = time.perf_counter() + MAX_WAIT
+            while len(words) < MAX_BATCH_WORDS:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                pending.append(item)
+                words |= item[0]
+
+            try:
+                words = sorted(words)
+                phonemes = dict(zip(words, phonemizer(words, "th", batch_size=PREDICT_BATCH_SIZE))) if words else {}
+                for request_words, future in pending:
+                    future.set_result({w: phonemes[w] for w in request_words})
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+
+
+batcher = MicroBatcher()
+
+
+def tokenize(text):
+    """Sentences of text, each as its word tokens."""
+    # 1. Sentence segmentation, 2. Word tokenization
+    return [
+        word_tokenize(re.sub(r"\s+", " ", sentence.strip()), engine="attacut")
+        for sentence in sent_tokenize(text, engine="crfcut")
+    ]
+
+
+def to_phoneme_string(sentences, phonemes):
+    all_sent_ph = []
+    for tokens in sentences:
+        # 3. Phonemes of each token, sub-phonemes joined with "-" to produce a single token-sep string
+        tokens_ph = ["" if t.isspace() or not t else "-".join(phonemes[t].split(" ")) for t in tokens]
+
+        # 4. Reconstruct the sentence's phoneme string, append a period
+        sent_ph = f"{' '.join(tokens_ph).replace('  ', ' ')}."
+        all_sent_ph.append(sent_ph)
+
+    return " ".join(all_sent_ph).strip()
+
+
+def g2p_texts(texts):
+    """Phoneme strings of texts, with the distinct words of all of them phonemized in one batch."""
+    tokenized = [tokenize(text) for text in texts]
+    words = {t for sentences in tokenized for tokens in sentences for t in tokens if t and not t.isspace()}
+    phonemes = batcher.phonemize(words)
+    return [to_phoneme_string(sentences, phonemes) for sentences in tokenized]
+
+
 class G2PRequest(BaseModel):
     text: str
 
@@ -50,6 +143,14 @@ class G2PResponse(BaseModel):
     phoneme: str
 
 
+class G2PBulkRequest(BaseModel):
+    texts: List[str]
+
+
+class G2PBulkResponse(BaseModel):
+    phonemes: List[str]
+
+
 @app.post("/g2p/", response_model=G2PResponse)
 def do_g2p(request: G2PRequest):
     """
@@ -74,28 +175,27 @@ def do_g2p(request: G2PRequest):
     if not text:
         raise HTTPException(status_code=400, detail="Empty text field")
 
-    # 1. Sentence segmentation
-    sentences = sent_tokenize(text, engine="crfcut")
-    all_sent_ph = []
+    return G2PResponse(phoneme=g2p_texts([text])[0])
 
-    for sentence in sentences:
-        # 2. Word tokenization
-        tokens = word_tokenize(re.sub(r"\s+", " ", sentence.strip()), engine="attacut")
-        tokens_ph = []
-
-        # 3. Run phonemizer on each token
-        for t in tokens:
-            if t.isspace() or not t:
-                tokens_ph.append("")
-            else:
-                # DeepPhonemizer inference (CPU), returns e.g. "ph1 ph2 ph3"
-                ph_str = phonemizer(t, "th")
-                # Join sub-phonemes with "-" to produce a single token-sep string
-                tokens_ph.append("-".join(ph_str.split(" ")))
 
-        # 4. Reconstruct the sentence's phoneme string, append a period
-        sent_ph = f"{' '.join(tokens_ph).replace('  ', ' ')}."
-        all_sent_ph.append(sent_ph)
+@app.post("/g2p/bulk/", response_model=G2PBulkResponse)
+def do_g2p_bulk(request: G2PBulkRequest):
+    """
+    Convert many Thai texts (e.g. thousands of metadata lines) in one call, same output as /g2p/ for each.
+
+    Request JSON:
+        {
+          "texts": ["สวัสดีครับ", ...]
+        }
+
+    Response JSON:
+        {
+          "phonemes": ["...-...", ...]
+        }
+    """
+    if phonemizer is None:
+        raise HTTPException(status_code=500, detail="Phonemizer not initialized")
 
-    full_ph_str = " ".join(all_sent_ph).strip()
-    return G2PResponse(phoneme=full_ph_str)
\ No newline at end of file
+    texts = [text.strip() for text in request.texts]
+    phonemes = iter(g2p_texts([text for text in texts if text]))
+    return G2PBulkResponse(phonemes=[next(phonemes) if text else "" for text in texts])
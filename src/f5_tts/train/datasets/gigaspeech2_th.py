@@ -20,6 +20,10 @@ warnings.simplefilter(action='ignore', category=UserWarning)
 
 # URL of your running Phonemizer server endpoint
 PHONEMIZER_SERVER_URL = "http://127.0.0.1:8000/g2p/"
+PHONEMIZER_BULK_URL = "http://127.0.0.1:8000/g2p/bulk/"
+
+# Lines sent to the bulk endpoint per request, the server phonemizes their distinct words in one batch
+BULK_SIZE = 512
 
 # Paths
 dataset_path = "/project/lt200249-speech/hall/datasets/multi-tts/th/gigaspeech2/"
@@ -55,7 +59,21 @@ def g2p_via_api(text: str) -> str:
         return ""
 
 
-def process_line(line: str):
+def g2p_bulk_via_api(texts):
+    """
+    Send {"texts": [...]} to the Phonemizer server and return the "phonemes" list.
+    On failure, print a warning and return empty strings.
+    """
+    try:
+        resp = requests.post(PHONEMIZER_BULK_URL, json={"texts": texts}, timeout=(2, None))
+        resp.raise_for_status()
+        return resp.json()["phonemes"]
+    except Exception as e:
+        sys.stderr.write(f"[ERROR] G2P bulk API failed for {len(texts)} texts: {e}\n")
+        return [""] * len(texts)
+
+
+def process_line(line: str, g2p=g2p_via_api):
     """
     Parse "relative/path/to.wav|transcript". If the WAV exists:
       1) compute duration,
@@ -97,7 +115,7 @@ def process_line(line: str):
         return None
 
     # 2) Phoneme via HTTP API
-    tokens_phoneme = g2p_via_api(transcript)
+    tokens_phoneme = g2p(transcript)
 
     metadata = {
         "id":       filename,
@@ -111,11 +129,31 @@ def process_line(line: str):
     return filename, metadata
 
 
-def process_all(line: str) -> str:
+def process_chunk(lines):
+    """
+    Called in each worker for BULK_SIZE lines. Phonemizes all their transcripts with one bulk request,
+    then runs process_all() on each line with the results.
+    """
+    transcripts = []
+    for line in lines:
+        parts = line.strip().split("|")
+        if len(parts) != 2:
+            continue
+        # only lines process_line() will not skip, so that a resumed run does not phonemize finished lines again
+        filename = os.path.basename(parts[0])
+        json_path = os.path.join(wavs_path, filename.replace('.wav', '.json'))
+        if os.path.exists(os.path.join(wavs_path, filename)) and not os.path.exists(json_path):
+            transcripts.append(parts[1])
+
+    phonemes = dict(zip(transcripts, g2p_bulk_via_api(transcripts)))
+    return [process_all(line, g2p=phonemes.get) for line in lines]
+
+
+def process_all(line: str, g2p=g2p_via_api) -> str:
     """
     Called in each worker. Runs process_line(), writes JSON, and returns status.
     """
-    result = process_line(line)
+    result = process_line(line, g2p=g2p)
     if result is None:
         parts = line.strip().split("|")
         fname = os.path.basename(parts[0]) if parts else "unknown"
@@ -148,8 +186,9 @@ if __name__ == "__main__":
     print(f"Total lines to process: {total}")
     print(f"Spawning {cpu_count()} CPU worker processes (via p_map).")
 
-    # 2) Use p_map to parallelize across all CPU cores
-    results = p_map(process_all, lines, num_cpus=cpu_count())
+    # 2) Use p_map to parallelize across all CPU cores, BULK_SIZE lines per G2P request
+    chunks = [lines[i:i + BULK_SIZE] for i in range(0, total, BULK_SIZE)]
+    results = p_map(process_chunk, chunks, num_cpus=cpu_count())
 
     # for res in results:
     #     print(res)
\ No newline at end of file
@@ -11,14 +11,13 @@ import sys
 sys.path.append(os.getcwd())
 
 import json
-from concurrent.futures import ProcessPoolExecutor
 from importlib.resources import files
 from pathlib import Path
 
-from datasets.arrow_writer import ArrowWriter
 from tqdm import tqdm
 
 from f5_tts.model.utils import convert_char_to_pinyin, repetition_found
+from f5_tts.train.datasets.prepare_sharded import prepare_sharded
 
 
 out_zh = {
@@ -110,8 +109,7 @@ en_filters = ["ا", "い", "て"]
 
 def deal_with_audio_dir(audio_dir):
     audio_jsonl = audio_dir.with_suffix(".jsonl")
-    sub_result, durations = [], []
-    vocab_set = set()
+    sub_result = []
     bad_case_zh = 0
     bad_case_en = 0
     with open(audio_jsonl, "r") as f:
@@ -139,73 +137,33 @@ def deal_with_audio_dir(audio_dir):
                 text = convert_char_to_pinyin([text], polyphone=polyphone)[0]
             duration = obj["duration"]
             sub_result.append({"audio_path": str(audio_dir.parent / obj["wav"]), "text": text, "duration": duration})
-            durations.append(duration)
-            vocab_set.update(list(text))
-    return sub_result, durations, vocab_set, bad_case_zh, bad_case_en
+    return sub_result, {"bad_case_zh": bad_case_zh, "bad_case_en": bad_case_en}
 
 
 def main():
     assert tokenizer in ["pinyin", "char"]
-    result = []
-    duration_list = []
-    text_vocab_set = set()
-    total_bad_case_zh = 0
-    total_bad_case_en = 0
-
-    # process raw data
-    executor = ProcessPoolExecutor(max_workers=max_workers)
-    futures = []
+
+    audio_dirs = []
     for lang in langs:
         dataset_path = Path(os.path.join(dataset_dir, lang))
-        [
-            futures.append(executor.submit(deal_with_audio_dir, audio_dir))
-            for audio_dir in dataset_path.iterdir()
-            if audio_dir.is_dir()
-        ]
-    for futures in tqdm(futures, total=len(futures)):
-        sub_result, durations, vocab_set, bad_case_zh, bad_case_en = futures.result()
-        result.extend(sub_result)
-        duration_list.extend(durations)
-        text_vocab_set.update(vocab_set)
-        total_bad_case_zh += bad_case_zh
-        total_bad_case_en += bad_case_en
-    executor.shutdown()
-
-    # save preprocessed dataset to disk
-    if not os.path.exists(f"{save_dir}"):
-        os.makedirs(f"{save_dir}")
+        audio_dirs.extend(sorted(audio_dir for audio_dir in dataset_path.iterdir() if audio_dir.is_dir()))
+
+    # process raw data in shards of audio dirs, saved to disk as they are done and resumed on re-run
     print(f"\nSaving to {save_dir} ...")
+    summary = prepare_sharded(audio_dirs, deal_with_audio_dir, save_dir, shard_size=shard_size, num_workers=max_workers)
 
-    # dataset = Dataset.from_dict({"audio_path": audio_path_list, "text": text_list, "duration": duration_list})  # oom
-    # dataset.save_to_disk(f"{save_dir}/raw", max_shard_size="2GB")
-    with ArrowWriter(path=f"{save_dir}/raw.arrow") as writer:
-        for line in tqdm(result, desc="Writing to raw.arrow ..."):
-            writer.write(line)
-        writer.finalize()
-
-    # dup a json separately saving duration in case for DynamicBatchSampler ease
-    with open(f"{save_dir}/duration.json", "w", encoding="utf-8") as f:
-        json.dump({"duration": duration_list}, f, ensure_ascii=False)
-
-    # vocab map, i.e. tokenizer
-    # add alphabets and symbols (optional, if plan to ft on de/fr etc.)
-    # if tokenizer == "pinyin":
-    #     text_vocab_set.update([chr(i) for i in range(32, 127)] + [chr(i) for i in range(192, 256)])
-    with open(f"{save_dir}/vocab.txt", "w") as f:
-        for vocab in sorted(text_vocab_set):
-            f.write(vocab + "\n")
-
-    print(f"\nFor {dataset_name}, sample count: {len(result)}")
-    print(f"For {dataset_name}, vocab size is: {len(text_vocab_set)}")
-    print(f"For {dataset_name}, total {sum(duration_list) / 3600:.2f} hours")
+    print(f"\nFor {dataset_name}, sample count: {summary['sample_count']}")
+    print(f"For {dataset_name}, vocab size is: {len(summary['vocab'])}")
+    print(f"For {dataset_name}, total {sum(summary['duration']) / 3600:.2f} hours")
     if "ZH" in langs:
-        print(f"Bad zh transcription case: {total_bad_case_zh}")
+        print(f"Bad zh transcription case: {summary['stats'].get('bad_case_zh', 0)}")
     if "EN" in langs:
-        print(f"Bad en transcription case: {total_bad_case_en}\n")
+        print(f"Bad en transcription case: {summary['stats'].get('bad_case_en', 0)}\n")
 
 
 if __name__ == "__main__":
     max_workers = 32
+    shard_size = 1  # audio dirs per shard, each dir being a jsonl of thousands of samples
 
     tokenizer = "pinyin"  # "pinyin" | "char"
     polyphone = True
@@ -4,19 +4,16 @@ import sys
 
 sys.path.append(os.getcwd())
 
-import json
-from concurrent.futures import ProcessPoolExecutor
 from importlib.resources import files
 from pathlib import Path
 
 import soundfile as sf
-from datasets.arrow_writer import ArrowWriter
-from tqdm import tqdm
+
+from f5_tts.train.datasets.prepare_sharded import prepare_sharded
 
 
 def deal_with_audio_dir(audio_dir):
-    sub_result, durations = [], []
-    vocab_set = set()
+    sub_result = []
     audio_lists = list(audio_dir.rglob("*.wav"))
 
     for line in audio_lists:
@@ -26,60 +23,26 @@ def deal_with_audio_dir(audio_dir):
         if duration < 0.4 or duration > 30:
             continue
         sub_result.append({"audio_path": str(line), "text": text, "duration": duration})
-        durations.append(duration)
-        vocab_set.update(list(text))
-    return sub_result, durations, vocab_set
+    return sub_result
 
 
 def main():
-    result = []
-    duration_list = []
-    text_vocab_set = set()
+    audio_dirs = []
+    for subset in SUB_SET:
+        dataset_path = Path(os.path.join(dataset_dir, subset))
+        audio_dirs.extend(sorted(audio_dir for audio_dir in dataset_path.iterdir() if audio_dir.is_dir()))
 
-    # process raw data
-    executor = ProcessPoolExecutor(max_workers=max_workers)
-    futures = []
+    # process raw data in shards, re-running resumes from the shards already saved
+    summary = prepare_sharded(audio_dirs, deal_with_audio_dir, save_dir, shard_size=shard_size, num_workers=max_workers)
 
-    for subset in tqdm(SUB_SET):
-        dataset_path = Path(os.path.join(dataset_dir, subset))
-        [
-            futures.append(executor.submit(deal_with_audio_dir, audio_dir))
-            for audio_dir in dataset_path.iterdir()
-            if audio_dir.is_dir()
-        ]
-    for future in tqdm(futures, total=len(futures)):
-        sub_result, durations, vocab_set = future.result()
-        result.extend(sub_result)
-        duration_list.extend(durations)
-        text_vocab_set.update(vocab_set)
-    executor.shutdown()
-
-    # save preprocessed dataset to disk
-    if not os.path.exists(f"{save_dir}"):
-        os.makedirs(f"{save_dir}")
-    print(f"\nSaving to {save_dir} ...")
-
-    with ArrowWriter(path=f"{save_dir}/raw.arrow") as writer:
-        for line in tqdm(result, desc="Writing to raw.arrow ..."):
-            writer.write(line)
-        writer.finalize()
-
-    # dup a json separately saving duration in case for DynamicBatchSampler ease
-    with open(f"{save_dir}/duration.json", "w", encoding="utf-8") as f:
-        json.dump({"duration": duration_list}, f, ensure_ascii=False)
-
-    # vocab map, i.e. tokenizer
-    with open(f"{save_dir}/vocab.txt", "w") as f:
-        for vocab in sorted(text_vocab_set):
-            f.write(vocab + "\n")
-
-    print(f"\nFor {dataset_name}, sample count: {len(result)}")
-    print(f"For {dataset_name}, vocab size is: {len(text_vocab_set)}")
-    print(f"For {dataset_name}, total {sum(duration_list) / 3600:.2f} hours")
+    print(f"\nFor {dataset_name}, sample count: {summary['sample_count']}")
+    print(f"For {dataset_name}, vocab size is: {len(summary['vocab'])}")
+    print(f"For {dataset_name}, total {sum(summary['duration']) / 3600:.2f} hours")
 
 
 if __name__ == "__main__":
     max_workers = 36
+    shard_size = 8  # speaker dirs per shard
 
     tokenizer = "char"  # "pinyin" | "char"
 
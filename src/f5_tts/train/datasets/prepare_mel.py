@@ -0,0 +1,138 @@
+"""Example Usage
+python src/f5_tts/train/datasets/prepare_mel.py data/Emilia_ZH_EN_pinyin --config F5TTS_v1_Base --batch_size 64
+"""
+
+# Offline mel extraction for a prepared dataset (raw.arrow or shards), read back by MemmapMelDataset
+# with `audio_type: memmap_mel`, so that training workers no longer decode audio nor run the STFT every epoch.
+# Audio is decoded and resampled by DataLoader workers, and mels of whole batches are computed on GPU if available.
+# Output in <data_dir>/mel: mel.bin (float16), index.npy (offset, frames per sample) and meta.json.
+
+import os
+import sys
+
+
+sys.path.append(os.getcwd())
+
+import argparse
+import json
+from importlib.resources import files
+
+import numpy as np
+import torch
+import torchaudio
+from omegaconf import OmegaConf
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from f5_tts.model.dataset import load_raw_dataset
+from f5_tts.model.modules import MelSpec
+
+
+class AudioDataset(Dataset):
+    def __init__(self, raw_dataset, indices, target_sample_rate):
+        self.data = raw_dataset
+        self.indices = indices
+        self.target_sample_rate = target_sample_rate
+        self.resamplers = {}
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        index = self.indices[i]
+        audio, source_sample_rate = torchaudio.load(self.data[index]["audio_path"])
+
+        # make sure mono input
+        if audio.shape[0] > 1:
+            audio = torch.mean(audio, dim=0, keepdim=True)
+
+        # resample if necessary
+        if source_sample_rate != self.target_sample_rate:
+            if source_sample_rate not in self.resamplers:
+                self.resamplers[source_sample_rate] = torchaudio.transforms.Resample(
+                    source_sample_rate, self.target_sample_rate
+                )
+            audio = self.resamplers[source_sample_rate](audio)
+
+        return index, audio.squeeze(0)
+
+
+def collate_audio(batch):
+    indices = [index for index, _ in batch]
+    lengths = [len(audio) for _, audio in batch]
+    audio = torch.zeros(len(batch), max(lengths))
+    for i, (_, wav) in enumerate(batch):
+        audio[i, : len(wav)] = wav
+    return indices, audio, lengths
+
+
+def mel_frame_len(num_samples, n_fft, hop_length, mel_spec_type):
+    """Frames of the mel of num_samples audio samples, as computed by MelSpec without batch padding."""
+    if mel_spec_type == "vocos":  # centered stft
+        return num_samples // hop_length + 1
+    # bigvgan, reflect padded by (n_fft - hop_length) // 2 on both sides
+    return (num_samples + 2 * ((n_fft - hop_length) // 2) - n_fft) // hop_length + 1
+
+
+@torch.inference_mode()
+def main():
+    parser = argparse.ArgumentParser(description="Precompute mels of a prepared dataset into a memory-mapped store.")
+    parser.add_argument("data_dir", type=str, help="Prepared dataset dir, with raw.arrow or shards.json")
+    parser.add_argument("--config", type=str, default="F5TTS_v1_Base", help="Model config to take mel settings from")
+    parser.add_argument("--out_dir", type=str, default=None, help="Default to <data_dir>/mel")
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--num_workers", type=int, default=8, help="Workers decoding and resampling audio")
+    parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    mel_cfg = OmegaConf.to_container(
+        OmegaConf.load(str(files("f5_tts").joinpath(f"configs/{args.config}.yaml"))).model.mel_spec
+    )
+    mel_spectrogram = MelSpec(**mel_cfg).to(args.device)
+    n_mel_channels = mel_cfg["n_mel_channels"]
+    out_dir = args.out_dir or os.path.join(args.data_dir, "mel")
+    os.makedirs(out_dir, exist_ok=True)
+
+    raw_dataset = load_raw_dataset(args.data_dir)
+    with open(os.path.join(args.data_dir, "duration.json"), "r", encoding="utf-8") as f:
+        durations = np.asarray(json.load(f)["duration"])
+
+    # samples filtered out in training are not extracted (0 frames), the rest sorted by length for little padding
+    valid = np.nonzero((durations >= 0.3) & (durations <= 30))[0]
+    indices = valid[np.argsort(durations[valid], kind="stable")].tolist()
+    loader = DataLoader(
+        AudioDataset(raw_dataset, indices, mel_cfg["target_sample_rate"]),
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        collate_fn=collate_audio,
+        pin_memory=args.device.startswith("cuda"),
+    )
+
+    index = np.zeros((len(durations), 2), dtype=np.int64)  # offset, frames
+    offset = 0
+    mel_path = os.path.join(out_dir, "mel.bin")
+    with open(f"{mel_path}.tmp", "wb") as f:
+        for batch_indices, audio, lengths in tqdm(loader, desc=f"Extracting mels to {out_dir}"):
+            mel = mel_spectrogram(audio.to(args.device, non_blocking=True))  # b d t
+            frames = [
+                min(mel_frame_len(n, mel_cfg["n_fft"], mel_cfg["hop_length"], mel_cfg["mel_spec_type"]), mel.shape[-1])
+                for n in lengths
+            ]
+            # one device to host copy per batch, each mel a contiguous (d, frames) block
+            flat = torch.cat([mel[i, :, :n].reshape(-1) for i, n in enumerate(frames)]).half().cpu().numpy()
+            f.write(flat.tobytes())
+            for sample_index, n in zip(batch_indices, frames):
+                index[sample_index] = (offset, n)
+                offset += n_mel_channels * n
+
+    np.save(os.path.join(out_dir, "index.npy"), index)
+    with open(os.path.join(out_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(dict(**mel_cfg, dtype="float16", sample_count=len(durations)), f, indent=2)
+    os.replace(f"{mel_path}.tmp", mel_path)  # last, the store is complete once mel.bin exists
+
+    print(f"\nExtracted {len(indices)} mels, {offset * 2 / 1024**3:.2f} GB, saved to {out_dir}")
+    print(f"Skipped {len(durations) - len(indices)} samples out of the 0.3 - 30 s duration range")
+
+
+if __name__ == "__main__":
+    main()
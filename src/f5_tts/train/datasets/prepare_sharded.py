@@ -0,0 +1,152 @@
+# Sharded, resumable dataset preparation shared by the prepare_* scripts
+
+# The manifest (any list of picklable items, e.g. audio dirs, (audio_path, text) pairs, json files) is cut into
+# shards of `shard_size` items. Each shard is processed in a worker process and written to its own Arrow file
+# under <save_dir>/shards/, followed by a small json marking it as done. Re-running skips done shards, so a job
+# killed at 90% only redoes the shards that were in flight. Once all shards are done, the merged index
+# (shards.json), duration.json and vocab.txt are written, which load_dataset reads in place of a single raw.arrow.
+
+import csv
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from datasets.arrow_writer import ArrowWriter
+from tqdm import tqdm
+
+
+def read_manifest(path, delimiter="|"):
+    """Items of a jsonl (one dict per line) or csv-like (dict per row, keyed by its header) manifest."""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return list(csv.DictReader(f, delimiter=delimiter))
+
+
+def manifest_fingerprint(manifest, shard_size):
+    digest = hashlib.md5(str(shard_size).encode())
+    for item in manifest:
+        digest.update(repr(item).encode())
+    return digest.hexdigest()
+
+
+def shard_name(index):
+    return f"raw-{index:05d}"
+
+
+def write_json(path, obj):
+    # write then rename, so that a killed job never leaves a truncated file behind
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(f"{path}.tmp", path)
+
+
+def prepare_shard(process_fn, items, shard_path):
+    """
+    Process the items of one shard, write their samples to <shard_path>.arrow and the shard info to <shard_path>.json
+
+    process_fn(item) returns a list of {"audio_path", "text", "duration"} samples, or (samples, stats) with stats a
+    dict of counters (e.g. filtered cases) which are summed over the dataset.
+    """
+    samples, stats = [], {}
+    for item in items:
+        result = process_fn(item)
+        if isinstance(result, tuple):
+            result, item_stats = result
+            for key, value in item_stats.items():
+                stats[key] = stats.get(key, 0) + value
+        samples.extend(result or [])
+
+    if samples:
+        with ArrowWriter(path=f"{shard_path}.arrow.tmp") as writer:
+            for sample in samples:
+                writer.write(sample)
+            writer.finalize()
+        os.replace(f"{shard_path}.arrow.tmp", f"{shard_path}.arrow")
+
+    vocab_set = set()
+    for sample in samples:
+        vocab_set.update(sample["text"])
+    info = {
+        "sample_count": len(samples),
+        "duration": [sample["duration"] for sample in samples],
+        "vocab": sorted(vocab_set),
+        "stats": stats,
+    }
+    write_json(f"{shard_path}.json", info)  # done marker, written last
+    return info
+
+
+def prepare_sharded(manifest, process_fn, save_dir, shard_size=1000, num_workers=None, desc="Preparing shards"):
+    """
+    Prepare a dataset from manifest items into sharded Arrow files under save_dir, resuming from done shards.
+
+    Writes <save_dir>/shards/raw-*.arrow, and once all of them are done, the merged shards.json, duration.json and
+    vocab.txt. Returns a dict with sample_count, duration (list, in dataset order), vocab (set) and summed stats.
+    """
+    manifest = list(manifest)
+    shard_dir = os.path.join(save_dir, "shards")
+    os.makedirs(shard_dir, exist_ok=True)
+
+    # the same shards may only be resumed for the same manifest
+    progress = {
+        "item_count": len(manifest),
+        "shard_size": shard_size,
+        "fingerprint": manifest_fingerprint(manifest, shard_size),
+    }
+    progress_path = os.path.join(shard_dir, "progress.json")
+    if os.path.exists(progress_path):
+        with open(progress_path, "r", encoding="utf-8") as f:
+            previous = json.load(f)
+        if previous != progress:
+            raise ValueError(
+                f"{shard_dir} was prepared from another manifest or shard size ({previous}), "
+                "remove it or use another save_dir"
+            )
+    else:
+        write_json(progress_path, progress)
+
+    shard_count = (len(manifest) + shard_size - 1) // shard_size
+    shard_paths = [os.path.join(shard_dir, shard_name(i)) for i in range(shard_count)]
+    pending = [i for i in range(shard_count) if not os.path.exists(f"{shard_paths[i]}.json")]
+    if len(pending) < shard_count:
+        print(f"Resuming, {shard_count - len(pending)}/{shard_count} shards already done")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(
+                    prepare_shard, process_fn, manifest[i * shard_size : (i + 1) * shard_size], shard_paths[i]
+                ): i
+                for i in pending
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                try:
+                    future.result()
+                except Exception:
+                    print(f"Failed on shard {shard_name(futures[future])}, done shards are kept for a re-run")
+                    raise
+
+    # merge, in manifest order
+    shards, sample_counts, duration_list, text_vocab_set, stats = [], [], [], set(), {}
+    for path in shard_paths:
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info["sample_count"]:
+            shards.append(os.path.relpath(f"{path}.arrow", save_dir))
+            sample_counts.append(info["sample_count"])
+        duration_list.extend(info["duration"])
+        text_vocab_set.update(info["vocab"])
+        for key, value in info["stats"].items():
+            stats[key] = stats.get(key, 0) + value
+
+    write_json(os.path.join(save_dir, "shards.json"), {"shards": shards, "sample_count": sample_counts})
+    # dup a json separately saving duration in case for DynamicBatchSampler ease
+    write_json(os.path.join(save_dir, "duration.json"), {"duration": duration_list})
+    # vocab map, i.e. tokenizer
+    with open(os.path.join(save_dir, "vocab.txt"), "w") as f:
+        for vocab in sorted(text_vocab_set):
+            f.write(vocab + "\n")
+
+    return dict(sample_count=len(duration_list), duration=duration_list, vocab=text_vocab_set, stats=stats)
@@ -3,14 +3,14 @@ import ujson as json
 from pathlib import Path
 from importlib.resources import files
 
-from p_tqdm import p_imap
-from datasets.arrow_writer import ArrowWriter
 from f5_tts.model.utils import convert_char_to_pinyin, repetition_found
+from f5_tts.train.datasets.prepare_sharded import prepare_sharded
 
 # ————————————————————————————
 # Configuration
 # ————————————————————————————
 MAX_WORKERS  = 128
+SHARD_SIZE   = 10000         # json files per shard, re-runs skip the shards already saved
 TOKENIZER    = "pinyin"      # or "char"
 POLYPHONE    = True
 LANGS        = ["TH", "EN", "ZH"]
@@ -61,9 +61,8 @@ def process_json_file(task):
     """
     lang, json_path = task
 
-    bad_zh = bad_en = bad_th = 0
-    samples, durations, vocab = [], [], set()
-    errors = []
+    bad_zh = bad_en = bad_th = errors = 0
+    samples = []
 
     try:
         obj = json.load(json_path.open("r", encoding="utf-8"))
@@ -78,7 +77,7 @@ def process_json_file(task):
                 or repetition_found(text)
             ):
                 bad_zh += 1
-                return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+                return samples, {"ZH": bad_zh}
             text = text.translate(TRANSLATOR)
 
         elif lang == "EN":
@@ -88,7 +87,7 @@ def process_json_file(task):
                 or repetition_found(text, length=4)
             ):
                 bad_en += 1
-                return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+                return samples, {"EN": bad_en}
 
         # —— NORMALIZE & TOKENIZE ——
         dur = obj["duration"]
@@ -110,8 +109,6 @@ def process_json_file(task):
             "text":       text,
             "duration":   dur
         })
-        durations.append(dur)
-        vocab.update(text)
 
         # —— TH: also emit the “phone” transcript ——
         if lang == "TH":
@@ -125,13 +122,11 @@ def process_json_file(task):
                 "text":       phone,
                 "duration":   dur
             })
-            durations.append(dur)
-            vocab.update(phone)
 
-    except Exception as e:
-        errors.append(str(json_path))
+    except Exception:
+        errors += 1
 
-    return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+    return samples, {"ZH": bad_zh, "EN": bad_en, "TH": bad_th, "errors": errors}
 
 
 def main():
@@ -143,54 +138,27 @@ def main():
             "EN": BASE / "en" / "emilia" / "wavs",
             "TH": BASE / "th" / "gigaspeech2" / "wavs",
         }[lang]
-        for j in folder.glob("*.json"):
-            tasks.append((lang, j))
+        tasks.extend(sorted((lang, j) for j in folder.glob("*.json")))  # sorted, so that re-runs make the same shards
 
-    # 2) process in parallel, streaming results with p_imap
-    results = p_imap(
-        process_json_file,
+    # 2) process in shards, each saved to SAVE_DIR/shards as it is done,
+    #    then merged into shards.json, duration.json and vocab.txt
+    result = prepare_sharded(
         tasks,
-        num_cpus=MAX_WORKERS,
+        process_json_file,
+        str(SAVE_DIR),
+        shard_size=SHARD_SIZE,
+        num_workers=MAX_WORKERS,
         desc="Shard→samples"
     )
+    stats = result["stats"]
 
-    # 3) open an ArrowWriter and fold in all samples
-    writer        = ArrowWriter(path=str(SAVE_DIR / "raw.arrow"))
-    all_durations = []
-    all_vocab     = set()
-    tot_bad_zh = tot_bad_en = tot_bad_th = 0
-    tot_errors = []
-
-    for samples, durs, vocab, bzh, ben, bth, errors in results:
-        for s in samples:
-            writer.write(s)
-        all_durations.extend(durs)
-        all_vocab.update(vocab)
-        tot_bad_zh += bzh
-        tot_bad_en += ben
-        tot_bad_th += bth
-        tot_errors += errors
-
-    writer.close()
-
-    # 4) ancillary files
-    (SAVE_DIR / "duration.json").write_text(
-        json.dumps({"duration": all_durations}, ensure_ascii=False),
-        encoding="utf-8"
-    )
-    (SAVE_DIR / "vocab.txt").write_text(
-        "\n".join(sorted(all_vocab)), encoding="utf-8"
-    )
-
-    # 5) summary
-    hours = sum(all_durations) / 3600
+    # 3) summary
+    hours = sum(result["duration"]) / 3600
     print(f"\n=== {DATASET_NAME} summary ===")
-    print(f"vocab size: {len(all_vocab)}")
+    print(f"vocab size: {len(result['vocab'])}")
     print(f"total hours: {hours:.2f}")
-    print(f"bad ZH: {tot_bad_zh}, bad EN: {tot_bad_en}, bad TH: {tot_bad_th}")
-    print(f"Error JSON: {len(tot_errors)}")
-    # for err in tot_errors:
-    #     print(f"  : {err}")
+    print(f"bad ZH: {stats.get('ZH', 0)}, bad EN: {stats.get('EN', 0)}, bad TH: {stats.get('TH', 0)}")
+    print(f"Error JSON: {stats.get('errors', 0)}")
 
 
 if __name__ == "__main__":
@@ -2,14 +2,14 @@
 
 import ujson as json
 from pathlib import Path
-from p_tqdm import p_imap      # note: p_imap yields as it goes
-from datasets.arrow_writer import ArrowWriter
 from f5_tts.model.utils import convert_char_to_pinyin, repetition_found
+from f5_tts.train.datasets.prepare_sharded import prepare_sharded
 
 # ————————————————————————————
 # Configuration (tweak these paths as needed)
 # ————————————————————————————
 MAX_WORKERS  = 128
+SHARD_SIZE   = 10000           # json files per shard, re-runs skip the shards already saved
 TOKENIZER    = "pinyin"
 POLYPHONE    = True
 LANG         = "EN"
@@ -59,8 +59,8 @@ def process_json_file(task):
     lang, json_path = task
 
     bad_zh = bad_en = bad_th = 0
-    samples, durations, vocab = [], [], set()
-    errors = []
+    samples = []
+    errors = 0
 
     try:
         obj = json.load(json_path.open("r", encoding="utf-8"))
@@ -75,7 +75,7 @@ def process_json_file(task):
                 or repetition_found(text)
             ):
                 bad_zh += 1
-                return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+                return samples, {"ZH": bad_zh, "EN": bad_en, "TH": bad_th, "errors": errors}
             text = text.translate(TRANSLATOR)
 
         elif lang == "EN":
@@ -85,7 +85,7 @@ def process_json_file(task):
                 or repetition_found(text, length=4)
             ):
                 bad_en += 1
-                return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+                return samples, {"ZH": bad_zh, "EN": bad_en, "TH": bad_th, "errors": errors}
 
         # —— NORMALIZE & TOKENIZE ——
         dur = obj["duration"]
@@ -107,8 +107,6 @@ def process_json_file(task):
             "text":       text,
             "duration":   dur
         })
-        durations.append(dur)
-        vocab.update(text)
 
         # —— TH: also emit the “phone” transcript ——
         if lang == "TH":
@@ -122,13 +120,11 @@ def process_json_file(task):
                 "text":       phone,
                 "duration":   dur
             })
-            durations.append(dur)
-            vocab.update(phone)
 
     except Exception:
-        errors.append(str(json_path))
+        errors += 1
 
-    return samples, durations, vocab, bad_zh, bad_en, bad_th, errors
+    return samples, {"ZH": bad_zh, "EN": bad_en, "TH": bad_th, "errors": errors}
 
 
 def main():
@@ -138,54 +134,29 @@ def main():
       "EN": BASE / "en" / "emilia" / "wavs",
       "TH": BASE / "th" / "gigaspeech2" / "wavs",
     }[LANG]
-    tasks = [(LANG, p) for p in folder.glob("*.json")]
+    tasks = sorted((LANG, p) for p in folder.glob("*.json"))  # sorted, so that re-runs make the same shards
 
-    # 2) open writer
-    writer = ArrowWriter(path=str(SAVE_DIR/"raw.arrow"))
-
-    # 3) stream through p_imap results
-    total_dur = 0.0
-    all_durations = []  # collect each sample’s duration
-    vocab = set()
-    bad_counts = {"ZH": 0, "EN": 0, "TH": 0}
-    errors = []
-
-    # p_imap yields (samples, durs, vocab_set, bad_zh, bad_en, bad_th, errs)
-    for samples, durs, vset, bzh, ben, bth, errs in p_imap(
-        process_json_file,
+    # 2) process in shards, each saved to SAVE_DIR/shards as it is done,
+    #    then merged into shards.json, duration.json and vocab.txt
+    result = prepare_sharded(
         tasks,
-        num_cpus=MAX_WORKERS,
-        desc=f"{LANG}→samples"
-    ):
-        for s in samples:
-            writer.write(s)
-        total_dur += sum(durs)
-        all_durations.extend(durs)  # record individual durations
-        vocab |= vset
-        bad_counts["ZH"] += bzh
-        bad_counts["EN"] += ben
-        bad_counts["TH"] += bth
-        errors.extend(errs)
-
-    writer.close()
-
-    # 4) write out every individual duration
-    (SAVE_DIR / "duration.json").write_text(
-        json.dumps({"duration": all_durations}, ensure_ascii=False),
-        encoding="utf-8"
+        process_json_file,
+        str(SAVE_DIR),
+        shard_size=SHARD_SIZE,
+        num_workers=MAX_WORKERS,
+        desc=f"{LANG}→shards"
     )
+    stats = result["stats"]
 
-    # 5) write ancillary per-language files
+    # 3) write ancillary per-language files
     summary = {
       "language": LANG,
-      "hours": total_dur / 3600,
-      "vocab_size": len(vocab),
-      "bad_counts": bad_counts,
-      "errors": len(errors)
+      "hours": sum(result["duration"]) / 3600,
+      "vocab_size": len(result["vocab"]),
+      "bad_counts": {lang: stats.get(lang, 0) for lang in ("ZH", "EN", "TH")},
+      "errors": stats.get("errors", 0)
     }
     json.dump(summary, open(SAVE_DIR/"summary.json", "w"), ensure_ascii=False, indent=2)
-    with open(SAVE_DIR/"vocab.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(sorted(vocab)))
 
 
 if __name__ == "__main__":
@@ -16,12 +16,15 @@ LANGS = [
 tables = []
 for lang in LANGS:
     shard_dir = SAVE_BASE / f"custom_{lang}_pinyin"
-    path      = shard_dir / "raw.arrow"
-    print("Reading:", path)
-    with path.open("rb") as f:
-        # use the streaming reader
-        reader = ipc.open_stream(f)
-        tables.append(reader.read_all())
+    # sharded output of process_language.py, listed in order in shards.json
+    shards    = json.load((shard_dir / "shards.json").open(encoding="utf-8"))["shards"]
+    for shard in shards:
+        path = shard_dir / shard
+        print("Reading:", path)
+        with path.open("rb") as f:
+            # use the streaming reader
+            reader = ipc.open_stream(f)
+            tables.append(reader.read_all())
 
 # concatenate
 combined = pa.concat_tables(tables)
@@ -34,6 +37,14 @@ out_path = out_dir / "raw.arrow"
 with ipc.new_file(out_path, combined.schema) as writer:
     writer.write_table(combined)
 
+# durations, in the same order as the rows
+durations = []
+for lang in LANGS:
+    duration_path = SAVE_BASE / f"custom_{lang}_pinyin" / "duration.json"
+    durations += json.load(duration_path.open(encoding="utf-8"))["duration"]
+with (out_dir / "duration.json").open("w", encoding="utf-8") as f:
+    json.dump({"duration": durations}, f, ensure_ascii=False)
+
 # 2) merge vocab...
 master_vocab = set()
 for lang in LANGS:
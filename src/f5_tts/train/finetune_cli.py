@@ -31,6 +31,13 @@ def parse_args():
         help="Experiment name",
     )
     parser.add_argument("--dataset_name", type=str, default="Emilia_ZH_EN", help="Name of the dataset to use")
+    parser.add_argument(
+        "--audio_type",
+        type=str,
+        default="raw",
+        choices=["raw", "memmap_mel"],
+        help="Extract mels on the fly, or read those precomputed with prepare_mel.py",
+    )
     parser.add_argument("--learning_rate", type=float, default=1e-5, help="Learning rate for training")
     parser.add_argument("--batch_size_per_gpu", type=int, default=3200, help="Batch size per GPU")
     parser.add_argument(
@@ -202,7 +209,9 @@ def main():
         bnb_optimizer=args.bnb_optimizer,
     )
 
-    train_dataset = load_dataset(args.dataset_name, tokenizer, mel_spec_kwargs=mel_spec_kwargs)
+    train_dataset = load_dataset(
+        args.dataset_name, tokenizer, audio_type=args.audio_type, mel_spec_kwargs=mel_spec_kwargs
+    )
 
     trainer.train(
         train_dataset,
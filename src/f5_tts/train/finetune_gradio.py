@@ -23,13 +23,13 @@ import psutil
 import torch
 import torchaudio
 from cached_path import cached_path
-from datasets import Dataset as Dataset_
 from datasets.arrow_writer import ArrowWriter
 from safetensors.torch import load_file, save_file
 from scipy.io import wavfile
 
 from f5_tts.api import F5TTS
 from f5_tts.infer.utils_infer import transcribe
+from f5_tts.model.dataset import load_raw_dataset
 from f5_tts.model.utils import convert_char_to_pinyin
 
 
@@ -323,6 +323,13 @@ def terminate_process(pid):
         terminate_process_tree(pid)
 
 
+def has_raw_dataset(path_project):
+    """Whether the project has prepared data, a single raw.arrow or the shards of prepare_csv_wavs (shards.json)"""
+    return os.path.isfile(os.path.join(path_project, "raw.arrow")) or os.path.isfile(
+        os.path.join(path_project, "shards.json")
+    )
+
+
 def start_training(
     dataset_name,
     exp_name,
@@ -366,9 +373,12 @@ def start_training(
         )
         return
 
-    file_raw = os.path.join(path_project, "raw.arrow")
-    if not os.path.isfile(file_raw):
-        yield f"There is no file {file_raw}", gr.update(interactive=True), gr.update(interactive=False)
+    if not has_raw_dataset(path_project):
+        yield (
+            f"There is no file raw.arrow or shards.json in {path_project}",
+            gr.update(interactive=True),
+            gr.update(interactive=False),
+        )
         return
 
     # Check if a training process is already running
@@ -796,6 +806,11 @@ def create_metadata(name_project, ch_tokenizer, progress=gr.Progress()):
     min_second = round(min(duration_list), 2)
     max_second = round(max(duration_list), 2)
 
+    # drop shards of an earlier prepare_csv_wavs run, load_raw_dataset would prefer them over the new raw.arrow
+    if os.path.isfile(os.path.join(path_project, "shards.json")):
+        os.remove(os.path.join(path_project, "shards.json"))
+    shutil.rmtree(os.path.join(path_project, "shards"), ignore_errors=True)
+
     with ArrowWriter(path=file_raw) as writer:
         for line in progress.tqdm(result, total=len(result), desc="prepare data"):
             writer.write(line)
@@ -1111,10 +1126,9 @@ def vocab_check(project_name, tokenizer_type):
 def get_random_sample_prepare(project_name):
     name_project = project_name
     path_project = os.path.join(path_data, name_project)
-    file_arrow = os.path.join(path_project, "raw.arrow")
-    if not os.path.isfile(file_arrow):
+    if not has_raw_dataset(path_project):
         return "", None
-    dataset = Dataset_.from_file(file_arrow)
+    dataset = load_raw_dataset(path_project)
     random_sample = dataset.shuffle(seed=random.randint(0, 1000)).select([0])
     text = "[" + " , ".join(["' " + t + " '" for t in random_sample["text"][0]]) + "]"
     audio_path = random_sample["audio_path"][0]
@@ -1471,7 +1485,7 @@ Using the extended model, you can finetune to a new language that is missing sym
 
         with gr.TabItem("Prepare Data"):
             gr.Markdown("""```plaintext 
-Skip this step if you have your dataset, raw.arrow, duration.json, and vocab.txt
+Skip this step if you have your dataset, raw.arrow (or shards.json), duration.json, and vocab.txt
 ```""")
 
             gr.Markdown(
@@ -20,6 +20,8 @@ def main(model_cfg):
     model_arc = model_cfg.model.arch
     tokenizer = model_cfg.model.tokenizer
     mel_spec_type = model_cfg.model.mel_spec.mel_spec_type
+    if model_cfg.datasets.get("pack_length") and model_cfg.model.backbone != "DiT":
+        raise ValueError("datasets.pack_length (sequence packing) is only supported by the DiT backbone")
 
     exp_name = f"{model_cfg.model.name}_{mel_spec_type}_{model_cfg.model.tokenizer}_{model_cfg.datasets.name}"
     wandb_resume_id = None
@@ -63,9 +65,16 @@ def main(model_cfg):
         is_local_vocoder=model_cfg.model.vocoder.is_local,
         local_vocoder_path=model_cfg.model.vocoder.local_path,
         model_cfg_dict=OmegaConf.to_container(model_cfg, resolve=True),
+        async_checkpoint=model_cfg.ckpts.get("async_checkpoint", True),
+        pack_length=model_cfg.datasets.get("pack_length", None),
     )
 
-    train_dataset = load_dataset(model_cfg.datasets.name, tokenizer, mel_spec_kwargs=model_cfg.model.mel_spec)
+    train_dataset = load_dataset(
+        model_cfg.datasets.name,
+        tokenizer,
+        audio_type=model_cfg.datasets.get("audio_type", "raw"),  # raw | memmap_mel
+        mel_spec_kwargs=model_cfg.model.mel_spec,
+    )
     trainer.train(
         train_dataset,
         num_workers=model_cfg.datasets.num_workers,
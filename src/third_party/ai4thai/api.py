@@ -1,54 +1,182 @@
 import json
 import os
 import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 from pythainlp.tokenize import word_tokenize, sent_tokenize
 
-Apikey = os.environ['AI4THAI_API']
+Apikey = os.environ.get('AI4THAI_API', '')
 external_g2p = 'https://api.aiforthai.in.th/vaja9/text2phoneme'
 internal_g2p = 'http://10.223.72.14:8623/text2phoneme'
 
+# word -> phoneme cache on disk, shared by processes and kept across restarts, '' to keep it in memory only
+g2p_cache_path = os.environ.get('G2P_CACHE_PATH', os.path.expanduser('~/.cache/ai4thai/g2p.sqlite'))
+# local DeepPhonemizer checkpoint, used for words the G2P service could not convert
+deep_phonemizer_ckpt = os.environ.get('DEEP_PHONEMIZER_CKPT', '')
+
+max_workers = 16  # concurrent requests to the G2P service
+timeout = 10  # seconds per G2P service request
+
+# keep-alive connections, pooled for the concurrent requests
+session = requests.Session()
+session.headers.update({'Apikey': Apikey, 'Content-Type': 'application/json'})
+session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=max_workers))
+session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=max_workers))
+executor = ThreadPoolExecutor(max_workers=max_workers)
+
+
+class PhonemeCache:
+    """Word -> phoneme LRU cache in memory, in front of an sqlite table at `path`."""
+
+    def __init__(self, path=g2p_cache_path, max_items=200_000):
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS phonemes (word TEXT PRIMARY KEY, phoneme TEXT NOT NULL)')
+            self.db.commit()
+
+    def _remember(self, word, phoneme):
+        self.memory[word] = phoneme
+        self.memory.move_to_end(word)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, words):
+        """Cached phonemes of words, as a dict of those found."""
+        found, missing = {}, []
+        with self.lock:
+            for word in words:
+                if word in self.memory:
+                    self.memory.move_to_end(word)
+                    found[word] = self.memory[word]
+                else:
+                    missing.append(word)
+
+            if missing and self.db is not None:
+                for start in range(0, len(missing), 500):  # sqlite bound parameter limit
+                    batch = missing[start:start + 500]
+                    rows = self.db.execute(
+                        f'SELECT word, phoneme FROM phonemes WHERE word IN ({",".join("?" * len(batch))})', batch
+                    ).fetchall()
+                    for word, phoneme in rows:
+                        self._remember(word, phoneme)
+                        found[word] = phoneme
+
+            self.hits += len(found)
+            self.misses += len(words) - len(found)
+        return found
+
+    def put_many(self, phonemes):
+        """Cache a dict of word -> phoneme, in memory and on disk. Empty phonemes are never cached."""
+        phonemes = {word: phoneme for word, phoneme in phonemes.items() if phoneme}
+        with self.lock:
+            for word, phoneme in phonemes.items():
+                self._remember(word, phoneme)
+            if phonemes and self.db is not None:
+                self.db.executemany('INSERT OR REPLACE INTO phonemes VALUES (?, ?)', phonemes.items())
+                self.db.commit()
+
+    def stats(self):
+        return dict(size=len(self.memory), hits=self.hits, misses=self.misses)
+
+
+cache = PhonemeCache()
+local_phonemizer = None
+local_phonemizer_lock = threading.Lock()
+
 
 def g2p_api(text, url_g2p=internal_g2p):
-    phoneme = None
-    response = requests.post(
-        url_g2p,
-        json={'text': text},
-        headers={
-            'Apikey': Apikey,
-            'Content-Type': 'application/json'
-        }
+    """Phonemes of text from the G2P service (syllables separated by spaces), None if it is unavailable."""
+    try:
+        response = session.post(url_g2p, json={'text': text}, timeout=timeout)
+        result = response.json()
+    except (requests.RequestException, ValueError):
+        return None
+    if result.get('status') == 'success':
+        return result['ta_data']['phoneme']
+    return None
+
+
+def g2p_local(words):
+    """Phonemes of words from the local DeepPhonemizer, '' for all of them if no checkpoint is configured."""
+    global local_phonemizer
+    if not deep_phonemizer_ckpt:
+        return {word: '' for word in words}
+    with local_phonemizer_lock:
+        if local_phonemizer is None:
+            from third_party.deep_phonemizer.phonemizer import Phonemizer
+            local_phonemizer = Phonemizer.from_checkpoint(deep_phonemizer_ckpt)
+        return dict(zip(words, local_phonemizer(list(words), 'th')))
+
+
+def g2p_words(words, url_g2p=internal_g2p):
+    """Phonemes of each distinct word, from the cache, else the G2P service (concurrently), else the local model."""
+    words = list(dict.fromkeys(word for word in words if word.strip()))
+    phonemes = cache.get_many(words)
+
+    missing = [word for word in words if word not in phonemes]
+    if missing:
+        fetched = dict(zip(missing, executor.map(lambda word: g2p_api(word, url_g2p), missing)))
+        fetched = {word: phoneme for word, phoneme in fetched.items() if phoneme is not None}
+        cache.put_many(fetched)
+        phonemes.update(fetched)
+
+        failed = [word for word in missing if word not in fetched]
+        if failed:
+            # not cached, the service is asked again next time and its result is preferred once it is back
+            phonemes.update(g2p_local(failed))
+    return phonemes
+
+
+def g2p_batch(texts, lang='th', token_sep='-', punctuation=".", verbose=False, url_g2p=internal_g2p):
+    """g2p of several texts, with the distinct words of all their sentences looked up in one go."""
+    tokenized = []
+    for text in texts:
+        # chunking into sentences
+        sentences = sent_tokenize(text, engine="crfcut")
+        tokenized.append([
+            (sentence, word_tokenize(re.sub(r'\s+', ' ', sentence.strip()), engine="attacut"))
+            for sentence in sentences
+        ])
+    phonemes = g2p_words(
+        [t for sentences in tokenized for _, tokens in sentences for t in tokens if not t.isspace()], url_g2p
     )
-    if (response.json()['status'] == 'success'):
-        phoneme = response.json()['ta_data']['phoneme']
-    return phoneme
-
-
-def g2p(text, lang='th', token_sep='-', punctuation=".", verbose=False):
-    # chunking into sentences
-    sentences = sent_tokenize(text, engine="crfcut")
-    results = {}
-    for index, sentence in enumerate(sentences):
-        tokens = word_tokenize(re.sub(r'\s+', ' ', sentence.strip()), engine="attacut")
-
-        tokens_ph_ = g2p_api(sentence)
-        if tokens_ph_ is None:
-            tokens_ph_ = ["" for t in tokens]
-        tokens_ph = [
-            token_sep.join(tokens_ph_.split(" "))
-            if not t.isspace() else ""
-            for t in tokens
-        ]
-        results[index] = {
-            "sentence": sentence,
-            "sentence_ph": f"{' '.join(tokens_ph).replace('  ', ' ')}{punctuation}",
-            "tokens": [[t, ph] for t, ph in zip(tokens, tokens_ph)],
-            # "tokens_ph": ,
-        }
-    if verbose:
-        print(json.dumps(results, ensure_ascii=False, indent=2))
-    return " ".join([value["sentence_ph"] for key, value in results.items()])
+
+    outputs = []
+    for sentences in tokenized:
+        results = {}
+        for index, (sentence, tokens) in enumerate(sentences):
+            tokens_ph = [
+                token_sep.join(phonemes.get(t, '').split(" "))
+                if not t.isspace() else ""
+                for t in tokens
+            ]
+            results[index] = {
+                "sentence": sentence,
+                "sentence_ph": f"{' '.join(tokens_ph).replace('  ', ' ')}{punctuation}",
+                "tokens": [[t, ph] for t, ph in zip(tokens, tokens_ph)],
+            }
+        if verbose:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        outputs.append(" ".join([value["sentence_ph"] for key, value in results.items()]))
+    return outputs
+
+
+def g2p(text, lang='th', token_sep='-', punctuation=".", verbose=False, url_g2p=internal_g2p):
+    return g2p_batch([text], lang, token_sep, punctuation, verbose, url_g2p)[0]
 
 
 if __name__ == "__main__":
@@ -56,3 +184,4 @@ if __name__ == "__main__":
     tokens_phoneme = g2p(text, verbose=False)
     print("input:\n", text)
     print("output:\n", tokens_phoneme)
+    print("cache:\n", cache.stats())
@@ -0,0 +1,159 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple, Union
+
+
+class Lexicon:
+    """
+    Bounded, thread-safe word-phoneme lexicon that learns from model predictions.
+
+    Entries are keyed by (lang, word) and hold the phonemes and the confidence of the prediction. The most recently
+    used max_items entries are kept in memory. With a path, all entries are also stored in an sqlite file, which
+    worker processes can share and which is kept across restarts.
+    """
+
+    def __init__(self,
+                 path: Union[str, None] = None,
+                 max_items: int = 1_000_000,
+                 min_confidence: float = 0.) -> None:
+        """
+        Initializes a lexicon.
+
+        Args:
+          path (str, optional): Path of the sqlite file to persist entries to, memory only if None.
+          max_items (int): Max number of entries kept in memory. (Default value = 1_000_000)
+          min_confidence (float): Predictions with lower confidence are not learned. (Default value = 0.)
+        """
+
+        self.max_items = max_items
+        self.min_confidence = min_confidence
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS lexicon (lang TEXT NOT NULL, word TEXT NOT NULL, '
+                            'phonemes TEXT NOT NULL, confidence REAL NOT NULL, PRIMARY KEY (lang, word))')
+            self.db.commit()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _remember(self, key: Tuple[str, str], entry: Tuple[str, float]) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_items:
+            self.entries.popitem(last=False)
+
+    def get_many(self, lang: str, words: Iterable[str]) -> Dict[str, str]:
+        """
+        Looks up words, in memory first, then in the sqlite file.
+
+        Args:
+          lang (str): Language of the words.
+          words (Iterable[str]): Words to look up.
+
+        Returns:
+          Dict[str, str]: Phonemes of the words found.
+        """
+
+        words = list(words)
+        found, missing = {}, []
+        with self.lock:
+            for word in words:
+                entry = self.entries.get((lang, word))
+                if entry is None:
+                    missing.append(word)
+                else:
+                    self.entries.move_to_end((lang, word))
+                    found[word] = entry[0]
+
+            if missing and self.db is not None:
+                for i in range(0, len(missing), 500):  # sqlite bound parameter limit
+                    batch = missing[i:i + 500]
+                    rows = self.db.execute(
+                        f'SELECT word, phonemes, confidence FROM lexicon '
+                        f'WHERE lang = ? AND word IN ({",".join("?" * len(batch))})', [lang] + batch).fetchall()
+                    for word, phonemes, confidence in rows:
+                        self._remember((lang, word), (phonemes, confidence))
+                        found[word] = phonemes
+
+            self.hits += len(found)
+            self.misses += len(words) - len(found)
+        return found
+
+    def put_many(self, lang: str, entries: Dict[str, Tuple[str, float]]) -> None:
+        """
+        Learns (phonemes, confidence) of words, skipping those below min_confidence.
+
+        Args:
+          lang (str): Language of the words.
+          entries (Dict[str, Tuple[str, float]]): Phonemes and confidence of each word.
+        """
+
+        entries = {word: entry for word, entry in entries.items() if entry[1] >= self.min_confidence}
+        if not entries:
+            return
+        with self.lock:
+            for word, entry in entries.items():
+                self._remember((lang, word), entry)
+            if self.db is not None:
+                self.db.executemany('INSERT OR REPLACE INTO lexicon VALUES (?, ?, ?, ?)',
+                                    [(lang, word, phonemes, confidence)
+                                     for word, (phonemes, confidence) in entries.items()])
+                self.db.commit()
+
+    def load(self, dump_path: str) -> int:
+        """
+        Loads a prebuilt dump, a tab separated file of lang, word, phonemes and confidence per line.
+
+        Args:
+          dump_path (str): Path of the dump.
+
+        Returns:
+          int: Number of entries loaded.
+        """
+
+        by_lang = {}
+        with open(dump_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 4:
+                    continue
+                lang, word, phonemes, confidence = parts
+                by_lang.setdefault(lang, {})[word] = (phonemes, float(confidence))
+        for lang, entries in by_lang.items():
+            self.put_many(lang, entries)
+        return sum(len(entries) for entries in by_lang.values())
+
+    def dump(self, dump_path: str) -> int:
+        """
+        Writes all entries (from the sqlite file if persisted, else from memory) in the format read by load().
+
+        Args:
+          dump_path (str): Path of the dump.
+
+        Returns:
+          int: Number of entries written.
+        """
+
+        with self.lock:
+            if self.db is not None:
+                rows = self.db.execute('SELECT lang, word, phonemes, confidence FROM lexicon').fetchall()
+            else:
+                rows = [(lang, word, phonemes, confidence)
+                        for (lang, word), (phonemes, confidence) in self.entries.items()]
+        with open(dump_path, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write('\t'.join(str(value) for value in row) + '\n')
+        return len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(size=len(self.entries), hits=self.hits, misses=self.misses)
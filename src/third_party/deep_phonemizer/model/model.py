@@ -4,6 +4,7 @@ from typing import Tuple, Dict, Any
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.nn import TransformerEncoderLayer, LayerNorm, TransformerEncoder
 
 from third_party.deep_phonemizer.model.utils import get_dedup_tokens, _make_len_mask, _generate_square_subsequent_mask, PositionalEncoding
@@ -260,6 +261,9 @@ class AutoregressiveTransformer(Model):
         """
         Inference pass on a batch of tokenized texts.
 
+        The decoder runs incrementally: each step only embeds the newest token, with the keys / values of past
+        tokens (self-attention) and of the encoder output (cross-attention) cached per layer.
+
         Args:
           batch (Dict[str, torch.Tensor]): Dictionary containing the input to the model with entries 'text'
                                            and 'start_index'
@@ -281,32 +285,36 @@ class AutoregressiveTransformer(Model):
             input = self.pos_encoder(input)
             input = self.transformer.encoder(input,
                                              src_key_padding_mask=src_pad_mask)
+
+            layers = self.transformer.decoder.layers
+            # memory keys / values are fixed, self-attention keys / values grow by one token per step
+            caches = [{'memory': (_project(layer.multihead_attn, input, 1), _project(layer.multihead_attn, input, 2)),
+                       'self': None} for layer in layers]
+            memory_mask = ~src_pad_mask[:, None, None, :]  # shape: [N, 1, 1, S], True where attended
+
             out_indices = start_index.unsqueeze(0)
             out_logits = []
+            finished = torch.zeros(batch_size, dtype=torch.bool, device=input.device)
             for i in range(max_len):
-                tgt_mask = _generate_square_subsequent_mask(i + 1).to(input.device)
-                output = self.decoder(out_indices)
-                output = self.pos_decoder(output)
-                output = self.transformer.decoder(output,
-                                                  input,
-                                                  memory_key_padding_mask=src_pad_mask,
-                                                  tgt_mask=tgt_mask)
-                output = self.fc_out(output)  # shape: [T, N, V]
-                out_tokens = output.argmax(2)[-1:, :]
-                out_logits.append(output[-1:, :, :])
+                output = self.decoder(out_indices[-1:])
+                output = output + self.pos_decoder.scale * self.pos_decoder.pe[i:i + 1]
+                for layer, cache in zip(layers, caches):
+                    output = _decoder_layer_step(layer, output, cache, memory_mask)
+                if self.transformer.decoder.norm is not None:
+                    output = self.transformer.decoder.norm(output)
+                output = self.fc_out(output)  # shape: [1, N, V]
+                out_tokens = output.argmax(2)
+                out_logits.append(output)
 
                 out_indices = torch.cat([out_indices, out_tokens], dim=0)
-                stop_rows, _ = torch.max(out_indices == self.end_index, dim=0)
-                if torch.sum(stop_rows) == batch_size:
+                finished |= out_tokens[0] == self.end_index
+                if bool(finished.all()):
                     break
 
         out_indices = out_indices.transpose(0, 1)  # out shape [N, T]
         out_logits = torch.cat(out_logits, dim=0).transpose(0, 1) # out shape [N, T, V]
-        out_logits = out_logits.softmax(-1)
-        out_probs = torch.ones((out_indices.size(0), out_indices.size(1)))
-        for i in range(out_indices.size(0)):
-            for j in range(0, out_indices.size(1)-1):
-                out_probs[i, j+1] = out_logits[i, j].max()
+        out_probs = torch.ones((out_indices.size(0), out_indices.size(1)), device=out_logits.device)
+        out_probs[:, 1:] = out_logits.softmax(-1).amax(-1)
         return out_indices, out_probs
 
     @classmethod
@@ -334,6 +342,51 @@ class AutoregressiveTransformer(Model):
         )
 
 
+def _project(attn: nn.MultiheadAttention, x: torch.Tensor, part: int) -> torch.Tensor:
+    """Query (0), key (1) or value (2) projection of x [T, N, D] by attn, split into heads [N, H, T, D / H]."""
+    d = attn.embed_dim
+    bias = attn.in_proj_bias[part * d:(part + 1) * d] if attn.in_proj_bias is not None else None
+    x = F.linear(x, attn.in_proj_weight[part * d:(part + 1) * d], bias)
+    return x.view(x.size(0), x.size(1), attn.num_heads, d // attn.num_heads).permute(1, 2, 0, 3)
+
+
+def _attend(attn: nn.MultiheadAttention, x: torch.Tensor, k: torch.Tensor, v: torch.Tensor,
+            mask: torch.Tensor = None) -> torch.Tensor:
+    """Attention of x [1, N, D] to projected keys / values [N, H, S, D / H], returns [1, N, D]."""
+    out = F.scaled_dot_product_attention(_project(attn, x, 0), k, v, attn_mask=mask)
+    out = out.permute(2, 0, 1, 3).reshape(x.size(0), x.size(1), attn.embed_dim)
+    return attn.out_proj(out)
+
+
+def _decoder_layer_step(layer: nn.TransformerDecoderLayer, x: torch.Tensor,
+                        cache: Dict[str, Any], memory_mask: torch.Tensor) -> torch.Tensor:
+    """One incremental step of a decoder layer for the newest token x [1, N, D], equivalent to running the layer
+    on the whole prefix with a causal mask and keeping the last position (in eval mode)."""
+
+    def self_attention(h):
+        k, v = _project(layer.self_attn, h, 1), _project(layer.self_attn, h, 2)
+        if cache['self'] is not None:
+            k, v = torch.cat([cache['self'][0], k], dim=2), torch.cat([cache['self'][1], v], dim=2)
+        cache['self'] = (k, v)
+        return _attend(layer.self_attn, h, k, v)
+
+    def cross_attention(h):
+        return _attend(layer.multihead_attn, h, *cache['memory'], mask=memory_mask)
+
+    def feed_forward(h):
+        return layer.linear2(layer.activation(layer.linear1(h)))
+
+    if layer.norm_first:
+        x = x + self_attention(layer.norm1(x))
+        x = x + cross_attention(layer.norm2(x))
+        x = x + feed_forward(layer.norm3(x))
+    else:
+        x = layer.norm1(x + self_attention(x))
+        x = layer.norm2(x + cross_attention(x))
+        x = layer.norm3(x + feed_forward(x))
+    return x
+
+
 def create_model(model_type: ModelType, config: Dict[str, Any]) -> Model:
     """
     Initializes a model from a config for a given model type.
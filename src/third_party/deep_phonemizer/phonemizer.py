@@ -2,6 +2,7 @@ import re
 from itertools import zip_longest
 from typing import Dict, Union, List, Set
 
+from third_party.deep_phonemizer.lexicon import Lexicon
 from third_party.deep_phonemizer.model.model import load_checkpoint
 from third_party.deep_phonemizer.model.predictor import Predictor
 from third_party.deep_phonemizer.result import PhonemizerResult
@@ -14,17 +15,21 @@ class Phonemizer:
 
     def __init__(self,
                  predictor: Predictor,
-                 lang_phoneme_dict: Dict[str, Dict[str, str]] = None) -> None:
+                 lang_phoneme_dict: Dict[str, Dict[str, str]] = None,
+                 lexicon: Lexicon = None) -> None:
         """
         Initializes a phonemizer with a ready predictor.
 
         Args:
             predictor (Predictor): Predictor object carrying the trained transformer model.
             lang_phoneme_dict (Dict[str, Dict[str, str]], optional): Word-phoneme dictionary for each language.
+            lexicon (Lexicon, optional): Lexicon of past predictions, consulted before the model and fed with
+                                         its predictions.
         """
 
         self.predictor = predictor
         self.lang_phoneme_dict = lang_phoneme_dict
+        self.lexicon = lexicon
 
     def __call__(self,
                  text: Union[str, List[str]],
@@ -49,7 +54,8 @@ class Phonemizer:
         single_input_string = isinstance(text, str)
         texts = [text] if single_input_string else text
         result = self.phonemise_list(texts=texts, lang=lang,
-                                     punctuation=punctuation, expand_acronyms=expand_acronyms)
+                                     punctuation=punctuation, expand_acronyms=expand_acronyms,
+                                     batch_size=batch_size)
 
         phoneme_lists = [''.join(phoneme_list) for phoneme_list in result.phonemes]
 
@@ -118,10 +124,19 @@ class Phonemizer:
         # predict all subwords that are missing in the phoneme dict
         words_to_predict = [word for word, phons in word_phonemes.items()
                             if phons is None and len(word_splits.get(word, [])) <= 1]
+
+        # words predicted before are served by the lexicon, only true OOV words go through the model
+        if self.lexicon is not None and words_to_predict:
+            learned = self.lexicon.get_many(lang, words_to_predict)
+            word_phonemes.update(learned)
+            words_to_predict = [word for word in words_to_predict if word not in learned]
+
         # print(words_to_predict)
         predictions = self.predictor(words=words_to_predict,
                                      lang=lang,
                                      batch_size=batch_size)
+        if self.lexicon is not None:
+            self.lexicon.put_many(lang, {pred.word: (pred.phonemes, pred.confidence) for pred in predictions})
 
         word_phonemes.update({pred.word: pred.phonemes for pred in predictions})
         # print(word_phonemes)
@@ -192,13 +207,15 @@ class Phonemizer:
     def from_checkpoint(cls,
                         checkpoint_path: str,
                         device='cpu',
-                        lang_phoneme_dict: Dict[str, Dict[str, str]] = None) -> 'Phonemizer':
+                        lang_phoneme_dict: Dict[str, Dict[str, str]] = None,
+                        lexicon: Lexicon = None) -> 'Phonemizer':
         """Initializes a Phonemizer object from a model checkpoint (.pt file).
 
         Args:
           checkpoint_path (str): Path to the .pt checkpoint file.
           device (str): Device to send the model to ('cpu' or 'cuda'). (Default value = 'cpu')
           lang_phoneme_dict (Dict[str, Dict[str, str]], optional): Word-phoneme dictionary for each language.
+          lexicon (Lexicon, optional): Lexicon of past predictions, see Phonemizer.__init__.
 
         Returns:
           Phonemizer: Phonemizer object carrying the loaded model and, optionally, a phoneme dictionary.
@@ -216,4 +233,5 @@ class Phonemizer:
         model_step = checkpoint['step']
         logger.debug(f'Initializing phonemizer with model step {model_step}')
         return Phonemizer(predictor=predictor,
-                          lang_phoneme_dict=applied_phoneme_dict)
+                          lang_phoneme_dict=applied_phoneme_dict,
+                          lexicon=lexicon)